@@ -0,0 +1,78 @@
+"""
+Scaling of ConcurrentSaver and RemoteBlobDict with the number of workers and keys.
+
+REMOTOOLS_BENCH_KEYS sets the numbers of keys of the RemoteBlobDict benchmarks (comma separated),
+e.g. REMOTOOLS_BENCH_KEYS=10000,100000,1000000
+"""
+import os
+import pytest
+from remotools.savers import PickleSaver
+from remotools.remote_dict import RemoteBlobDict
+from fakes import DictRemote
+
+KEYS = [int(n) for n in os.environ.get('REMOTOOLS_BENCH_KEYS', '10000').split(',')]
+
+# Round trip of the fake cloud storage (in seconds)
+LATENCY = 0.002
+
+
+@pytest.mark.parametrize('workers', [1, 4, 16, 64])
+def bench_concurrent_save(benchmark, small_payload, workers):
+    saver = PickleSaver(DictRemote(latency=LATENCY))
+    keys = [f'key-{i}' for i in range(256)]
+    objs = [small_payload] * len(keys)
+
+    def run():
+        with saver.concurrent(max_workers=workers) as c:
+            for result in c.iter_save(objs, keys, progress=False):
+                if result.error is not None:
+                    raise result.error
+
+    benchmark.pedantic(run, rounds=3)
+
+
+@pytest.mark.parametrize('workers', [1, 4, 16, 64])
+def bench_concurrent_load(benchmark, small_payload, workers):
+    saver = PickleSaver(DictRemote(latency=LATENCY))
+    keys = [saver.save(small_payload, f'key-{i}', progress=False) for i in range(256)]
+
+    def run():
+        with saver.concurrent(max_workers=workers) as c:
+            for result in c.iter_load(keys, progress=False):
+                if result.error is not None:
+                    raise result.error
+
+    benchmark.pedantic(run, rounds=3)
+
+
+def _filled_dict(remote: DictRemote, n: int) -> RemoteBlobDict:
+    dct = RemoteBlobDict(saver_cls=PickleSaver, remote=remote, prefix='blobs')
+    with dct.parallel(max_workers=32, max_in_flight=1024, progress=False):
+        for i in range(n):
+            dct.save(i, f'key-{i}', progress=False)
+        dct.flush()
+    return dct
+
+
+@pytest.mark.parametrize('n', KEYS)
+def bench_blob_dict_save(benchmark, n):
+    benchmark.pedantic(lambda: _filled_dict(DictRemote(), n), rounds=1)
+
+
+@pytest.mark.parametrize('n', KEYS)
+def bench_blob_dict_commit(benchmark, n):
+    dct = _filled_dict(DictRemote(), n)
+    benchmark.pedantic(lambda: dct.commit(progress=False), rounds=3)
+
+
+@pytest.mark.parametrize('n', KEYS)
+def bench_blob_dict_fetch(benchmark, n):
+    remote = DictRemote()
+    _filled_dict(remote, n).commit(progress=False)
+
+    def fetch():
+        dct = RemoteBlobDict(saver_cls=PickleSaver, remote=remote, prefix='blobs')
+        dct.fetch(progress=False)
+        return dct
+
+    benchmark.pedantic(fetch, rounds=3)
@@ -0,0 +1,44 @@
+"""
+Import time budget.
+
+Every module is imported in a fresh interpreter, and the fastest of several runs must stay within the budget
+(REMOTOOLS_IMPORT_BUDGET_MS, in milliseconds). The heavy optional dependencies must not be imported
+until they are used.
+"""
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+BUDGET_MS = float(os.environ.get('REMOTOOLS_IMPORT_BUDGET_MS', 100))
+RUNS = 5
+
+MODULES = ['remotools.remotes', 'remotools.savers', 'remotools.remote_dict', 'remotools.remote_fs']
+DEFERRED = ['tqdm', 'requests', 'sqlitedict', 'cachetools', 'jsonpickle', 'numpy', 'boto3', 'google.cloud']
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1000, 'modules': sorted(sys.modules)}}))
+"""
+
+
+def _import(module: str) -> dict:
+    output = subprocess.run([sys.executable, '-c', SCRIPT.format(module=module)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize('module', MODULES)
+def bench_import_time(module):
+    ms = min(_import(module)['ms'] for _ in range(RUNS))
+    assert ms <= BUDGET_MS, f'Importing {module} took {ms:.1f}ms (budget: {BUDGET_MS}ms)'
+
+
+@pytest.mark.parametrize('module', MODULES)
+def bench_deferred_dependencies(module):
+    imported = set(_import(module)['modules'])
+    assert not imported.intersection(DEFERRED), f'{module} imports {sorted(imported.intersection(DEFERRED))}'
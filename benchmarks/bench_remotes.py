@@ -0,0 +1,87 @@
+"""
+Transfer throughput and per-request overhead of the remotes.
+"""
+import io
+import pytest
+from remotools.remotes import HFSRemote, CachingRemote
+from remotools.progress import reporting, ProgressSink
+from remotools.utils import compute_hash
+from fakes import DictRemote
+
+
+@pytest.mark.parametrize('size', ['small', 'large'])
+def bench_local_upload(benchmark, local_remote, request, size):
+    payload = request.getfixturevalue(f'{size}_payload')
+    benchmark.extra_info['bytes'] = len(payload)
+    benchmark(lambda: local_remote.upload(io.BytesIO(payload), 'key', progress=False))
+
+
+@pytest.mark.parametrize('size', ['small', 'large'])
+def bench_local_download(benchmark, local_remote, request, size):
+    payload = request.getfixturevalue(f'{size}_payload')
+    local_remote.upload(io.BytesIO(payload), 'key', progress=False)
+    benchmark.extra_info['bytes'] = len(payload)
+    benchmark(lambda: local_remote.download(io.BytesIO(), 'key', progress=False))
+
+
+@pytest.mark.parametrize('size', ['small', 'large'])
+def bench_fake_cloud_roundtrip(benchmark, dict_remote, request, size):
+    """ Upload and download through a dictionary standing in for S3 / GCS """
+    payload = request.getfixturevalue(f'{size}_payload')
+    benchmark.extra_info['bytes'] = len(payload)
+
+    def roundtrip():
+        dict_remote.upload(io.BytesIO(payload), 'key', progress=False)
+        dict_remote.download(io.BytesIO(), 'key', progress=False)
+
+    benchmark(roundtrip)
+
+
+@pytest.mark.parametrize('algorithm', ['md5', 'sha256', 'xxh64'])
+def bench_hfs_hashing(benchmark, large_payload, algorithm):
+    f = io.BytesIO(large_payload)
+    benchmark.extra_info['bytes'] = len(large_payload)
+    benchmark(compute_hash, f, algorithm=algorithm)
+
+
+@pytest.mark.parametrize('size', ['small', 'large'])
+def bench_hfs_upload(benchmark, dict_remote, request, size):
+    payload = request.getfixturevalue(f'{size}_payload')
+    remote = HFSRemote(dict_remote)
+    benchmark.extra_info['bytes'] = len(payload)
+    benchmark(lambda: remote.upload(io.BytesIO(payload), None, progress=False))
+
+
+@pytest.fixture
+def caching_remote() -> CachingRemote:
+    return CachingRemote(DictRemote(latency=0.005), cache=HFSRemote(DictRemote()), keystore={})
+
+
+def bench_caching_hit(benchmark, caching_remote, small_payload):
+    caching_remote.upload(io.BytesIO(small_payload), 'key', progress=False)
+    benchmark(lambda: caching_remote.download(io.BytesIO(), 'key', progress=False))
+
+
+def bench_caching_miss(benchmark, caching_remote, small_payload):
+    caching_remote.remote.upload(io.BytesIO(small_payload), 'key', progress=False)
+
+    # override_cache forces every download to go to the (slow) underlying remote
+    benchmark(lambda: caching_remote.download(io.BytesIO(), 'key', progress=False,
+                                              params=dict(override_cache=True)))
+
+
+@pytest.mark.parametrize('nested', [False, True], ids=['flat', 'nested'])
+@pytest.mark.parametrize('progress', ['off', 'aggregated'])
+def bench_progress_overhead(benchmark, small_payload, nested, progress):
+    """ Per-object overhead of progress reporting on small objects """
+    remote = HFSRemote(DictRemote()) if nested else DictRemote()
+    keys = [f'key-{i}' for i in range(100)]
+
+    def run():
+        for key in keys:
+            key = remote.upload(io.BytesIO(small_payload), key, progress=progress != 'off')
+            remote.download(io.BytesIO(), key, progress=progress != 'off')
+
+    # A sink that does nothing isolates the cost of the reporting machinery
+    with reporting(ProgressSink()):
+        benchmark(run)
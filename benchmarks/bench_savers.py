@@ -0,0 +1,102 @@
+"""
+Encoding and decoding time and peak memory of every saver.
+
+The peak memory (measured with tracemalloc in a separate, untimed run) is reported in the extra_info of
+each benchmark.
+"""
+import io
+import tracemalloc
+import pytest
+from remotools.savers import (PickleSaver, JSONSaver, JSONPickleSaver, YAMLSaver, TextSaver, NumpySaver,
+                              CSVPandasSaver, PILImageSaverPNG, PILImageSaverJPG, TorchSaver, PlyDataSaver)
+from fakes import DictRemote
+
+
+def _records(n=1000):
+    return {f'record-{i}': {'id': i, 'name': f'name-{i}', 'values': list(range(10))} for i in range(n)}
+
+
+def _array():
+    np = pytest.importorskip('numpy')
+    return np.random.rand(1024, 1024).astype('float32')
+
+
+def _frame():
+    pd = pytest.importorskip('pandas')
+    np = pytest.importorskip('numpy')
+    return pd.DataFrame(np.random.rand(100000, 8), columns=[f'c{i}' for i in range(8)])
+
+
+def _image():
+    pytest.importorskip('PIL.Image')
+    np = pytest.importorskip('numpy')
+    return (np.random.rand(1024, 1024, 3) * 255).astype('uint8')
+
+
+def _tensor():
+    torch = pytest.importorskip('torch')
+    return {'weight': torch.rand(1024, 1024), 'bias': torch.rand(1024)}
+
+
+def _ply():
+    plyfile = pytest.importorskip('plyfile')
+    np = pytest.importorskip('numpy')
+    vertices = np.zeros(100000, dtype=[('x', 'f4'), ('y', 'f4'), ('z', 'f4')])
+    return plyfile.PlyData([plyfile.PlyElement.describe(vertices, 'vertex')])
+
+
+CASES = {
+    'pickle': (PickleSaver, _records),
+    'json': (JSONSaver, _records),
+    'jsonpickle': (JSONPickleSaver, _records),
+    'yaml': (YAMLSaver, lambda: _records(100)),
+    'text': (TextSaver, lambda: 'line of text\n' * 100000),
+    'numpy': (NumpySaver, _array),
+    'csvpandas': (CSVPandasSaver, _frame),
+    'png': (PILImageSaverPNG, _image),
+    'jpg': (PILImageSaverJPG, _image),
+    'torch': (TorchSaver, _tensor),
+    'plydata': (PlyDataSaver, _ply),
+}
+
+
+def _peak_memory(fn) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.fixture(params=list(CASES))
+def case(request):
+    saver_cls, make = CASES[request.param]
+    return saver_cls(DictRemote()), make()
+
+
+def bench_encode(benchmark, case):
+    saver, obj = case
+
+    def encode():
+        f = io.BytesIO()
+        saver.encode(obj, f)
+        return f
+
+    benchmark.extra_info['bytes'] = len(encode().getbuffer())
+    benchmark.extra_info['peak_memory'] = _peak_memory(encode)
+    benchmark(encode)
+
+
+def bench_decode(benchmark, case):
+    saver, obj = case
+    f = io.BytesIO()
+    saver.encode(obj, f)
+    data = f.getvalue()
+
+    def decode():
+        return saver.decode(io.BytesIO(data))
+
+    benchmark.extra_info['bytes'] = len(data)
+    benchmark.extra_info['peak_memory'] = _peak_memory(decode)
+    benchmark(decode)
@@ -0,0 +1,38 @@
+"""
+Benchmarks of remotools (requires pytest-benchmark). Run from this directory with remotools installed:
+
+    pytest                                  # everything
+    pytest bench_savers.py -k numpy         # a subset
+    pytest --benchmark-autosave             # store the results, compare later with --benchmark-compare
+
+Network storage (S3, GCS) is stood in by the in-memory remotes in fakes.py, so no connection is needed.
+REMOTOOLS_BENCH_LARGE sets the size in bytes of the 'large' objects (64MiB by default).
+"""
+import os
+import pytest
+from remotools.remotes import LocalRemote
+from fakes import DictRemote
+
+# Object sizes (in bytes) of the 'small' and 'large' transfers
+SMALL = 4 * 2 ** 10
+LARGE = int(os.environ.get('REMOTOOLS_BENCH_LARGE', 64 * 2 ** 20))
+
+
+@pytest.fixture(scope='session')
+def small_payload() -> bytes:
+    return os.urandom(SMALL)
+
+
+@pytest.fixture(scope='session')
+def large_payload() -> bytes:
+    return os.urandom(LARGE)
+
+
+@pytest.fixture
+def local_remote(tmp_path) -> LocalRemote:
+    return LocalRemote(prefix=str(tmp_path / 'local'))
+
+
+@pytest.fixture
+def dict_remote() -> DictRemote:
+    return DictRemote()
@@ -0,0 +1,55 @@
+"""
+Stand-ins for network storage, so that the benchmarks run offline.
+"""
+import time
+from remotools.remotes import BaseRemote, KeyInfo
+from remotools.remotes.exceptions import KeyNotFoundError
+
+
+class DictRemote(BaseRemote):
+    """
+    Stores the objects in a dictionary.
+
+    Objects are transferred in chunks of chunk_size bytes, like a network client would, and every request
+    (download, upload or contains) sleeps for latency seconds to emulate the round trip of S3 or GCS.
+    """
+
+    def __init__(self, latency: float = 0., chunk_size: int = 1024, **kwargs):
+        super(DictRemote, self).__init__(**kwargs)
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.objects = {}
+
+    def _request(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _download(self, f, key: str, **kwargs):
+        self._request()
+        if key not in self.objects:
+            raise KeyNotFoundError(key)
+
+        data = memoryview(self.objects[key])
+        for i in range(0, len(data), self.chunk_size):
+            f.write(data[i: i + self.chunk_size])
+
+    def _upload(self, f, key: str, **kwargs) -> str:
+        self._request()
+        chunks = []
+        while True:
+            chunk = f.read(self.chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.objects[key] = b''.join(chunks)
+        return key
+
+    def _contains(self, key: str) -> bool:
+        self._request()
+        return key in self.objects
+
+    def _stat(self, key: str) -> KeyInfo:
+        self._request()
+        if key not in self.objects:
+            raise KeyNotFoundError(key)
+        return KeyInfo(key=key, size=len(self.objects[key]))
@@ -0,0 +1,332 @@
+"""
+Metrics and tracing of remote and saver operations.
+
+Operations (download, upload, contains, copy, save, load, hashing, etc.) are wrapped in spans that are reported
+to the enabled recorders. A span is identified by the name of the remote (or saver) performing it and by
+the operation name. Nested operations, such as the download of an HFSRemote that downloads from its underlying
+remote, produce nested spans.
+
+When no recorder is enabled, instrument(...) returns a shared no-op span, so the instrumentation costs a single
+function call per operation.
+
+Examples
+--------
+>> recorder = MetricsRecorder()
+>> with recording(recorder):
+>>     saver.load('some/key')
+>> print(recorder.to_prometheus())
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+import bisect
+import threading
+import time
+import typing as tp
+
+# Upper bounds (in seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60.)
+
+
+class Span:
+    """
+    A single timed operation.
+
+    Attributes
+    ----------
+    name
+        Name of the remote or saver performing the operation
+
+    op
+        Operation name
+
+    nbytes
+        Number of bytes transferred, if known. Measured from the position of the stream given to instrument(...),
+        or set explicitly by the instrumented code.
+
+    duration
+        Duration in seconds (available once the span is finished)
+
+    error
+        The exception that terminated the operation, if any
+    """
+
+    __slots__ = ('name', 'op', 'nbytes', 'duration', 'error', '_stream', '_position', '_started', '_tokens')
+
+    def __init__(self, name: str, op: str, stream=None):
+        self.name = name
+        self.op = op
+        self.nbytes: tp.Optional[int] = None
+        self.duration: tp.Optional[float] = None
+        self.error: tp.Optional[BaseException] = None
+        self._stream = stream
+        self._position = None
+        self._started = None
+        self._tokens = None
+
+    def __enter__(self):
+        self._position = _tell(self._stream)
+        self._tokens = [(recorder, recorder.start(self)) for recorder in _recorders]
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.duration = time.perf_counter() - self._started
+        self.error = exc_val
+
+        if self.nbytes is None and self._position is not None:
+            position = _tell(self._stream)
+            if position is not None:
+                self.nbytes = abs(position - self._position)
+
+        for recorder, token in reversed(self._tokens):
+            recorder.finish(self, token)
+
+        return False
+
+
+class _NullSpan:
+    """ The span used when instrumentation is disabled """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    @property
+    def nbytes(self):
+        return None
+
+    @nbytes.setter
+    def nbytes(self, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Recorder:
+    """
+    The base class of span consumers.
+
+    start(...) is called when a span begins and may return a token that is passed back to finish(...).
+    Recorders are called from many threads concurrently.
+    """
+
+    def start(self, span: Span) -> tp.Any:
+        return None
+
+    def finish(self, span: Span, token: tp.Any):
+        pass
+
+    def event(self, name: str, event: str, value: float = 1):
+        pass
+
+
+class MetricsRecorder(Recorder):
+    """
+    Aggregates the spans into per (name, operation) metrics: call and error counts, transferred bytes
+    and a latency histogram. Events (e.g. cache hits) are aggregated into per (name, event) counters.
+    """
+
+    def __init__(self, buckets: tp.Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._operations: tp.Dict[tp.Tuple[str, str], _OperationMetrics] = {}
+        self._events: tp.Dict[tp.Tuple[str, str], float] = {}
+
+    def finish(self, span: Span, token: tp.Any):
+        with self._lock:
+            metrics = self._operations.get((span.name, span.op))
+            if metrics is None:
+                metrics = self._operations[(span.name, span.op)] = _OperationMetrics(len(self.buckets))
+
+            metrics.count += 1
+            metrics.seconds += span.duration
+            metrics.histogram[bisect.bisect_left(self.buckets, span.duration)] += 1
+            if span.nbytes:
+                metrics.nbytes += span.nbytes
+            if span.error is not None:
+                metrics.errors += 1
+
+    def event(self, name: str, event: str, value: float = 1):
+        with self._lock:
+            self._events[(name, event)] = self._events.get((name, event), 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+            self._events.clear()
+
+    def operations(self) -> tp.Dict[tp.Tuple[str, str], dict]:
+        """ A snapshot of the operation metrics """
+        with self._lock:
+            return {key: dict(count=m.count, errors=m.errors, nbytes=m.nbytes, seconds=m.seconds)
+                    for key, m in self._operations.items()}
+
+    def events(self) -> tp.Dict[tp.Tuple[str, str], float]:
+        """ A snapshot of the event counters """
+        with self._lock:
+            return dict(self._events)
+
+    def cache_hit_ratio(self, name: str) -> tp.Optional[float]:
+        """ The ratio of cache hits for the given remote name, or None if it wasn't accessed """
+        with self._lock:
+            hits = self._events.get((name, 'cache_hit'), 0)
+            misses = self._events.get((name, 'cache_miss'), 0)
+        return hits / (hits + misses) if hits + misses > 0 else None
+
+    def to_prometheus(self, prefix='remotools') -> str:
+        """ Export the metrics in the Prometheus text exposition format """
+
+        with self._lock:
+            operations = sorted(((key, m.copy()) for key, m in self._operations.items()), key=lambda item: item[0])
+            events = sorted(self._events.items())
+
+        lines = [f'# HELP {prefix}_operation_seconds Duration of operations',
+                 f'# TYPE {prefix}_operation_seconds histogram']
+        for (name, op), m in operations:
+            labels = f'remote="{_escape(name)}",operation="{_escape(op)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, m.histogram):
+                cumulative += count
+                lines.append(f'{prefix}_operation_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_operation_seconds_bucket{{{labels},le="+Inf"}} {m.count}')
+            lines.append(f'{prefix}_operation_seconds_sum{{{labels}}} {m.seconds}')
+            lines.append(f'{prefix}_operation_seconds_count{{{labels}}} {m.count}')
+
+        for metric, attribute, description in [('operation_errors_total', 'errors', 'Number of failed operations'),
+                                               ('operation_bytes_total', 'nbytes', 'Number of bytes transferred')]:
+            lines.append(f'# HELP {prefix}_{metric} {description}')
+            lines.append(f'# TYPE {prefix}_{metric} counter')
+            for (name, op), m in operations:
+                labels = f'remote="{_escape(name)}",operation="{_escape(op)}"'
+                lines.append(f'{prefix}_{metric}{{{labels}}} {getattr(m, attribute)}')
+
+        lines.append(f'# HELP {prefix}_events_total Number of events (e.g. cache hits and misses)')
+        lines.append(f'# TYPE {prefix}_events_total counter')
+        for (name, event), value in events:
+            lines.append(f'{prefix}_events_total{{remote="{_escape(name)}",event="{_escape(event)}"}} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class _OperationMetrics:
+
+    __slots__ = ('count', 'errors', 'nbytes', 'seconds', 'histogram')
+
+    def __init__(self, nbuckets: int):
+        self.count = 0
+        self.errors = 0
+        self.nbytes = 0
+        self.seconds = 0.
+
+        # The last bucket counts the durations above the largest bound
+        self.histogram = [0] * (nbuckets + 1)
+
+    def copy(self) -> _OperationMetrics:
+        other = _OperationMetrics(len(self.histogram) - 1)
+        other.count, other.errors, other.nbytes, other.seconds = self.count, self.errors, self.nbytes, self.seconds
+        other.histogram = list(self.histogram)
+        return other
+
+
+class OpenTelemetryRecorder(Recorder):
+    """
+    Reports each span as an OpenTelemetry span (requires the opentelemetry-api package).
+
+    Spans are started as the current span, so the spans of nested remotes become children of the spans of
+    the remotes wrapping them. Events are added to the current span.
+    """
+
+    def __init__(self, tracer=None, prefix='remotools'):
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer('remotools')
+        self.prefix = prefix
+
+    def start(self, span: Span) -> tp.Any:
+        context = self.tracer.start_as_current_span(f'{self.prefix}.{span.op}',
+                                                    attributes={f'{self.prefix}.name': span.name},
+                                                    record_exception=False,
+                                                    set_status_on_exception=False)
+        return context, context.__enter__()
+
+    def finish(self, span: Span, token: tp.Any):
+        context, otel_span = token
+        if span.nbytes is not None:
+            otel_span.set_attribute(f'{self.prefix}.bytes', span.nbytes)
+
+        if span.error is not None:
+            otel_span.record_exception(span.error)
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, str(span.error)))
+            context.__exit__(type(span.error), span.error, span.error.__traceback__)
+        else:
+            context.__exit__(None, None, None)
+
+    def event(self, name: str, event: str, value: float = 1):
+        self._trace.get_current_span().add_event(event, attributes={f'{self.prefix}.name': name,
+                                                                    f'{self.prefix}.value': value})
+
+
+# The enabled recorders. Replaced (never mutated) so that it can be read without locking.
+_recorders: tp.Tuple[Recorder, ...] = ()
+_recorders_lock = threading.Lock()
+
+
+def enable(*recorders: Recorder):
+    """ Start reporting to the given recorders """
+    global _recorders
+    with _recorders_lock:
+        _recorders = _recorders + tuple(r for r in recorders if r not in _recorders)
+
+
+def disable(*recorders: Recorder):
+    """ Stop reporting to the given recorders (to all of them if none are given) """
+    global _recorders
+    with _recorders_lock:
+        _recorders = tuple(r for r in _recorders if recorders and r not in recorders)
+
+
+@contextmanager
+def recording(*recorders: Recorder):
+    """ Report to the given recorders for the duration of the context """
+    enable(*recorders)
+    try:
+        yield recorders[0] if len(recorders) == 1 else recorders
+    finally:
+        disable(*recorders)
+
+
+def instrument(name: str, op: str, stream=None) -> tp.Union[Span, _NullSpan]:
+    """
+    Returns a context manager timing an operation.
+
+    If a stream is given, the number of bytes is measured as the difference of its position at the start
+    and at the end of the operation.
+    """
+    if not _recorders:
+        return _NULL_SPAN
+    return Span(name, op, stream=stream)
+
+
+def count(name: str, event: str, value: float = 1):
+    """ Report an event, e.g. a cache hit """
+    for recorder in _recorders:
+        recorder.event(name, event, value)
+
+
+def _tell(stream) -> tp.Optional[int]:
+    if stream is None:
+        return None
+    try:
+        return stream.tell()
+    except Exception:
+        return None
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,330 @@
+"""
+Memoization of function results in a remote.
+
+The result of a call is saved with a saver under a key derived from the function's identity and from its
+arguments, and loaded from there instead of being recomputed the next time the function is called with the same
+arguments (by this process or any other process sharing the remote).
+
+Examples
+--------
+>> @remote_memoize(saver=NumpySaver, remote=S3Remote(bucket='features'), cache_path='$HOME/.cache/features')
+>> def extract_features(video_path: str, fps: int = 5) -> np.ndarray:
+>>     ...
+>>
+>> features = extract_features('videos/1.mp4')      # Computed and saved
+>> features = extract_features('videos/1.mp4')      # Loaded from the local cache (or from S3)
+>> extract_features.stats                           # MemoizeStats(hits=1, misses=1, ...)
+"""
+from __future__ import annotations
+from concurrent.futures import Future
+import functools
+import inspect
+import logging
+import pickle
+import struct
+import threading
+import time
+import typing as tp
+from remotools.remotes.base import BaseRemote
+from remotools.remotes.exceptions import KeyNotFoundError
+from remotools.savers.base import BaseSaver
+from remotools.instrumentation import instrument, count
+from remotools.utils import new_hash, estimate_size
+
+logger = logging.getLogger(__name__)
+
+
+class MemoizeStats:
+    """ Counters of a memoized function """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0
+        self.skipped = 0        # Results not saved because of their size
+        self.shared = 0         # Calls that waited for the same call in progress in another thread
+        self.failed = 0         # Results that couldn't be loaded or saved (the function was called instead)
+        self.compute_time = 0.
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: float = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    @property
+    def hit_ratio(self) -> tp.Optional[float]:
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(hits={self.hits}, misses={self.misses}, saved={self.saved}, ' \
+               f'skipped={self.skipped}, shared={self.shared}, failed={self.failed}, ' \
+               f'compute_time={self.compute_time:.2f}s)'
+
+
+def remote_memoize(saver: tp.Union[BaseSaver, tp.Type[BaseSaver], None] = None,
+                   remote: tp.Optional[BaseRemote] = None,
+                   prefix: str = 'memoize',
+                   cache_path: tp.Optional[str] = None,
+                   version: tp.Optional[str] = None,
+                   algorithm: str = 'xxh128',
+                   min_size: int = 0,
+                   max_size: tp.Optional[int] = None,
+                   ignore: tp.Sequence[str] = (),
+                   progress: bool = False):
+    """
+    A decorator memoizing the results of a function in a remote.
+
+    The results are stored under f'{prefix}/{module}.{qualname}/{digest}', where the digest hashes the function's
+    identity (its qualified name and either its version or its code) and its arguments, after binding them to
+    the signature (so f(1), f(x=1) and f(1, y=<default>) share a result). Arguments are hashed by value: bytes,
+    strings, numbers, containers and buffers (e.g. numpy arrays) directly, and other objects through pickle.
+
+    Concurrent calls with the same arguments in the same process are single-flight: one thread computes (or loads)
+    the result and the others wait for it.
+
+    Parameters
+    ----------
+    saver
+        The saver storing the results. Either an instance, or a saver class instantiated with the given remote.
+        Defaults to a PickleSaver over the given remote.
+
+    remote
+        The remote storing the results, when saver is a class or None. Its keys must be preserved by uploads
+        (e.g. not an HFSRemote, but possibly a CachingRemote over one).
+
+    prefix
+        Prefix of the result keys
+
+    cache_path
+        Wrap the remote with an HFSLocalCachingRemote using this path, so that results are loaded from the local
+        cache when possible
+
+    version
+        Identifies the function instead of its code. Change it to invalidate the stored results. By default,
+        any change to the function's code invalidates them.
+
+    algorithm
+        The hash algorithm (see utils.new_hash)
+
+    min_size, max_size
+        Results whose estimated size (see utils.estimate_size) is outside these bounds are returned but not saved
+
+    ignore
+        Names of arguments that don't affect the result (e.g. verbose), excluded from the key
+
+    progress
+        Report the progress of the uploads and downloads (see BaseRemote.download)
+
+    Returns
+    -------
+        The decorator. The decorated function has the additional attributes:
+        key(*args, **kwargs) -> str
+            The key under which the result of a call is stored
+
+        stats
+            A MemoizeStats instance counting the hits, misses, etc.
+    """
+
+    if saver is None or isinstance(saver, type):
+        if remote is None:
+            raise ValueError('A remote must be given unless saver is a saver instance')
+        if cache_path is not None:
+            from remotools.remotes.caching import HFSLocalCachingRemote
+            remote = HFSLocalCachingRemote(remote, local_cache_path=cache_path)
+        if saver is None:
+            from remotools.savers.pickle_saver import PickleSaver
+            saver = PickleSaver
+        saver = saver(remote)
+
+    elif remote is not None or cache_path is not None:
+        raise ValueError('remote and cache_path can only be given along with a saver class (or no saver)')
+
+    def decorator(fn: tp.Callable) -> tp.Callable:
+        name = f'{fn.__module__}.{fn.__qualname__}'
+        signature = inspect.signature(fn)
+        identity = new_hash(algorithm)
+        _feed(identity, name)
+        _feed(identity, version if version is not None else _code_identity(fn))
+
+        stats = MemoizeStats()
+        inflight: tp.Dict[str, Future] = {}
+        lock = threading.Lock()
+
+        def key(*args, **kwargs) -> str:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+
+            h = identity.copy()
+            for arg, value in bound.arguments.items():
+                if arg not in ignore:
+                    _feed(h, arg)
+                    _feed(h, value)
+            return f'{prefix}/{name}/{h.hexdigest()}'
+
+        def call(remote_key: str, args, kwargs):
+            try:
+                with instrument(name, 'memoize_load'):
+                    result = saver.load(remote_key, progress=progress)
+                stats.add('hits')
+                count(name, 'cache_hit')
+                return result
+
+            except KeyNotFoundError:
+                pass
+
+            except Exception as e:
+                # E.g. a result saved by an incompatible version of a library
+                logger.warning(f'Failed loading {remote_key}, recomputing it: {e!r}')
+                stats.add('failed')
+
+            stats.add('misses')
+            count(name, 'cache_miss')
+
+            started = time.perf_counter()
+            result = fn(*args, **kwargs)
+            stats.add('compute_time', time.perf_counter() - started)
+
+            size = estimate_size(result)
+            if size < min_size or (max_size is not None and size > max_size):
+                stats.add('skipped')
+                return result
+
+            try:
+                with instrument(name, 'memoize_save'):
+                    saved_key = saver.save(result, remote_key, progress=progress)
+            except Exception as e:
+                logger.warning(f'Failed saving {remote_key}: {e!r}')
+                stats.add('failed')
+                return result
+
+            if saved_key != remote_key:
+                logger.warning(f'The result of {name} was saved as {saved_key} instead of {remote_key}, so it '
+                               f'will not be found (the remote must preserve keys)')
+            stats.add('saved')
+            return result
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            remote_key = key(*args, **kwargs)
+
+            with lock:
+                future = inflight.get(remote_key)
+                owner = future is None
+                if owner:
+                    future = inflight[remote_key] = Future()
+
+            if not owner:
+                stats.add('shared')
+                return future.result()
+
+            try:
+                result = call(remote_key, args, kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                with lock:
+                    del inflight[remote_key]
+
+        wrapper.key = key
+        wrapper.stats = stats
+        wrapper.saver = saver
+        return wrapper
+
+    return decorator
+
+
+def _code_identity(fn: tp.Callable, _seen: tp.FrozenSet[int] = frozenset()) -> tp.Any:
+    """
+    The bytecode of a function along with the constants, global and attribute names, and variable names it uses
+    (recursively, for the functions and classes defined in it), and the values of its closure variables
+    """
+    fn = inspect.unwrap(fn)
+    code = getattr(fn, '__code__', None)
+    if code is None:
+        # E.g. builtins and callable objects
+        return repr(fn)
+
+    def flatten(c):
+        return (c.co_code, tuple(flatten(const) if inspect.iscode(const) else const for const in c.co_consts),
+                c.co_names, c.co_varnames, c.co_freevars)
+
+    # Recursive functions refer to themselves through their closure
+    _seen = _seen | {id(fn)}
+    closure = tuple(_cell_contents(cell, _seen) for cell in fn.__closure__ or ())
+    return flatten(code), closure
+
+
+def _cell_contents(cell, seen: tp.FrozenSet[int]) -> tp.Any:
+    try:
+        value = cell.cell_contents
+    except ValueError:
+        # An empty cell
+        return None
+
+    # Functions (e.g. a decorated function's wrapped function) are identified by their code rather than pickled
+    if inspect.isfunction(value):
+        return _code_identity(value, seen) if id(value) not in seen else value.__qualname__
+
+    # Values that can't be hashed (see _feed) are identified by their type, e.g. a lock or a client
+    try:
+        _digest(value)
+    except Exception:
+        return f'<{type(value).__module__}.{type(value).__qualname__}>'
+    return value
+
+
+def _feed(h, value: tp.Any):
+    """ Update a hash with a value, tagged by its type so that e.g. 1, '1' and (1,) hash differently """
+    if value is None or isinstance(value, (bool, int, float, complex)):
+        h.update(b'v' + repr(value).encode())
+
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        h.update(b's' + struct.pack('<Q', len(data)) + data)
+
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        data = memoryview(value).cast('B')
+        h.update(b'b' + struct.pack('<Q', data.nbytes))
+        h.update(data)
+
+    elif isinstance(value, (tuple, list)):
+        h.update(b'l' + struct.pack('<Q', len(value)))
+        for item in value:
+            _feed(h, item)
+
+    elif isinstance(value, dict):
+        # Insertion order doesn't matter
+        items = sorted((_digest(k), _digest(v)) for k, v in value.items())
+        h.update(b'd' + struct.pack('<Q', len(items)) + b''.join(k + v for k, v in items))
+
+    elif isinstance(value, (set, frozenset)):
+        items = sorted(_digest(item) for item in value)
+        h.update(b'e' + struct.pack('<Q', len(items)) + b''.join(items))
+
+    elif type(value).__module__ == 'numpy' and type(value).__name__ == 'ndarray':
+        import numpy as np
+        h.update(b'a' + str(value.dtype).encode() + repr(value.shape).encode())
+        if value.dtype.hasobject:
+            _feed(h, value.tolist())
+        else:
+            value = np.ascontiguousarray(value)
+            try:
+                h.update(memoryview(value).cast('B'))
+            except (TypeError, ValueError):
+                # Types not supporting the buffer protocol, e.g. datetime64
+                h.update(value.tobytes())
+
+    else:
+        h.update(b'p')
+        h.update(pickle.dumps(value, protocol=4))
+
+
+def _digest(value: tp.Any) -> bytes:
+    h = new_hash('md5')
+    _feed(h, value)
+    return h.digest()
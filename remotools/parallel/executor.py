@@ -0,0 +1,147 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor, Future
+import threading
+import typing as tp
+from remotools.utils import estimate_size
+
+if tp.TYPE_CHECKING:
+    from remotools.parallel.saver import SaverProcessPool
+
+
+class BoundedExecutor:
+    """
+    A thread pool that limits the amount of work that is in flight.
+
+    Tasks submitted with submit_bounded(...) are accounted for by count and by (estimated) size in bytes.
+    Once either limit is reached, submit_bounded(...) blocks until enough of the running tasks complete.
+    This keeps the submitted objects from piling up in the executor's queue when they are produced faster
+    than they can be consumed (e.g. uploaded over the network).
+
+    A task larger than max_bytes_in_flight is still accepted once nothing else is in flight, so the
+    executor never deadlocks on a single large object.
+
+    All the bounded tasks share a single progress bar.
+
+    Attributes
+    ----------
+    max_in_flight
+        Maximal number of bounded tasks that are submitted but not yet completed. None means no limit.
+
+    max_bytes_in_flight
+        Maximal total size of bounded tasks that are submitted but not yet completed. None means no limit.
+
+    getsizeof
+        A callable that estimates the size in bytes of an object. Defaults to remotools.utils.estimate_size
+
+    processes
+        An optional pool of worker processes for CPU-bound work, shut down together with the executor
+    """
+
+    def __init__(self,
+                 max_in_flight: tp.Optional[int] = None,
+                 max_bytes_in_flight: tp.Optional[int] = None,
+                 getsizeof: tp.Optional[tp.Callable[[tp.Any], int]] = None,
+                 progress=True,
+                 desc: tp.Optional[str] = None,
+                 processes: tp.Optional[SaverProcessPool] = None,
+                 **kwargs):
+        """
+        Parameters
+        ----------
+        max_in_flight
+            Maximal number of bounded tasks in flight
+
+        max_bytes_in_flight
+            Maximal total size (in bytes) of bounded tasks in flight
+
+        getsizeof
+            Size estimation function
+
+        progress
+            Show an aggregated progress bar for the bounded tasks
+
+        desc
+            Progress bar description
+
+        processes
+            Pool of worker processes
+
+        kwargs
+            Passed as is to ThreadPoolExecutor
+        """
+        self.max_in_flight = max_in_flight
+        self.max_bytes_in_flight = max_bytes_in_flight
+        self.getsizeof = getsizeof or estimate_size
+        self.processes = processes
+
+        self._pool = ThreadPoolExecutor(**kwargs)
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._bytes_in_flight = 0
+        import tqdm
+        self._progress = tqdm.tqdm(total=0, desc=desc, unit='obj', disable=not progress)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def bytes_in_flight(self) -> int:
+        return self._bytes_in_flight
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """ Submit a task without any accounting (same as ThreadPoolExecutor.submit) """
+        return self._pool.submit(fn, *args, **kwargs)
+
+    def submit_bounded(self, nbytes: int, fn, *args, **kwargs) -> Future:
+        """ Submit a task of the given size, blocking while the in-flight limits are exceeded """
+        self._acquire(nbytes)
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._release(nbytes)
+            raise
+
+        future.add_done_callback(lambda _: self._release(nbytes, completed=True))
+        return future
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+        if self.processes is not None:
+            self.processes.shutdown(wait=wait)
+        self._progress.close()
+
+    def _has_capacity(self, nbytes: int) -> bool:
+        # Always let a task through if nothing else is running
+        if self._in_flight == 0:
+            return True
+
+        if self.max_in_flight is not None and self._in_flight >= self.max_in_flight:
+            return False
+
+        if self.max_bytes_in_flight is not None and self._bytes_in_flight + nbytes > self.max_bytes_in_flight:
+            return False
+
+        return True
+
+    def _acquire(self, nbytes: int):
+        with self._cond:
+            self._cond.wait_for(lambda: self._has_capacity(nbytes))
+            self._in_flight += 1
+            self._bytes_in_flight += nbytes
+            self._progress.total += 1
+            self._progress.refresh()
+
+    def _release(self, nbytes: int, completed=False):
+        with self._cond:
+            self._in_flight -= 1
+            self._bytes_in_flight -= nbytes
+            if completed:
+                self._progress.update(1)
+            self._cond.notify_all()
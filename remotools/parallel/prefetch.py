@@ -0,0 +1,228 @@
+from __future__ import annotations
+from collections import defaultdict
+from concurrent.futures import Future
+import bisect
+import logging
+import os
+import threading
+import typing as tp
+from remotools.instrumentation import count
+
+if tp.TYPE_CHECKING:
+    from remotools.remotes.caching import CachingRemote
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchStats:
+    """ Counters of a Prefetcher """
+
+    def __init__(self):
+        self.hits = 0           # Accesses to keys that were prefetched
+        self.late = 0           # Accesses to keys whose prefetch was still in progress (and were waited for)
+        self.misses = 0         # Accesses to keys that weren't prefetched
+        self.fetched = 0
+        self.failed = 0
+        self.unexpected = 0     # Accesses to keys not found in the sequence
+
+    @property
+    def hit_rate(self) -> tp.Optional[float]:
+        """ The fraction of accesses that found their key prefetched (or being prefetched) """
+        total = self.hits + self.late + self.misses
+        return (self.hits + self.late) / total if total else None
+
+    def __repr__(self):
+        hit_rate = self.hit_rate
+        return f'{self.__class__.__name__}(hits={self.hits}, late={self.late}, misses={self.misses}, ' \
+               f'fetched={self.fetched}, failed={self.failed}, unexpected={self.unexpected}, ' \
+               f'hit_rate={"-" if hit_rate is None else f"{hit_rate:.2f}"})'
+
+
+class Prefetcher:
+    """
+    Warms the cache of a CachingRemote ahead of the accesses, following an expected sequence of keys.
+
+    The prefetcher tracks the downloads of the remote: each download advances the position in the sequence to the
+    key being downloaded, and the next window keys are fetched into the cache in the background (through
+    ConcurrentCachingRemote.fetch). A download of a key whose prefetch is in progress waits for it instead of
+    downloading the key again.
+
+    The sequence is either given explicitly, or learned: with an access_log, the keys downloaded while the
+    prefetcher is attached are recorded in it, and the log of the previous run (e.g. the previous epoch) is used as
+    the sequence of the next one.
+
+    The hits, misses etc. are counted in stats, and reported as prefetch_hit, prefetch_late and prefetch_miss
+    events of the remote (see remotools.instrumentation).
+
+    Attributes
+    ----------
+    remote
+        The CachingRemote
+
+    keys
+        The expected sequence of keys. Keys may repeat.
+
+    window
+        Number of keys fetched ahead of the last access
+
+    max_workers
+        Number of threads fetching the keys
+
+    access_log
+        Path of a file in which the accessed keys are recorded (one per line). When keys isn't given, the keys
+        recorded by the previous run are used as the sequence.
+
+    Examples
+    --------
+    >> remote = HFSLocalCachingRemote(S3Remote(bucket='dataset'), '/tmp/cache')
+    >> for epoch in range(10):
+    >>     with remote.prefetch(access_log='/tmp/cache/access.log', window=64):
+    >>         for key in shuffled_keys(epoch):  # Learned from the first epoch when the order repeats
+    >>             train_on(saver.load(key))
+    """
+
+    def __init__(self, remote: CachingRemote, keys: tp.Optional[tp.Iterable[str]] = None, window: int = 16,
+                 max_workers: int = 4, access_log: tp.Optional[str] = None):
+        from remotools.remotes.caching import CachingRemote
+        if not isinstance(remote, CachingRemote):
+            raise TypeError(f'Remote must be of type {CachingRemote.__name__}')
+
+        if keys is None and access_log is not None and os.path.exists(access_log):
+            with open(access_log, 'r') as log:
+                keys = [line.rstrip('\n') for line in log if line.strip()]
+
+        self.remote = remote
+        self.keys: tp.List[str] = list(keys or [])
+        self.window = window
+        self.max_workers = max_workers
+        self.access_log = access_log
+        self.stats = PrefetchStats()
+
+        self._positions: tp.Dict[str, tp.List[int]] = defaultdict(list)
+        for i, key in enumerate(self.keys):
+            self._positions[key].append(i)
+
+        self._position = -1         # Index of the last access in keys
+        self._scheduled = -1        # Index of the last key fetched
+        self._futures: tp.Dict[str, Future] = {}
+        # Reentrant, since the callbacks of futures that are already done are called by add_done_callback
+        self._lock = threading.RLock()
+        self._concurrent = None
+        self._log = None
+
+    def start(self) -> Prefetcher:
+        """ Attach to the remote and prefetch the first window keys """
+        if self.remote.prefetcher is not None:
+            raise RuntimeError(f'{self.remote.name} already has a prefetcher attached')
+
+        self._concurrent = self.remote.concurrent(max_workers=self.max_workers)
+        if self.access_log is not None:
+            self._log = open(self.access_log + '.new', 'w')
+
+        self.remote.prefetcher = self
+        with self._lock:
+            self._schedule()
+        return self
+
+    def close(self, wait: bool = False):
+        """ Detach from the remote, and stop prefetching (cancelling the pending fetches unless wait=True) """
+        if self.remote.prefetcher is self:
+            self.remote.prefetcher = None
+
+        if self._concurrent is not None:
+            if not wait:
+                with self._lock:
+                    for future in self._futures.values():
+                        future.cancel()
+            self._concurrent._pool.shutdown(wait=wait)
+            self._concurrent = None
+
+        if self._log is not None:
+            # The log becomes the sequence of the next run
+            self._log.close()
+            os.replace(self.access_log + '.new', self.access_log)
+            self._log = None
+
+    def __enter__(self) -> Prefetcher:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def accessed(self, key: str):
+        """ Called by the remote before downloading a key. Waits for the prefetch of the key, if in progress. """
+        with self._lock:
+            if self._log is not None:
+                self._log.write(key + '\n')
+
+            future = self._futures.pop(key, None)
+            self._advance(key)
+
+            if future is None:
+                event = 'miss'
+                self.stats.misses += 1
+            elif future.done():
+                event = 'hit'
+                self.stats.hits += 1
+            else:
+                event = 'late'
+                self.stats.late += 1
+
+        count(self.remote.name, f'prefetch_{event}')
+        if future is None:
+            return
+
+        try:
+            future.result()
+        except Exception:
+            # Counted by _fetched. The download goes on to the remote.
+            pass
+
+    def _advance(self, key: str):
+        positions = self._positions.get(key)
+        if not positions:
+            self.stats.unexpected += 1
+            return
+
+        # The next occurrence of the key, or its first one when the sequence restarted
+        previous = self._position
+        i = bisect.bisect_right(positions, previous)
+        self._position = positions[i] if i < len(positions) else positions[0]
+
+        # Moving backwards starts a new pass over the keys
+        self._scheduled = self._position if self._position < previous else max(self._scheduled, self._position)
+        self._schedule()
+
+    def _schedule(self):
+        """ Fetch the keys up to window keys ahead of the position (call while holding the lock) """
+        if self._concurrent is None:
+            return
+
+        end = min(len(self.keys) - 1, self._position + self.window)
+        while self._scheduled < end:
+            self._scheduled += 1
+            key = self.keys[self._scheduled]
+            if key in self._futures:
+                continue
+
+            future = self._concurrent.fetch(key, progress=False)
+            future.add_done_callback(self._fetched)
+            self._futures[key] = future
+
+        # Forget the keys that were skipped
+        if len(self._futures) > 2 * self.window:
+            for key in [key for key, future in self._futures.items() if future.done()][:-self.window]:
+                del self._futures[key]
+
+    def _fetched(self, future: Future):
+        if future.cancelled():
+            return
+
+        error = future.exception()
+        with self._lock:
+            if error is None:
+                self.stats.fetched += 1
+            else:
+                self.stats.failed += 1
+        if error is not None:
+            logger.warning(f'{self.remote.name}: prefetching failed: {error!r}')
@@ -5,7 +5,6 @@ import typing as tp
 if tp.TYPE_CHECKING:
     from remotools.remotes.base import BaseRemote
 
-# TODO add concurrent_copy (download one uri, upload to another uri)
 # TODO change download -> async_download etc
 
 
@@ -1,20 +1,67 @@
 from __future__ import annotations
-from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
+from collections import OrderedDict
+from itertools import zip_longest
 import typing as tp
-import tqdm
+import io
+import os
 from operator import setitem
 from functools import partial
 from remotools.exceptions import SaverError
+from remotools.utils import BufferReader, estimate_size
 
 if tp.TYPE_CHECKING:
     from remotools.savers import BaseSaver
 
+BACKENDS = ('thread', 'process')
+
+
+class ConcurrentResult(tp.NamedTuple):
+    """ The outcome of a single item of ConcurrentSaver.iter_save(...) or ConcurrentSaver.iter_load(...) """
+
+    key: str
+    value: tp.Any
+    error: tp.Optional[BaseException]
+
 
 class ConcurrentSaver:
+    """
+    Runs the operations of a saver concurrently.
+
+    With the 'thread' backend (the default) both the serialization and the remote I/O run in a thread pool.
+    With the 'process' backend the serialization (encode/decode) runs in a pool of worker processes and the
+    encoded bytes are passed back through shared memory, while the remote I/O stays on the threads of the
+    current process. This helps savers whose serialization holds the GIL (e.g. PIL, pandas, jsonpickle, yaml).
+    The produced objects are identical for both backends.
+
+    Savers that do not implement encode/decode always run in the threads.
+    """
+
+    def __init__(self, saver: BaseSaver, backend='thread', max_processes: tp.Optional[int] = None, **kwargs):
+        """
+        Parameters
+        ----------
+        saver
+            The saver to run concurrently
+
+        backend
+            Either 'thread' or 'process'
+
+        max_processes
+            Number of worker processes (for the 'process' backend)
+
+        kwargs
+            Passed as is to ThreadPoolExecutor
+        """
+        if backend not in BACKENDS:
+            raise SaverError(f'Unknown backend {backend} (must be one of {BACKENDS})')
 
-    def __init__(self, saver: BaseSaver, **kwargs):
         self.saver = saver
-        self._pool = ThreadPoolExecutor(**kwargs)
+
+        # The default of ThreadPoolExecutor
+        self.max_workers = kwargs.pop('max_workers', None) or min(32, (os.cpu_count() or 1) + 4)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, **kwargs)
+        self._processes = SaverProcessPool(max_workers=max_processes) if backend == 'process' else None
 
     def __enter__(self):
         self._pool.__enter__()
@@ -22,13 +69,27 @@ class ConcurrentSaver:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._pool.__exit__(exc_type, exc_val, exc_tb)
+        if self._processes is not None:
+            self._processes.shutdown(wait=True)
+
+    @property
+    def _save(self) -> tp.Callable[..., str]:
+        if self._processes is not None:
+            return partial(self._processes.save, self.saver)
+        return self.saver.save
+
+    @property
+    def _load(self) -> tp.Callable[..., tp.Any]:
+        if self._processes is not None:
+            return partial(self._processes.load, self.saver)
+        return self.saver.load
 
     def async_save(self, obj: tp.Any, key: str, upload_params=None, progress=True, **kwargs) -> Future:
-        return self._pool.submit(self.saver.save, obj=obj, key=key,
+        return self._pool.submit(self._save, obj=obj, key=key,
                                  upload_params=upload_params, progress=progress, **kwargs)
 
     def async_load(self, key: str, download_params=None, progress=True, **kwargs) -> Future:
-        return self._pool.submit(self.saver.load, key=key,
+        return self._pool.submit(self._load, key=key,
                                  download_params=download_params, progress=progress, **kwargs)
 
     def concurrent_save(self,
@@ -49,6 +110,7 @@ class ConcurrentSaver:
             futures.append(future)
 
         # TODO add retries handling
+        import tqdm
         for future in tqdm.tqdm(as_completed(futures),
                                 total=len(futures), desc=f"Concurrent save  by {self.saver.__class__.__name__} "
                                                          f"over {self.saver.remote.name}"):
@@ -57,6 +119,119 @@ class ConcurrentSaver:
 
         return [x.result() for x in futures]
 
+    def iter_save(self,
+                  objs: tp.Iterable[tp.Any],
+                  keys: tp.Iterable[str],
+                  window: tp.Optional[int] = None,
+                  ordered=False,
+                  upload_params=None, progress=True, **kwargs) -> tp.Iterator[ConcurrentResult]:
+        """
+        Save objects in parallel while consuming the inputs lazily.
+
+        At most window objects are in flight at any time (defaults to twice the number of threads), so the
+        inputs may be arbitrarily long iterators. Yields a ConcurrentResult per object whose value is the final
+        key. An item that failed is yielded with its exception in the error field instead of raising.
+
+        Parameters
+        ----------
+        objs
+            The objects to save
+
+        keys
+            The keys to save the objects with
+
+        window
+            Maximal number of objects in flight
+
+        ordered
+            Yield the results in the order of the inputs, rather than the order of completion
+
+        upload_params
+            Parameters passed to the remote's upload method
+
+        progress
+            Show an aggregated progress bar
+        """
+
+        def tasks():
+            for key, obj in zip_longest(keys, objs, fillvalue=_MISSING):
+                if key is _MISSING or obj is _MISSING:
+                    raise SaverError('The number of objects is different from the number of keys')
+                yield key, partial(self._sized_save, obj=obj, key=key, upload_params=upload_params, **kwargs)
+
+        yield from self._iter_window(tasks(), window=window, ordered=ordered, progress=progress,
+                                     desc=f"Concurrent save by {self.saver.__class__.__name__} "
+                                          f"over {self.saver.remote.name}")
+
+    def iter_load(self,
+                  keys: tp.Iterable[str],
+                  window: tp.Optional[int] = None,
+                  ordered=False,
+                  download_params=None, progress=True, **kwargs) -> tp.Iterator[ConcurrentResult]:
+        """
+        Load objects in parallel while consuming the keys lazily.
+
+        Same as iter_save(...), but the value of each ConcurrentResult is the loaded object.
+        """
+
+        def tasks():
+            for key in keys:
+                yield key, partial(self._sized_load, key=key, download_params=download_params, **kwargs)
+
+        yield from self._iter_window(tasks(), window=window, ordered=ordered, progress=progress,
+                                     desc=f"Concurrent load by {self.saver.__class__.__name__} "
+                                          f"over {self.saver.remote.name}")
+
+    def _sized_save(self, obj: tp.Any, **kwargs) -> tp.Tuple[str, int]:
+        return self._save(obj=obj, progress=False, **kwargs), estimate_size(obj)
+
+    def _sized_load(self, **kwargs) -> tp.Tuple[tp.Any, int]:
+        obj = self._load(progress=False, **kwargs)
+        return obj, estimate_size(obj)
+
+    def _iter_window(self,
+                     tasks: tp.Iterator[tp.Tuple[str, tp.Callable[[], tp.Tuple[tp.Any, int]]]],
+                     window: tp.Optional[int],
+                     ordered: bool,
+                     progress: bool,
+                     desc: str) -> tp.Iterator[ConcurrentResult]:
+
+        window = window or 2 * self.max_workers
+        pending: tp.Dict[Future, str] = OrderedDict()
+
+        with _ThroughputBar(desc=desc, disable=not progress) as bar:
+            for key, task in tasks:
+                pending[self._pool.submit(task)] = key
+
+                if len(pending) >= window:
+                    yield from self._collect(pending, ordered=ordered, bar=bar)
+
+            while pending:
+                yield from self._collect(pending, ordered=ordered, bar=bar)
+
+    @staticmethod
+    def _collect(pending: tp.Dict[Future, str], ordered: bool, bar: _ThroughputBar) -> tp.Iterator[ConcurrentResult]:
+        """ Wait for some of the pending futures and yield their results """
+
+        if ordered:
+            done = [next(iter(pending))]
+            wait(done)
+        else:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            done = [future for future in pending if future in finished]
+
+        for future in done:
+            key = pending.pop(future)
+            error = future.exception()
+
+            if error is None:
+                value, nbytes = future.result()
+                bar.update(nbytes)
+                yield ConcurrentResult(key=key, value=value, error=None)
+            else:
+                bar.update(0)
+                yield ConcurrentResult(key=key, value=None, error=error)
+
     def concurrent_load(self,
                         keys: tp.Iterable[str],
                         download_params=None, progress=True, **kwargs) -> tp.List[tp.Any]:
@@ -70,6 +245,7 @@ class ConcurrentSaver:
             futures.append(future)
 
         # TODO add retries handling
+        import tqdm
         for future in tqdm.tqdm(as_completed(futures),
                                 total=len(futures), desc=f"Concurrent load  by {self.saver.__class__.__name__} "
                                                          f"over {self.saver.remote.name}"):
@@ -78,3 +254,149 @@ class ConcurrentSaver:
 
         return [x.result() for x in futures]
 
+
+class _ThroughputBar:
+    """ A progress bar counting objects, that also shows the throughput in MB/s """
+
+    def __init__(self, desc: str, disable=False):
+        import tqdm
+        self._bar = tqdm.tqdm(desc=desc, unit='obj', disable=disable)
+        self._nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._bar.close()
+
+    def update(self, nbytes: int):
+        self._nbytes += nbytes
+        elapsed = self._bar.format_dict['elapsed']
+        if elapsed > 0:
+            self._bar.set_postfix_str(f'{self._nbytes / elapsed / 2 ** 20:.2f}MB/s', refresh=False)
+        self._bar.update(1)
+
+
+# Marks an exhausted input
+_MISSING = object()
+
+
+class SaverProcessPool:
+    """
+    Offloads the serialization of savers to worker processes.
+
+    The save(...) and load(...) methods mirror those of BaseSaver and are meant to be called from threads of the
+    current process: they block on the worker while the remote I/O happens in the calling thread. The encoded
+    bytes are moved between the processes through multiprocessing.shared_memory blocks, which are unlinked as
+    soon as the transfer is done.
+
+    The saver (including its remote) must be picklable.
+    """
+
+    def __init__(self, max_workers: tp.Optional[int] = None, **kwargs):
+        from multiprocessing import resource_tracker
+
+        # The workers must share the resource tracker of the current process, as shared memory blocks
+        # are created on one side and unlinked on the other
+        resource_tracker.ensure_running()
+        self._pool = ProcessPoolExecutor(max_workers=max_workers, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def save(self, saver: BaseSaver, obj: tp.Any, key: str, upload_params=None, progress=True, **kwargs) -> str:
+        if not saver.supports_encoding:
+            return saver.save(obj=obj, key=key, upload_params=upload_params, progress=progress, **kwargs)
+
+        name, size = self._pool.submit(_encode_to_shared_memory, saver, obj, key, kwargs).result()
+        with _attached_reader(name, size, unlink=True) as f:
+            return saver.remote.upload(f, key, params=upload_params, progress=progress)
+
+    def load(self, saver: BaseSaver, key: str, download_params=None, progress=True, **kwargs) -> tp.Any:
+        if not saver.supports_encoding:
+            return saver.load(key=key, download_params=download_params, progress=progress, **kwargs)
+
+        f = io.BytesIO()
+        saver.remote.download(f, key, params=download_params, progress=progress)
+        name, size = _to_shared_memory(f.getbuffer())
+        try:
+            return self._pool.submit(_decode_from_shared_memory, saver, name, size, kwargs).result()
+        finally:
+            _unlink_shared_memory(name)
+
+
+def _to_shared_memory(buffer) -> tp.Tuple[tp.Optional[str], int]:
+    """ Copy a buffer into a new shared memory block. Returns the block's name and the buffer's size. """
+    from multiprocessing import shared_memory
+
+    with memoryview(buffer) as view:
+        size = view.nbytes
+
+        # Shared memory blocks can't be empty
+        if size == 0:
+            return None, 0
+
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            shm.buf[:size] = view.cast('B')
+        finally:
+            shm.close()
+
+    return shm.name, size
+
+
+def _unlink_shared_memory(name: tp.Optional[str]):
+    from multiprocessing import shared_memory
+
+    if name is not None:
+        shm = shared_memory.SharedMemory(name=name)
+        shm.close()
+        shm.unlink()
+
+
+class _attached_reader:
+    """ A context manager providing a BufferReader over an existing shared memory block """
+
+    def __init__(self, name: tp.Optional[str], size: int, unlink=False):
+        self.name = name
+        self.size = size
+        self.unlink = unlink
+        self._shm = None
+        self._reader = None
+
+    def __enter__(self) -> BufferReader:
+        from multiprocessing import shared_memory
+
+        if self.name is None:
+            self._reader = BufferReader(b'')
+        else:
+            self._shm = shared_memory.SharedMemory(name=self.name)
+            self._reader = BufferReader(self._shm.buf[:self.size])
+        return self._reader
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._reader.close()
+        if self._shm is not None:
+            self._shm.close()
+            if self.unlink:
+                self._shm.unlink()
+
+
+def _encode_to_shared_memory(saver: BaseSaver, obj: tp.Any, key: str, kwargs: dict):
+    """ Runs in the worker process """
+    f = io.BytesIO()
+    saver.encode(obj, f, key=key, **kwargs)
+    return _to_shared_memory(f.getbuffer())
+
+
+def _decode_from_shared_memory(saver: BaseSaver, name: tp.Optional[str], size: int, kwargs: dict):
+    """ Runs in the worker process """
+    with _attached_reader(name, size) as f:
+        # The reads copy out of the block, so the decoded object doesn't refer to it once it is unlinked
+        return saver.decode(f, **kwargs)
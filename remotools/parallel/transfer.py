@@ -0,0 +1,357 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import io
+import json
+import os
+import queue
+import threading
+import time
+import typing as tp
+from remotools.remotes.exceptions import KeyNotFoundError
+
+if tp.TYPE_CHECKING:
+    import tqdm
+    from remotools.remotes.base import BaseRemote, KeyInfo
+
+SKIP_MODES = (None, 'exists', 'size', 'hash')
+
+
+class TransferStats:
+    """ Counters of a Transfer run """
+
+    def __init__(self):
+        self.copied = 0
+        self.skipped = 0
+        self.failed: tp.Dict[str, BaseException] = {}
+        self.nbytes = 0
+        self.elapsed = 0.
+
+    @property
+    def throughput(self) -> float:
+        """ Copied bytes per second """
+        return self.nbytes / self.elapsed if self.elapsed > 0 else 0.
+
+    @property
+    def objects_per_second(self) -> float:
+        return self.copied / self.elapsed if self.elapsed > 0 else 0.
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(copied={self.copied}, skipped={self.skipped}, ' \
+               f'failed={len(self.failed)}, nbytes={self.nbytes}, elapsed={self.elapsed:.2f}s, ' \
+               f'throughput={self.throughput / 2 ** 20:.2f}MB/s)'
+
+
+class Transfer:
+    """
+    Pipelined copying of objects from one remote to another.
+
+    The keys are consumed lazily from an iterable and every object passes through two stages: a download
+    from the source remote and an upload to the destination remote. Each stage runs in its own thread pool,
+    so the two directions can be tuned separately. The objects in flight are held in a fixed set of reusable
+    buffers (max_buffers), which bounds the memory and throttles the consumption of keys.
+
+    Objects that already exist on the destination can be skipped (see skip_existing). When a checkpoint file
+    is given, every key that was copied or skipped is appended to it, and the keys found in it are skipped
+    on the next run, which allows resuming an interrupted transfer.
+
+    Attributes
+    ----------
+    src
+        The source remote
+
+    dst
+        The destination remote
+
+    download_workers
+        Number of threads downloading from the source
+
+    upload_workers
+        Number of threads uploading to the destination
+
+    max_buffers
+        Maximal number of objects in flight. Defaults to download_workers + upload_workers
+
+    skip_existing
+        None - copy everything
+        'exists' - skip keys that exist on the destination
+        'size' - skip keys that exist on the destination with the same size (the default)
+        'hash' - skip keys that exist on the destination with the same content hash. When the hashes aren't
+                 known to both remotes, the sizes are compared instead
+        'size' and 'hash' rely on BaseRemote.stat(...). When it's not supported the object is copied.
+
+    checkpoint
+        Path of a checkpoint file
+
+    Examples
+    --------
+    >> transfer = Transfer(S3Remote(), LocalRemote('/data/mirror'), download_workers=32, upload_workers=4,
+    >>                     checkpoint='/data/mirror.ckpt')
+    >> stats = transfer.run(line.strip() for line in open('keys.txt'))
+    """
+
+    def __init__(self,
+                 src: BaseRemote,
+                 dst: BaseRemote,
+                 download_workers=8,
+                 upload_workers=8,
+                 max_buffers: tp.Optional[int] = None,
+                 skip_existing: tp.Optional[str] = 'size',
+                 checkpoint: tp.Optional[str] = None,
+                 download_params: tp.Optional[dict] = None,
+                 upload_params: tp.Optional[dict] = None,
+                 progress=True):
+
+        if skip_existing not in SKIP_MODES:
+            raise ValueError(f'Unknown skip mode {skip_existing} (must be one of {SKIP_MODES})')
+
+        self.src = src
+        self.dst = dst
+        self.download_workers = download_workers
+        self.upload_workers = upload_workers
+        self.max_buffers = max_buffers or download_workers + upload_workers
+        self.skip_existing = skip_existing
+        self.checkpoint = checkpoint
+        self.download_params = download_params
+        self.upload_params = upload_params
+        self.progress = progress
+
+        self._lock = threading.Lock()
+        self._checkpoint_file = None
+
+    def run(self, keys: tp.Iterable[str]) -> TransferStats:
+        """ Copy the given keys. Returns the transfer statistics. """
+
+        import tqdm
+
+        stats = TransferStats()
+        done = self._read_checkpoint()
+        buffers = queue.Queue()
+        for _ in range(self.max_buffers):
+            buffers.put(ReusableBuffer())
+
+        start = time.monotonic()
+        with self._open_checkpoint(), \
+                tqdm.tqdm(desc=f'Transfer {self.src.name} -> {self.dst.name}', unit='B', unit_scale=True,
+                          disable=not self.progress) as bar, \
+                ThreadPoolExecutor(max_workers=self.upload_workers) as uploads, \
+                ThreadPoolExecutor(max_workers=self.download_workers) as downloads:
+
+            # The download pool is shut down (and waited for) before the upload pool, so by the time
+            # the upload pool is shut down all the uploads have been submitted
+            for key in keys:
+                if key in done:
+                    with self._lock:
+                        stats.skipped += 1
+                    continue
+
+                # Blocks while all the buffers are in flight
+                buffer = buffers.get()
+                downloads.submit(self._download, key, buffer, buffers, uploads, stats, bar)
+
+        stats.elapsed = time.monotonic() - start
+        return stats
+
+    def _download(self, key: str, buffer: ReusableBuffer, buffers: queue.Queue, uploads: ThreadPoolExecutor,
+                  stats: TransferStats, bar: tqdm.tqdm):
+        try:
+            if self._should_skip(key):
+                self._record(key, stats, bar, skipped=True)
+                buffers.put(buffer)
+                return
+
+            buffer.reset()
+            self.src.download(buffer, key, progress=False, params=self.download_params)
+            buffer.seek(0)
+
+        except BaseException as e:
+            self._record(key, stats, bar, error=e)
+            buffers.put(buffer)
+            return
+
+        uploads.submit(self._upload, key, buffer, buffers, stats, bar)
+
+    def _upload(self, key: str, buffer: ReusableBuffer, buffers: queue.Queue, stats: TransferStats, bar: tqdm.tqdm):
+        try:
+            self.dst.upload(buffer, key, progress=False, params=self.upload_params)
+            self._record(key, stats, bar, nbytes=len(buffer))
+
+        except BaseException as e:
+            self._record(key, stats, bar, error=e)
+
+        finally:
+            buffers.put(buffer)
+
+    def _should_skip(self, key: str) -> bool:
+        if self.skip_existing is None:
+            return False
+
+        if self.skip_existing == 'exists':
+            return self.dst.contains(key)
+
+        try:
+            dst_info = self.dst.stat(key)
+        except KeyNotFoundError:
+            return False
+        except NotImplementedError:
+            return False
+
+        try:
+            src_info = self.src.stat(key)
+        except NotImplementedError:
+            return False
+
+        return _same_content(src_info, dst_info, compare_hash=self.skip_existing == 'hash')
+
+    def _record(self, key: str, stats: TransferStats, bar: tqdm.tqdm,
+                nbytes=0, skipped=False, error: tp.Optional[BaseException] = None):
+        with self._lock:
+            if error is not None:
+                stats.failed[key] = error
+            else:
+                if skipped:
+                    stats.skipped += 1
+                else:
+                    stats.copied += 1
+                    stats.nbytes += nbytes
+
+                if self._checkpoint_file is not None:
+                    self._checkpoint_file.write(json.dumps(key) + '\n')
+                    self._checkpoint_file.flush()
+
+            bar.set_postfix(copied=stats.copied, skipped=stats.skipped, failed=len(stats.failed), refresh=False)
+            bar.update(nbytes)
+
+    def _read_checkpoint(self) -> tp.Set[str]:
+        done = set()
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return done
+
+        with open(self.checkpoint, 'r') as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line))
+
+                # The last line may be partially written if the previous run was interrupted
+                except ValueError:
+                    pass
+
+        return done
+
+    @contextmanager
+    def _open_checkpoint(self):
+        if self.checkpoint is None:
+            yield
+            return
+
+        with open(self.checkpoint, 'a') as f:
+            self._checkpoint_file = f
+            try:
+                yield
+            finally:
+                self._checkpoint_file = None
+
+
+def _same_content(src_info: KeyInfo, dst_info: KeyInfo, compare_hash: bool) -> bool:
+    if compare_hash and src_info.hash is not None and dst_info.hash is not None:
+        src_algorithm = src_info.hash.split(':', maxsplit=1)[0]
+        dst_algorithm = dst_info.hash.split(':', maxsplit=1)[0]
+        if src_algorithm == dst_algorithm:
+            return src_info.hash == dst_info.hash
+
+    return src_info.size is not None and src_info.size == dst_info.size
+
+
+def concurrent_copy(src: BaseRemote, dst: BaseRemote, keys: tp.Iterable[str], **kwargs) -> TransferStats:
+    """ Copy the given keys from src to dst. See Transfer for the keyword arguments. """
+    return Transfer(src=src, dst=dst, **kwargs).run(keys)
+
+
+class ReusableBuffer(io.RawIOBase):
+    """
+    An in-memory binary stream whose storage is kept between uses.
+
+    Unlike BytesIO, reset() empties the stream without releasing the memory, so a buffer that is reused for
+    many objects only grows to the size of the largest one.
+    """
+
+    def __init__(self):
+        super(ReusableBuffer, self).__init__()
+        self._data = bytearray()
+        self._size = 0
+        self._position = 0
+
+    def __len__(self):
+        return self._size
+
+    def reset(self):
+        self._size = 0
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f'Invalid whence ({whence})')
+
+        if position < 0:
+            raise ValueError(f'Negative seek position {position}')
+
+        self._position = position
+        return position
+
+    def truncate(self, size=None):
+        self._size = self._position if size is None else min(size, self._size)
+        return self._size
+
+    def write(self, b):
+        with memoryview(b) as view, view.cast('B') as data:
+            n = data.nbytes
+            end = self._position + n
+
+            # Zero the gap when writing past the end (the storage may hold the bytes of a previous object)
+            if self._position > self._size:
+                stored = min(self._position, len(self._data))
+                self._data[self._size:stored] = bytes(stored - self._size)
+                self._data.extend(bytes(self._position - stored))
+
+            self._data[self._position:end] = data
+
+        self._size = max(self._size, end)
+        self._position = end
+        return n
+
+    def readinto(self, b):
+        start = min(self._position, self._size)
+        with memoryview(b) as view, view.cast('B') as target, memoryview(self._data) as data:
+            n = min(target.nbytes, self._size - start)
+            target[:n] = data[start:start + n]
+        self._position = start + n
+        return n
+
+    def read(self, size=-1):
+        start = min(self._position, self._size)
+        end = self._size if size is None or size < 0 else min(start + size, self._size)
+        self._position = end
+        with memoryview(self._data) as data:
+            return data[start:end].tobytes()
+
+    def readall(self):
+        return self.read()
+
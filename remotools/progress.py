@@ -0,0 +1,278 @@
+from __future__ import annotations
+from contextlib import contextmanager
+import logging
+import threading
+import time
+import typing as tp
+
+
+class TransferProgress:
+    """
+    The progress of a single download or upload.
+
+    Attributes
+    ----------
+    desc
+        Description of the transfer, e.g. '[LocalRemote DOWNLOAD] some/key'
+
+    nbytes
+        Number of bytes transferred so far
+
+    started
+        Start time (time.monotonic())
+    """
+
+    __slots__ = ('desc', 'nbytes', 'started')
+
+    def __init__(self, desc: str):
+        self.desc = desc
+        self.nbytes = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+
+class ProgressSink:
+    """
+    The base class of progress consumers.
+
+    A sink is notified when a transfer starts, whenever bytes are transferred and when the transfer finishes.
+    The same sink may receive the events of many concurrent transfers from different threads.
+    """
+
+    def start(self, transfer: TransferProgress):
+        pass
+
+    def update(self, transfer: TransferProgress, nbytes: int):
+        pass
+
+    def finish(self, transfer: TransferProgress, error: tp.Optional[BaseException] = None):
+        pass
+
+    def close(self):
+        pass
+
+
+class TqdmSink(ProgressSink):
+    """ Shows the progress of all the transfers it receives on a single tqdm progress bar """
+
+    def __init__(self, desc: str = 'Transfer', **kwargs):
+        self.desc = desc
+        self.kwargs = kwargs
+        self._bar = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def start(self, transfer: TransferProgress):
+        with self._lock:
+            if self._bar is None:
+                import tqdm
+                self._bar = tqdm.tqdm(desc=self.desc, unit='B', unit_scale=True, unit_divisor=1024, **self.kwargs)
+
+    def update(self, transfer: TransferProgress, nbytes: int):
+        self._bar.update(nbytes)
+
+    def finish(self, transfer: TransferProgress, error: tp.Optional[BaseException] = None):
+        with self._lock:
+            self._count += 1
+            self._bar.set_postfix(objects=self._count, refresh=False)
+
+    def close(self):
+        with self._lock:
+            if self._bar is not None:
+                self._bar.close()
+                self._bar = None
+
+
+class LoggingSink(ProgressSink):
+    """ Logs every finished transfer, and the overall throughput at most once per interval (in seconds) """
+
+    def __init__(self, logger: tp.Optional[logging.Logger] = None, level=logging.INFO, interval=10.):
+        self.logger = logger or logging.getLogger('remotools.progress')
+        self.level = level
+        self.interval = interval
+        self._nbytes = 0
+        self._count = 0
+        self._started = time.monotonic()
+        self._last_report = self._started
+        self._lock = threading.Lock()
+
+    def update(self, transfer: TransferProgress, nbytes: int):
+        with self._lock:
+            self._nbytes += nbytes
+            now = time.monotonic()
+            if now - self._last_report < self.interval:
+                return
+            self._last_report = now
+            nbytes, count, elapsed = self._nbytes, self._count, now - self._started
+
+        self.logger.log(self.level, f'{count} transfers, {nbytes} bytes, {nbytes / elapsed / 2 ** 20:.2f}MB/s')
+
+    def finish(self, transfer: TransferProgress, error: tp.Optional[BaseException] = None):
+        with self._lock:
+            self._count += 1
+
+        if error is None:
+            self.logger.log(self.level, f'{transfer.desc}: {transfer.nbytes} bytes in {transfer.elapsed:.3f}s')
+        else:
+            self.logger.log(self.level, f'{transfer.desc}: failed after {transfer.nbytes} bytes ({error!r})')
+
+
+class CallbackSink(ProgressSink):
+    """ Forwards the events to the given callables """
+
+    def __init__(self,
+                 on_update: tp.Optional[tp.Callable[[TransferProgress, int], None]] = None,
+                 on_start: tp.Optional[tp.Callable[[TransferProgress], None]] = None,
+                 on_finish: tp.Optional[tp.Callable[[TransferProgress, tp.Optional[BaseException]], None]] = None):
+        self.on_update = on_update
+        self.on_start = on_start
+        self.on_finish = on_finish
+
+    def start(self, transfer: TransferProgress):
+        if self.on_start is not None:
+            self.on_start(transfer)
+
+    def update(self, transfer: TransferProgress, nbytes: int):
+        if self.on_update is not None:
+            self.on_update(transfer, nbytes)
+
+    def finish(self, transfer: TransferProgress, error: tp.Optional[BaseException] = None):
+        if self.on_finish is not None:
+            self.on_finish(transfer, error)
+
+
+class MultiSink(ProgressSink):
+    """ Forwards the events to several sinks """
+
+    def __init__(self, sinks: tp.Iterable[ProgressSink]):
+        self.sinks = list(sinks)
+
+    def start(self, transfer: TransferProgress):
+        for sink in self.sinks:
+            sink.start(transfer)
+
+    def update(self, transfer: TransferProgress, nbytes: int):
+        for sink in self.sinks:
+            sink.update(transfer, nbytes)
+
+    def finish(self, transfer: TransferProgress, error: tp.Optional[BaseException] = None):
+        for sink in self.sinks:
+            sink.finish(transfer, error)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+# The sink receiving the progress of all transfers with progress=True. Shared by all threads.
+_ambient_sink: tp.Optional[ProgressSink] = None
+
+
+@contextmanager
+def reporting(*sinks: ProgressSink):
+    """
+    Report the progress of all the transfers started with progress=True to the given sinks, from any thread,
+    for the duration of the context. The sinks are closed on exit.
+
+    Examples
+    --------
+    >> with reporting(TqdmSink(desc='Dataset')):
+    >>     with saver.concurrent(max_workers=16) as c:
+    >>         c.concurrent_load(keys)
+    """
+    global _ambient_sink
+
+    sink = sinks[0] if len(sinks) == 1 else MultiSink(sinks)
+    previous, _ambient_sink = _ambient_sink, sink
+    try:
+        yield sink
+    finally:
+        _ambient_sink = previous
+        sink.close()
+
+
+@contextmanager
+def track(f, progress: tp.Union[bool, ProgressSink], desc: str, method: str):
+    """
+    Report the bytes passing through the given method ('read' or 'write') of the stream f.
+
+    progress is either a sink, or a boolean. When True, the ambient sink (see reporting(...)) is used, or a
+    progress bar dedicated to this transfer if there is no ambient sink.
+    Yields the stream to use instead of f. When there's nothing to report to, f itself is yielded.
+    """
+
+    owned = False
+    if isinstance(progress, ProgressSink):
+        sink = progress
+    elif not progress:
+        sink = None
+    elif _ambient_sink is not None:
+        sink = _ambient_sink
+    else:
+        sink = TqdmSink(desc=desc)
+        owned = True
+
+    if sink is None:
+        yield f
+        return
+
+    transfer = TransferProgress(desc)
+    sink.start(transfer)
+    try:
+        yield ProgressStream(f, sink, transfer, method)
+    except BaseException as e:
+        sink.finish(transfer, error=e)
+        raise
+    else:
+        sink.finish(transfer)
+    finally:
+        if owned:
+            sink.close()
+
+
+class ProgressStream:
+    """ Wraps a stream and reports the bytes passing through one of its methods ('read' or 'write') """
+
+    def __init__(self, f, sink: ProgressSink, transfer: TransferProgress, method: str):
+        self._f = f
+        self._sink = sink
+        self._transfer = transfer
+
+        if method == 'read':
+            self.read = self._read
+            if hasattr(f, 'readinto'):
+                self.readinto = self._readinto
+        elif method == 'write':
+            self.write = self._write
+        else:
+            raise ValueError(f'Unsupported method {method}')
+
+    def __getattr__(self, item):
+        return getattr(self._f, item)
+
+    def __iter__(self):
+        return iter(self._f)
+
+    def _report(self, nbytes: int):
+        self._transfer.nbytes += nbytes
+        self._sink.update(self._transfer, nbytes)
+
+    def _read(self, *args, **kwargs):
+        data = self._f.read(*args, **kwargs)
+        if data:
+            self._report(len(data))
+        return data
+
+    def _readinto(self, b):
+        n = self._f.readinto(b)
+        if n:
+            self._report(n)
+        return n
+
+    def _write(self, b):
+        n = self._f.write(b)
+        self._report(len(b) if n is None else n)
+        return n
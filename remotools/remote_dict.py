@@ -6,10 +6,10 @@ from remotools.remotes import BaseRemote
 import typing as tp
 from functools import partial
 import logging
-from cachetools import LRUCache
 from collections import UserDict
 from remotools.remotes.exceptions import KeyNotFoundError
-from scalpl import Cut
+from remotools.parallel.executor import BoundedExecutor
+from remotools.parallel.saver import SaverProcessPool, BACKENDS
 from typing import Type
 from contextlib import contextmanager
 from operator import attrgetter
@@ -85,7 +85,7 @@ class RemoteDict(UserDict):
             return None
 
     @pool.setter
-    def pool(self, value: ThreadPoolExecutor):
+    def pool(self, value: tp.Union[BoundedExecutor, ThreadPoolExecutor, None]):
         self._pool = value
 
     def remote_key(self, key: tp.Optional[str]):
@@ -94,11 +94,37 @@ class RemoteDict(UserDict):
 
     # TODO what about nested calls here?
     @contextmanager
-    def parallel(self, **kwargs):
+    def parallel(self,
+                 max_in_flight: tp.Optional[int] = None,
+                 max_bytes_in_flight: tp.Optional[int] = None,
+                 getsizeof: tp.Optional[tp.Callable[[tp.Any], int]] = None,
+                 progress=True,
+                 backend='thread',
+                 max_processes: tp.Optional[int] = None,
+                 **kwargs):
+        """
+        Perform the operations in the context using ambient threads.
+
+        Saving blocks once max_in_flight objects or max_bytes_in_flight bytes (as estimated by getsizeof) are
+        submitted but not yet uploaded. All the uploads share a single progress bar.
+        With backend='process' the serialization of objects runs in max_processes worker processes
+        (see SaverProcessPool), while the uploads and downloads stay on the threads.
+        The remaining keyword arguments are passed to ThreadPoolExecutor.
+        """
+
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown backend {backend} (must be one of {BACKENDS})')
 
         # In case no pool is available, start one
         if self.pool is None:
-            self.pool = ThreadPoolExecutor(**kwargs)
+            self.pool = BoundedExecutor(max_in_flight=max_in_flight,
+                                        max_bytes_in_flight=max_bytes_in_flight,
+                                        getsizeof=getsizeof,
+                                        progress=progress,
+                                        desc=f'{self.__class__.__name__} upload',
+                                        processes=SaverProcessPool(max_workers=max_processes)
+                                        if backend == 'process' else None,
+                                        **kwargs)
             try:
                 yield self
 
@@ -118,6 +144,10 @@ class RemoteDict(UserDict):
     def parent(self):
         return self._parent
 
+    def flush(self):
+        """ Block until all the pending operations complete """
+        pass
+
     def commit(self, key: tp.Optional[str]=None, upload_params=None, progress=True, **kwargs) -> tp.Optional[str]:
         """
         Save the self.data attribute in a state file using a JSONPickleSaver over the remote.
@@ -189,6 +219,20 @@ class RemoteBlobDict(RemoteDict):
     def saver(self):
         return self.saver_cls(self.remote)
 
+    @property
+    def _saver_processes(self) -> tp.Optional[SaverProcessPool]:
+        return getattr(self.pool, 'processes', None)
+
+    def _save_fn(self) -> tp.Callable[..., str]:
+        if self._saver_processes is not None:
+            return partial(self._saver_processes.save, self.saver)
+        return self.saver.save
+
+    def _load_fn(self) -> tp.Callable[..., tp.Any]:
+        if self._saver_processes is not None:
+            return partial(self._saver_processes.load, self.saver)
+        return self.saver.load
+
     def save(self, obj: tp.Any, key: str, upload_params=None, progress=True, **kwargs):
         """ Stores the object using the provided saver in a parallel fashion """
 
@@ -199,13 +243,21 @@ class RemoteBlobDict(RemoteDict):
             obj = self._get_future_result(obj)
 
         if self.pool is not None:
+            if isinstance(self.pool, BoundedExecutor):
+                # Block while too much data is in flight. The per-object progress bars
+                # are replaced by the executor's aggregated one.
+                submit = partial(self.pool.submit_bounded, self.pool.getsizeof(obj))
+                progress = False
+            else:
+                submit = self.pool.submit
+
             # Submit the save task to the Executor
-            future: Future = self.pool.submit(self.saver.save,
-                                              obj=obj,
-                                              key=self.remote_key(key),
-                                              upload_params=upload_params,
-                                              progress=progress,
-                                              **kwargs)
+            future: Future = submit(self._save_fn(),
+                                    obj=obj,
+                                    key=self.remote_key(key),
+                                    upload_params=upload_params,
+                                    progress=progress,
+                                    **kwargs)
 
             # Keep the Future object in the executor. When the future finishes, that is,
             # when the object finishes uploading, or an error occurs, a callback is called to
@@ -236,7 +288,7 @@ class RemoteBlobDict(RemoteDict):
 
         if self.pool is not None:
             # Download the object in the Executor. When done, update the cache using the callback
-            future: Future = self.pool.submit(self.saver.load,
+            future: Future = self.pool.submit(self._load_fn(),
                                               key=obj,
                                               download_params=download_params,
                                               progress=progress,
@@ -276,13 +328,17 @@ class RemoteBlobDict(RemoteDict):
         for key in self.keys():
             yield key, self[key]
 
+    def flush(self):
+        """ Block until all the objects submitted for saving are uploaded """
+        for k in list(self.data.keys()):
+            obj = self.data.get(k)
+            if isinstance(obj, Future):
+                self._get_future_result(future=obj)
+
     def commit(self, key: tp.Optional[str]=None, upload_params=None, progress=True, **kwargs):
 
         # Make sure that everything was uploaded before committing
-        for k in self.data.keys():
-            obj = self.data[k]
-            if isinstance(obj, Future):
-                self._get_future_result(future=obj)
+        self.flush()
 
         return super(RemoteBlobDict, self).commit(key=key,
                                                   upload_params=upload_params,
@@ -302,6 +358,7 @@ class RemoteBlobDictWithLRUCache(RemoteBlobDict):
         super(RemoteBlobDictWithLRUCache, self).__init__(saver_cls=saver_cls, **kwargs)
         self.maxsize = maxsize
         self.getsizeof = getsizeof
+        from cachetools import LRUCache
         self._cache = LRUCache(maxsize=maxsize, getsizeof=getsizeof)
 
     @property
@@ -359,6 +416,11 @@ class CompositeRemoteDict(RemoteDict):
         dct._parent = None
         dct._extra_prefix = None
 
+    def flush(self):
+        """ Block until all the pending operations of all the children complete """
+        for remote_dict in self.data.values():
+            remote_dict.flush()
+
     def commit(self, key: tp.Optional[str]=None, upload_params=None, progress=True, **kwargs):
 
         # Commit all children
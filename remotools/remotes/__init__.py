@@ -1,11 +1,49 @@
-from .base import BaseRemote
-from .caching import CachingRemote, HFSLocalCachingRemote
-from .hfs import HFSRemote
-from .local import LocalRemote
-from .web import WebRemote
-from .uri import URIRemote
-from .composite import CompositeRemote
-
-# Dependent on extra packages
-from .extras.gs import GSRemote
-from .extras.s3 import S3Remote
+from .base import BaseRemote, KeyInfo, RemoteFile
+import importlib
+import typing as tp
+
+# The remotes are imported on first access (PEP 562), so that importing a single remote
+# doesn't pull in the dependencies of all the others (requests, sqlitedict, boto3, etc.)
+_LAZY = {
+    'CachingRemote': '.caching',
+    'HFSLocalCachingRemote': '.caching',
+    'HFSRemote': '.hfs',
+    'LocalRemote': '.local',
+    'MemoryRemote': '.memory',
+    'SharedMemoryRemote': '.memory',
+    'WebRemote': '.web',
+    'URIRemote': '.uri',
+    'CompositeRemote': '.composite',
+    'PeerRemote': '.peer',
+
+    # Dependent on extra packages
+    'GSRemote': '.extras.gs',
+    'S3Remote': '.extras.s3',
+}
+
+__all__ = ['BaseRemote', 'KeyInfo', 'RemoteFile'] + list(_LAZY)
+
+if tp.TYPE_CHECKING:
+    from .caching import CachingRemote, HFSLocalCachingRemote
+    from .hfs import HFSRemote
+    from .local import LocalRemote
+    from .memory import MemoryRemote, SharedMemoryRemote
+    from .web import WebRemote
+    from .uri import URIRemote
+    from .composite import CompositeRemote
+    from .peer import PeerRemote
+    from .extras.gs import GSRemote
+    from .extras.s3 import S3Remote
+
+
+def __getattr__(name: str):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return __all__
@@ -1,12 +1,38 @@
 from __future__ import annotations
-import tqdm
 from abc import ABC, abstractmethod
 import typing as tp
 from remotools.utils import keep_position
+from remotools.progress import ProgressSink, track
+from remotools.instrumentation import instrument
 from remotools.parallel.remote import ConcurrentRemote
 import io
 
 
+class KeyInfo(tp.NamedTuple):
+    """
+    Metadata of a remote object.
+
+    Attributes
+    ----------
+    key
+        The object key (in the context of the remote that produced it)
+
+    size
+        Size in bytes, if known
+
+    mtime
+        Last modification time as a POSIX timestamp, if known
+
+    hash
+        Content hash in the form '<algorithm>:<hex digest>', if known
+    """
+
+    key: str
+    size: tp.Optional[int] = None
+    mtime: tp.Optional[float] = None
+    hash: tp.Optional[str] = None
+
+
 class BaseRemote(ABC):
     """
     The base class from which all Remotes must inherit.
@@ -45,6 +71,19 @@ class BaseRemote(ABC):
     contains(key)
         Checks whether a given key exists in on the target storage
 
+    stat(key) -> KeyInfo
+        Returns the metadata of the object identified by key. Supported only by remotes implementing _stat(...)
+
+    download_range(f, key, start, end)
+        Copies the bytes [start, end) of a remote object to the stream f
+
+    open(key) -> RemoteFile
+        Returns a read-only, seekable stream over a remote object, fetching only the parts that are read
+
+    list(prefix, recursive, metadata) -> iterator of keys
+        Lazily iterates over the keys starting with a given prefix. Supported only by remotes implementing
+        _list(...)
+
     concurrent(**kwargs) -> ConcurrentRemote
         Converts the remote into a concurrent remote that utilizes threads to speed up the operations.
         Returns an instance of a ConcurrentRemote.
@@ -74,7 +113,8 @@ class BaseRemote(ABC):
 
         self.name = name or self.__class__.__name__
 
-    def download(self, f, key: str, progress=True, keep_stream_position=False, params: tp.Optional[dict]=None):
+    def download(self, f, key: str, progress: tp.Union[bool, ProgressSink] = True, keep_stream_position=False,
+                 params: tp.Optional[dict]=None):
         """
         Download a key to the provided stream.
 
@@ -87,7 +127,8 @@ class BaseRemote(ABC):
             Remote object identifier string
 
         progress
-            Show progress bar
+            Report the progress. Either a boolean or a ProgressSink (see remotools.progress).
+            When False, the stream is passed to the implementation as is.
 
         keep_stream_position
             Whether to revert to the current position in the stream after downloading
@@ -119,14 +160,14 @@ class BaseRemote(ABC):
         if params is None:
             params = {}
 
-        with self._download_progress_bar(f, key, progress=progress) as fp:
-            if keep_stream_position:
-                with keep_position(fp):
-                    self._download(fp, key, **params)
-            else:
-                self._download(fp, key, **params)
+        if not progress:
+            return self._download_stream(f, key, keep_stream_position=keep_stream_position, params=params)
 
-    def upload(self, f, key: str, progress=True, keep_stream_position=False, params: tp.Optional[dict]=None) -> str:
+        with track(f, progress, desc=f"[{self.name} DOWNLOAD] {key}", method='write') as fp:
+            self._download_stream(fp, key, keep_stream_position=keep_stream_position, params=params)
+
+    def upload(self, f, key: str, progress: tp.Union[bool, ProgressSink] = True, keep_stream_position=False,
+               params: tp.Optional[dict]=None) -> str:
         """
         Upload a stream to the provided key.
 
@@ -141,7 +182,8 @@ class BaseRemote(ABC):
             Remote object identifier string
 
         progress
-            Show progress bar
+            Report the progress. Either a boolean or a ProgressSink (see remotools.progress).
+            When False, the stream is passed to the implementation as is.
 
         keep_stream_position
             Whether to revert to the current position in the stream after uploading
@@ -169,12 +211,28 @@ class BaseRemote(ABC):
         if params is None:
             params = {}
 
-        with self._upload_progress_bar(f, key, progress=progress) as fp:
-            if keep_stream_position:
-                with keep_position(fp):
-                    return self._upload(fp, key, **params)
-            else:
-                return self._upload(fp, key, **params)
+        if not progress:
+            return self._upload_stream(f, key, keep_stream_position=keep_stream_position, params=params)
+
+        with track(f, progress, desc=f"[{self.name} UPLOAD] {key}", method='read') as fp:
+            return self._upload_stream(fp, key, keep_stream_position=keep_stream_position, params=params)
+
+    def _download_stream(self, f, key: str, keep_stream_position: bool, params: dict):
+        # The span is innermost so that it measures the transferred bytes before the position is restored
+        if keep_stream_position:
+            with keep_position(f), instrument(self.name, 'download', stream=f):
+                self._download(f, key, **params)
+        else:
+            with instrument(self.name, 'download', stream=f):
+                self._download(f, key, **params)
+
+    def _upload_stream(self, f, key: str, keep_stream_position: bool, params: dict) -> str:
+        if keep_stream_position:
+            with keep_position(f), instrument(self.name, 'upload', stream=f):
+                return self._upload(f, key, **params)
+        else:
+            with instrument(self.name, 'upload', stream=f):
+                return self._upload(f, key, **params)
 
     def contains(self, key: str) -> bool:
         """
@@ -190,13 +248,153 @@ class BaseRemote(ABC):
         True if the given key exists and False otherwise.
 
         """
-        return self._contains(key)
+        with instrument(self.name, 'contains'):
+            return self._contains(key)
+
+    def stat(self, key: str) -> KeyInfo:
+        """
+        Get the metadata of the object identified by the given key.
+
+        Parameters
+        ----------
+        key
+            Remote object identifier string
+
+        Raises
+        ------
+        KeyNotFoundError
+            When the key doesn't exist on the storage
+
+        NotImplementedError
+            When the remote doesn't support metadata queries
+
+        Returns
+        -------
+        A KeyInfo instance. Fields that the storage doesn't provide are None.
+
+        """
+        with instrument(self.name, 'stat'):
+            return self._stat(key)
+
+    def _stat(self, key: str) -> KeyInfo:
+        raise NotImplementedError(f"Metadata queries are not supported for {self.__class__.__name__}")
+
+    def download_range(self, f, key: str, start: int = 0, end: tp.Optional[int] = None,
+                       progress: tp.Union[bool, ProgressSink] = False, params: tp.Optional[dict] = None):
+        """
+        Download the bytes [start, end) of a key to the provided stream.
+
+        Parameters
+        ----------
+        f
+            A stream (file-like) object
+
+        key
+            Remote object identifier string
+
+        start
+            Offset of the first byte
+
+        end
+            Offset past the last byte. None means the end of the object. Ranges past the end of the object
+            are truncated (so fewer bytes than requested may be written).
+
+        progress
+            Report the progress. Either a boolean or a ProgressSink (see remotools.progress).
+
+        params
+            Extra parameter dictionary passed to _download_range(...) as keyword arguments
+
+        Raises
+        ------
+        Same as download(...)
+
+        """
+        if params is None:
+            params = {}
+
+        if start < 0 or (end is not None and end < start):
+            raise ValueError(f'Invalid range [{start}, {end})')
+
+        if not progress:
+            with instrument(self.name, 'download_range', stream=f):
+                return self._download_range(f, key, start, end, **params)
+
+        with track(f, progress, desc=f"[{self.name} DOWNLOAD] {key}[{start}:{end}]", method='write') as fp, \
+                instrument(self.name, 'download_range', stream=fp):
+            self._download_range(fp, key, start, end, **params)
+
+    def _download_range(self, f, key: str, start: int, end: tp.Optional[int], **kwargs):
+        # Remotes without native support for ranges download the whole object
+        buffer = io.BytesIO()
+        self._download(buffer, key, **kwargs)
+        view = buffer.getbuffer()
+        try:
+            f.write(view[start:end])
+        finally:
+            view.release()
+
+    def open(self, key: str, block_size: int = 2 ** 20, params: tp.Optional[dict] = None) -> RemoteFile:
+        """
+        Open a remote object as a read-only, seekable binary stream.
+
+        The object is fetched with ranged downloads, one block at a time, so readers that seek (e.g.
+        Parquet or zip readers) download only what they read. Remotes that don't support metadata queries
+        (see stat(...)) download the whole object when the stream is opened.
+
+        Parameters
+        ----------
+        key
+            Remote object identifier string
+
+        block_size
+            Minimal number of bytes fetched per ranged download
+
+        params
+            Extra parameter dictionary passed to _download_range(...) as keyword arguments
+        """
+        return RemoteFile(self, key, block_size=block_size, params=params)
+
+    def list(self, prefix: str = '', recursive=True, metadata=False,
+             page_size: tp.Optional[int] = None) -> tp.Iterator[tp.Union[str, KeyInfo]]:
+        """
+        Iterate over the keys of the objects whose key starts with the given prefix.
+
+        The keys are produced lazily (page by page for paginated storage APIs), so the memory usage does not
+        depend on the number of keys. The order of the keys is implementation specific.
+
+        Parameters
+        ----------
+        prefix
+            Only keys starting with this string are listed
+
+        recursive
+            If False, keys containing a '/' after the prefix are not listed. Instead, each such 'directory'
+            is listed once as the prefix up to and including the '/' (e.g. 'a/b/' for the key 'a/b/c').
+
+        metadata
+            If True, yield KeyInfo instances instead of strings. 'Directories' have all their metadata
+            fields set to None.
+
+        page_size
+            Number of keys requested from the storage per call (for paginated APIs)
+
+        Raises
+        ------
+        NotImplementedError
+            When the remote doesn't support listing
+
+        Returns
+        -------
+        An iterator over keys (or KeyInfo instances)
 
-    def _upload_progress_bar(self, f, key: str, progress: bool = True):
-        return tqdm.tqdm.wrapattr(f, "read", desc=f"[{self.name} UPLOAD] {key}", disable=not progress)
+        """
+        for info in self._list(prefix, recursive=recursive, metadata=metadata, page_size=page_size):
+            yield info if metadata else info.key
 
-    def _download_progress_bar(self, f, key: str, progress: bool = True):
-        return tqdm.tqdm.wrapattr(f, "write", desc=f"[{self.name} DOWNLOAD] {key}", disable=not progress)
+    def _list(self, prefix: str, recursive=True, metadata=False,
+              page_size: tp.Optional[int] = None) -> tp.Iterator[KeyInfo]:
+        raise NotImplementedError(f"Listing is not supported for {self.__class__.__name__}")
 
     @abstractmethod
     def _download(self, f, key: str, **kwargs):
@@ -217,6 +415,108 @@ class BaseRemote(ABC):
              download_params: tp.Optional[dict]=None,
              upload_params: tp.Optional[dict]=None) -> str:
 
+        with instrument(self.name, 'copy'):
+            f = io.BytesIO()
+            self.download(f, src_key, progress=progress, keep_stream_position=True, params=download_params)
+            return self.upload(f, dst_key, progress=progress, params=upload_params)
+
+
+class RemoteFile(io.RawIOBase):
+    """
+    A read-only, seekable binary stream over a remote object, reading it with ranged downloads.
+
+    The last downloaded block is kept, so that small sequential reads don't result in a download each.
+    """
+
+    def __init__(self, remote: BaseRemote, key: str, block_size: int = 2 ** 20, params: tp.Optional[dict] = None):
+        super(RemoteFile, self).__init__()
+        self.remote = remote
+        self.key = key
+        self.block_size = block_size
+        self.params = params
+        self._position = 0
+        self._block_start = 0
+        self._block = b''
+
+        try:
+            self._size = remote.stat(key).size
+        except NotImplementedError:
+            self._size = None
+
+        # Without the size the range requests can't be planned, so the object is downloaded as a single block
+        if self._size is None:
+            f = io.BytesIO()
+            remote.download(f, key, progress=False, params=params)
+            self._block = f.getvalue()
+            self._size = len(self._block)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f'Invalid whence ({whence})')
+
+        if position < 0:
+            raise ValueError(f'Negative seek position {position}')
+
+        self._position = position
+        return position
+
+    def readall(self):
+        return self.read(max(0, self._size - self._position))
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.readall()
+        return super(RemoteFile, self).read(size)
+
+    def readinto(self, b):
+        with memoryview(b) as view, view.cast('B') as target:
+            n = min(target.nbytes, max(0, self._size - self._position))
+            if n == 0:
+                return 0
+
+            start, end = self._position, self._position + n
+            block_end = self._block_start + len(self._block)
+            if not (self._block_start <= start and end <= block_end):
+                if n >= self.block_size:
+                    # Large reads go directly to the target, without replacing the current block
+                    received = self._fetch(start, end)
+                    target[:len(received)] = received
+                    self._position += len(received)
+                    return len(received)
+
+                self._block_start = start
+                self._block = self._fetch(start, min(self._size, start + self.block_size))
+
+            offset = start - self._block_start
+            n = min(n, len(self._block) - offset)
+            target[:n] = self._block[offset: offset + n]
+
+        self._position += n
+        return n
+
+    def _fetch(self, start: int, end: int) -> bytes:
         f = io.BytesIO()
-        self.download(f, src_key, progress=progress, keep_stream_position=True, params=download_params)
-        return self.upload(f, dst_key, progress=progress, params=upload_params)
+        self.remote.download_range(f, self.key, start, end, params=self.params)
+        return f.getvalue()
@@ -1,19 +1,34 @@
 from __future__ import annotations
-from remotools.remotes.base import BaseRemote
+from remotools.remotes.base import BaseRemote, KeyInfo
+from remotools.remotes.exceptions import KeyNotFoundError
 from remotools.remotes.hfs import HFSRemote
 from remotools.remotes.local import LocalRemote
 from remotools.parallel.remote import ConcurrentRemote
+from remotools.instrumentation import instrument, count
+from remotools.utils import is_seekable, is_readable, spool
+from shutil import copyfileobj
 from concurrent.futures import Future
+from collections import OrderedDict
 import typing as tp
 from io import BytesIO
-from sqlitedict import SqliteDict
 import os.path as osp
 import os
 import logging
+import tempfile
+import threading
+import time
+
+if tp.TYPE_CHECKING:
+    from remotools.parallel.prefetch import Prefetcher
 
 # This will prevent SqliteDict from showing tons of garbage
 logging.getLogger('sqlitedict').setLevel(level=logging.WARNING)
 
+logger = logging.getLogger(__name__)
+
+# Non-seekable streams are buffered in memory up to this size, and in a temporary file beyond it
+SPOOL_SIZE = 2 ** 26
+
 
 class CachingRemote(BaseRemote):
     """
@@ -35,6 +50,24 @@ class CachingRemote(BaseRemote):
     keystore
         Dictionary like object storing the mapping between remote keys and cache keys. For example SqliteDict
 
+    write_behind
+        Uploads are committed to the cache and return immediately, and are drained to the remote by background
+        threads. The remote must preserve the keys it is given (upload returns the given key). Downloads of
+        pending keys are served from the cache, and list() includes them. Call flush() to wait for the pending
+        uploads.
+
+    journal
+        Dictionary like object recording the pending uploads (remote key -> (cache key, upload params)) in
+        write-behind mode. The upload params are stored along, so they must be picklable for a persistent journal.
+        Use a persistent one (e.g. SqliteDictKeystore) so that the uploads pending when the process exits are
+        drained by the next CachingRemote created over it. Defaults to an in-memory dict.
+
+    max_pending
+        Maximal number of pending uploads. Uploads block while the limit is reached.
+
+    drain_workers
+        Number of threads draining the pending uploads
+
     Examples
     --------
     >> with SqliteDict(filename='/home/<user>/store.db', tablename='keystore', autocommit=True) as keystore:
@@ -46,13 +79,40 @@ class CachingRemote(BaseRemote):
     The next time the code above is called the object will be taken from the local cache
     """
 
-    def __init__(self, remote: BaseRemote, cache: BaseRemote, keystore):
+    def __init__(self, remote: BaseRemote, cache: BaseRemote, keystore, write_behind: bool = False, journal=None,
+                 max_pending: int = 1024, drain_workers: int = 4):
         super(CachingRemote, self).__init__(name=f'{self.__class__.__name__}<{remote.name}, {cache.name}>')
         self.remote = remote
         self.cache = cache
         self.keystore = keystore
+        self.write_behind = write_behind
+        self.journal = journal if journal is not None else {}
+        self.max_pending = max_pending
+        self.drain_workers = drain_workers
+
+        # An attached Prefetcher, notified of the downloads (see prefetch(...))
+        self.prefetcher = None
+
+        # The pending uploads (remote key -> (cache key, upload params)) in order, mirroring the journal
+        self._pending: tp.Dict[str, tp.Tuple[str, dict]] = OrderedDict(self.journal.items())
+        self._draining: tp.Set[str] = set()
+        self._errors: tp.Dict[str, BaseException] = {}
+        self._retries: tp.Dict[str, tp.Tuple[int, float]] = {}     # Key -> (failures, time of the next retry)
+        self._condition = threading.Condition()
+        self._drainers = 0
+
+        # Uploads left pending by a previous process
+        if self._pending:
+            logger.info(f'{self.name}: resuming {len(self._pending)} pending uploads')
+            self._start_drainers()
 
     def _download(self, f, key: str, override_cache=False, **kwargs):
+        if self.prefetcher is not None:
+            self.prefetcher.accessed(key)
+
+        # Pending uploads only exist in the cache
+        override_cache = override_cache and key not in self._pending
+
         # Check if exists locally
         if (not override_cache) and key in self.keystore:
             # If the key is found in the keystore, look for it in the cache, and get it if possible
@@ -60,25 +120,61 @@ class CachingRemote(BaseRemote):
 
             if self.cache.contains(cache_key):
                 self.cache.download(f, cache_key, progress=False, params=kwargs)
+                count(self.name, 'cache_hit')
                 return
 
         # If we got here that means the key doesn't exist either in the keystore or in the cache
         # Lets download it and update the cache and the keystore
-        self.remote.download(f, key, progress=False, params=kwargs, keep_stream_position=True)
-        cache_key = self.cache.upload(f, key, progress=False)
+        count(self.name, 'cache_miss')
+        if is_seekable(f) and is_readable(f):
+            self.remote.download(f, key, progress=False, params=kwargs, keep_stream_position=True)
+            cache_key = self.cache.upload(f, key, progress=False)
+
+        else:
+            # Streams that can't be read back (e.g. pipes) receive the object once it is in the cache
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spooled:
+                self.remote.download(spooled, key, progress=False, params=kwargs, keep_stream_position=True)
+                cache_key = self.cache.upload(spooled, key, progress=False, keep_stream_position=True)
+                copyfileobj(spooled, f)
 
         if key in self.keystore:
             del self.keystore[key]
 
         self.keystore[key] = cache_key
 
+    def _download_range(self, f, key: str, start: int, end: tp.Optional[int], override_cache=False, **kwargs):
+        if self.prefetcher is not None:
+            self.prefetcher.accessed(key)
+
+        override_cache = override_cache and key not in self._pending
+        if (not override_cache) and key in self.keystore:
+            cache_key = self.keystore[key]
+            if self.cache.contains(cache_key):
+                self.cache.download_range(f, cache_key, start, end, params=kwargs)
+                count(self.name, 'cache_hit')
+                return
+
+        # Parts of objects are not cached
+        count(self.name, 'cache_miss')
+        self.remote.download_range(f, key, start, end, params=kwargs)
+
     def _upload(self, f, key: str, **kwargs):
-        # Upload to remote and get the new key
-        key = self.remote.upload(f, key, progress=False, params=kwargs, keep_stream_position=True)
+        if self.write_behind:
+            return self._upload_behind(f, key, **kwargs)
 
-        # Update the cache and the key store
-        cache_key = self.cache.upload(f, key, progress=False)
-        self.keystore[key] = cache_key
+        # The stream is read twice, so non-seekable streams are spooled first
+        spooled = spool(f, max_size=SPOOL_SIZE)
+        try:
+            # Upload to remote and get the new key
+            key = self.remote.upload(spooled, key, progress=False, params=kwargs, keep_stream_position=True)
+
+            # Update the cache and the key store
+            cache_key = self.cache.upload(spooled, key, progress=False)
+            self.keystore[key] = cache_key
+
+        finally:
+            if spooled is not f:
+                spooled.close()
 
         return key
 
@@ -92,6 +188,41 @@ class CachingRemote(BaseRemote):
         # Check remote if key wasn't found in the cache
         return self.remote.contains(key)
 
+    def _stat(self, key: str) -> KeyInfo:
+        entry = self._pending.get(key)
+        if entry is not None:
+            return self.cache.stat(entry[0])._replace(key=key)
+        return self.remote.stat(key)
+
+    def _list(self, prefix: str, recursive=True, metadata=False, page_size=None) -> tp.Iterator[KeyInfo]:
+        # Pending uploads are listed first (as they are in the cache), and skipped in the listing of the remote
+        with self._condition:
+            pending = [(key, cache_key) for key, (cache_key, _) in self._pending.items() if key.startswith(prefix)]
+
+        listed = set()
+        for key, cache_key in pending:
+            if not recursive and '/' in key[len(prefix):]:
+                directory = key[:key.index('/', len(prefix)) + 1]
+                if directory not in listed:
+                    listed.add(directory)
+                    yield KeyInfo(key=directory)
+                continue
+
+            listed.add(key)
+            if not metadata:
+                yield KeyInfo(key=key)
+                continue
+
+            try:
+                yield self.cache.stat(cache_key)._replace(key=key)
+            except (KeyNotFoundError, NotImplementedError):
+                yield KeyInfo(key=key)
+
+        for info in self.remote.list(prefix, recursive=recursive, metadata=metadata, page_size=page_size):
+            info = info if metadata else KeyInfo(key=info)
+            if info.key not in listed:
+                yield info
+
     # Extra methods
     def fetch(self, key: str, override_cache=False, progress=True, **kwargs):
         """ Calling this method will make sure that the given key is found in the cache """
@@ -111,9 +242,150 @@ class CachingRemote(BaseRemote):
 
         self.keystore[key] = cache_key
 
+    def materialize(self, key: str, dest_path: str, override_cache=False, **kwargs) -> str:
+        """
+        Place the object of the given key as a file at dest_path, straight from the cache (see HFSRemote.materialize,
+        whose keyword arguments are accepted). The object is fetched into the cache first if necessary.
+
+        Returns the method used ('reflink', 'hardlink', 'copy' or 'download').
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.accessed(key)
+
+        self.fetch(key, override_cache=override_cache and key not in self._pending, progress=False)
+        cache_key = self.keystore[key]
+
+        if isinstance(self.cache, HFSRemote):
+            return self.cache.materialize(cache_key, dest_path, **kwargs)
+
+        with open(dest_path, 'wb') as f:
+            self.cache.download(f, cache_key, progress=False)
+        return 'download'
+
     def concurrent(self, **kwargs)-> ConcurrentCachingRemote:
         return ConcurrentCachingRemote(self, **kwargs)
 
+    def prefetch(self, keys: tp.Optional[tp.Iterable[str]] = None, window: int = 16, max_workers: int = 4,
+                 access_log: tp.Optional[str] = None) -> Prefetcher:
+        """
+        Returns a Prefetcher warming the cache ahead of the downloads, along the given keys or the keys recorded in
+        access_log (see remotools.parallel.prefetch.Prefetcher). It is attached to the remote while used as a
+        context manager (or between its start() and close()).
+        """
+        from remotools.parallel.prefetch import Prefetcher
+        return Prefetcher(self, keys=keys, window=window, max_workers=max_workers, access_log=access_log)
+
+    # Write-behind
+    @property
+    def pending(self) -> int:
+        """ Number of uploads not yet drained to the remote """
+        with self._condition:
+            return len(self._pending)
+
+    @property
+    def errors(self) -> tp.Dict[str, BaseException]:
+        """ The last error of each pending upload that failed (failed uploads are retried) """
+        with self._condition:
+            return dict(self._errors)
+
+    def flush(self, timeout: tp.Optional[float] = None):
+        """
+        Wait until all the uploads pending so far are drained to the remote.
+
+        Raises TimeoutError if they aren't drained within timeout seconds (e.g. when the remote keeps failing,
+        see errors).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            # Keys are re-queued at the end when they are uploaded again, so waiting for the keys pending now
+            # is enough
+            waiting = set(self._pending)
+            while waiting & (set(self._pending) | self._draining):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f'{len(self._pending)} uploads are still pending '
+                                       f'({len(self._errors)} failing)')
+                self._condition.wait(remaining)
+
+    def _upload_behind(self, f, key: str, **kwargs) -> str:
+        with self._condition:
+            while len(self._pending) >= self.max_pending and key not in self._pending:
+                self._condition.wait()
+
+        with instrument(self.name, 'upload_behind'):
+            cache_key = self.cache.upload(f, key, progress=False)
+            self.keystore[key] = cache_key
+
+            # The upload params are applied when the upload is drained
+            with self._condition:
+                self.journal[key] = cache_key, kwargs
+                self._pending.pop(key, None)
+                self._pending[key] = cache_key, kwargs
+                self._errors.pop(key, None)
+                self._retries.pop(key, None)
+                self._condition.notify_all()
+
+        self._start_drainers()
+        return key
+
+    def _start_drainers(self):
+        with self._condition:
+            for _ in range(self.drain_workers - self._drainers):
+                threading.Thread(target=self._drain, name=f'{self.__class__.__name__}-drain', daemon=True).start()
+                self._drainers += 1
+
+    def _next_pending(self) -> tp.Optional[tp.Tuple[str, tp.Tuple[str, dict]]]:
+        """ The oldest pending upload that isn't being drained or retried yet (call while holding the lock) """
+        now = time.monotonic()
+        for key, entry in self._pending.items():
+            if key not in self._draining and self._retries.get(key, (0, 0.))[1] <= now:
+                return key, entry
+        return None
+
+    def _drain(self):
+        while True:
+            with self._condition:
+                item = self._next_pending()
+                while item is None:
+                    if not self._pending:
+                        # The drainer exits when idle, and is restarted by the next upload
+                        self._drainers -= 1
+                        return
+                    self._condition.wait(timeout=1.)
+                    item = self._next_pending()
+
+                key, entry = item
+                self._draining.add(key)
+
+            try:
+                cache_key, params = entry
+                with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spooled:
+                    self.cache.download(spooled, cache_key, progress=False, keep_stream_position=True)
+                    self.remote.upload(spooled, key, progress=False, params=params)
+
+            except Exception as e:
+                logger.warning(f'{self.name}: failed uploading {key} (will retry): {e!r}')
+                count(self.name, 'upload_behind_error')
+                with self._condition:
+                    # Exponential backoff, up to a minute
+                    failures = self._retries.get(key, (0, 0.))[0] + 1
+                    self._retries[key] = failures, time.monotonic() + min(2. ** failures, 60.)
+                    self._errors[key] = e
+
+            else:
+                with self._condition:
+                    # Unless the key was uploaded again in the meantime
+                    if self._pending.get(key) == entry:
+                        del self._pending[key]
+                        del self.journal[key]
+                    self._errors.pop(key, None)
+                    self._retries.pop(key, None)
+
+            finally:
+                with self._condition:
+                    self._draining.discard(key)
+                    self._condition.notify_all()
+
 
 class ConcurrentCachingRemote(ConcurrentRemote):
     """ An adaptation of the ConcurrentRemote class to support fetching """
@@ -137,32 +409,64 @@ class SqliteDictKeystore:
     def __init__(self, filename):
         self.filename = filename
 
+    def _open(self):
+        from sqlitedict import SqliteDict
+        return SqliteDict(filename=self.filename, autocommit=True)
+
     def __getitem__(self, item):
-        with SqliteDict(filename=self.filename, autocommit=True) as db:
+        with instrument(self.__class__.__name__, 'get'), self._open() as db:
             return db[item]
 
     def __setitem__(self, key, value):
-        with SqliteDict(filename=self.filename, autocommit=True) as db:
+        with instrument(self.__class__.__name__, 'set'), self._open() as db:
             db[key] = value
 
     def __contains__(self, item):
-        with SqliteDict(filename=self.filename, autocommit=True) as db:
+        with instrument(self.__class__.__name__, 'contains'), self._open() as db:
             return item in db
 
+    def __delitem__(self, key):
+        with instrument(self.__class__.__name__, 'delete'), self._open() as db:
+            del db[key]
+
+    def get(self, key, default=None):
+        with instrument(self.__class__.__name__, 'get'), self._open() as db:
+            return db.get(key, default)
+
+    def items(self) -> tp.List[tp.Tuple[str, tp.Any]]:
+        with self._open() as db:
+            return list(db.items())
+
 
 class HFSLocalCachingRemote(CachingRemote):
-    """ A specialized version of CachingRemote initializes a local cache and provides a keystore """
+    """
+    A specialized version of CachingRemote initializes a local cache and provides a keystore.
+
+    The cached files are verified against their hash the first time they are read, and again only if they change
+    (verify='first', see HFSRemote). The verified files are recorded next to the keystore. Pass e.g.
+    hfs_params={'verify': 'always'} to verify every read.
+    """
 
-    def __init__(self, remote: BaseRemote, local_cache_path: str, hfs_params: tp.Optional[tp.Dict]=None):
+    def __init__(self, remote: BaseRemote, local_cache_path: str, hfs_params: tp.Optional[tp.Dict]=None,
+                 write_behind: bool = False, **kwargs):
 
         # Expand environmental variables in the given path and create the directory
         local_cache_path = os.path.realpath(os.path.expandvars(local_cache_path))
         os.makedirs(local_cache_path, exist_ok=True)
+        journal_path = osp.join(local_cache_path, '.pending')
+        hfs_params = {'verify': 'first',
+                      'verified': SqliteDictKeystore(filename=osp.join(local_cache_path, '.verified')),
+                      **(hfs_params or {})}
 
         super(HFSLocalCachingRemote, self).__init__(remote=remote,
                                                     cache=HFSRemote(LocalRemote(prefix=local_cache_path),
-                                                                    **(hfs_params or {})),
+                                                                    **hfs_params),
                                                     # keystore=SqliteDict(filename=osp.join(local_cache_path, '.index'),
                                                     #                     autocommit=True),
                                                     keystore=SqliteDictKeystore(filename=osp.join(local_cache_path,
-                                                                                                  '.index')))
+                                                                                                  '.index')),
+                                                    write_behind=write_behind,
+                                                    # The pending uploads survive the process
+                                                    journal=SqliteDictKeystore(filename=journal_path)
+                                                    if write_behind or osp.exists(journal_path) else None,
+                                                    **kwargs)
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from remotools.remotes.base import BaseRemote
+from remotools.remotes.base import BaseRemote, KeyInfo
 from remotools.remotes.local import LocalRemote
 from remotools.remotes.web import WebRemote
 from collections import UserDict
@@ -29,7 +29,7 @@ class CompositeRemote(BaseRemote):
 
     def __init__(self, remotes: tp.Optional[dict]=None, *args, **kwargs):
         super(CompositeRemote, self).__init__(*args, **kwargs)
-        self.remotes = _RemotesDict(dict={'%': LocalRemote()})
+        self.remotes = _RemotesDict({'%': LocalRemote()})
         self.remotes.update(remotes or {})
 
     @staticmethod
@@ -48,6 +48,14 @@ class CompositeRemote(BaseRemote):
         remote = self.remotes[remote_name]
         remote.download(f, remote_key, progress=False, params=kwargs)
 
+    def _download_range(self, f, key: str, start: int, end: tp.Optional[int], **kwargs):
+        remote_name, remote_key = self.parse_key(key)
+        if remote_name not in self.remotes:
+            raise KeyNotFoundError(f'No such remote {remote_name}')
+
+        remote = self.remotes[remote_name]
+        remote.download_range(f, remote_key, start, end, params=kwargs)
+
     def _upload(self, f, key: str, **kwargs) -> str:
         remote_name, remote_key = self.parse_key(key)
         if remote_name not in self.remotes:
@@ -65,6 +73,32 @@ class CompositeRemote(BaseRemote):
         remote = self.remotes[remote_name]
         return remote.contains(remote_key)
 
+    def _stat(self, key: str) -> KeyInfo:
+        remote_name, remote_key = self.parse_key(key)
+        if remote_name not in self.remotes:
+            raise KeyNotFoundError(f'No such remote {remote_name}')
+
+        remote = self.remotes[remote_name]
+        return remote.stat(remote_key)._replace(key=key)
+
+    def _list(self, prefix: str, recursive=True, metadata=False, page_size=None) -> tp.Iterator[KeyInfo]:
+        if CompositeRemote.SEPARATOR in prefix:
+            remote_name, remote_key = self.parse_key(prefix)
+            names = [remote_name] if remote_name in self.remotes else []
+
+        # Without a separator the listing spans all the remotes whose name matches the prefix, except for
+        # the reserved ones (that would list the whole local file system)
+        else:
+            remote_key = ''
+            names = [name for name in self.remotes if name.startswith(prefix) and name != '%']
+
+        for name in names:
+            remote = self.remotes[name]
+            for info in remote.list(remote_key, recursive=recursive, metadata=metadata, page_size=page_size):
+                if not metadata:
+                    info = KeyInfo(key=info)
+                yield info._replace(key=f'{name}{CompositeRemote.SEPARATOR}{info.key}')
+
 
 class _RemotesDict(UserDict):
     """
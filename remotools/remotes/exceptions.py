@@ -41,3 +41,7 @@ class UnknownError(Exception):
     """
 
 
+class NotModifiedError(Exception):
+    """
+    This exception is raised by a conditional download when the remote object hasn't changed
+    """
@@ -1,4 +1,6 @@
-from remotools.remotes.base import BaseRemote
+import base64
+import typing as tp
+from remotools.remotes.base import BaseRemote, KeyInfo
 from remotools.utils import join
 from remotools.remotes.exceptions import KeyNotFoundError, IllegalKeyError
 
@@ -58,6 +60,32 @@ class GSRemote(BaseRemote):
         except NotFound as e:
             raise KeyNotFoundError(f"Key {key} not found") from e
 
+    def _download_range(self, f, key: str, start: int, end: tp.Optional[int], **kwargs):
+
+        from google.cloud import storage
+        from google.cloud.exceptions import NotFound
+        from google.api_core.exceptions import RequestRangeNotSatisfiable
+
+        path = join(self.prefix, key)
+
+        result = path.split(sep=KEY_SEPARATOR, maxsplit=2)
+        if len(result) < 3:
+            raise IllegalKeyError(f'Full path {path} is too short (must contain at least 2 separators)')
+        project, bucket, blob = result
+
+        if end is not None and end <= start:
+            return
+
+        try:
+            # The end offset is inclusive
+            storage.Client(project=project, credentials=self.credentials).bucket(bucket).blob(blob)\
+                .download_to_file(f, start=start, end=end - 1 if end is not None else None)
+        except NotFound as e:
+            raise KeyNotFoundError(f"Key {key} not found") from e
+        except RequestRangeNotSatisfiable:
+            # The range starts past the end of the object
+            return
+
     def _upload(self, f, key: str, **kwargs) -> str:
 
         from google.cloud import storage
@@ -87,3 +115,74 @@ class GSRemote(BaseRemote):
         return storage.Client(project=project,
                               credentials=self.credentials).bucket(bucket).blob(key).exists()
 
+
+    def _stat(self, key: str) -> KeyInfo:
+
+        from google.cloud import storage
+
+        path = join(self.prefix, key)
+
+        result = path.split(sep=KEY_SEPARATOR, maxsplit=2)
+        if len(result) < 3:
+            raise IllegalKeyError(f'Full path {path} is too short (must contain at least 2 separators)')
+        project, bucket, blob = result
+
+        blob = storage.Client(project=project,
+                              credentials=self.credentials).bucket(bucket).get_blob(blob)
+        if blob is None:
+            raise KeyNotFoundError(f"Key {key} not found")
+
+        return KeyInfo(key=key,
+                       size=blob.size,
+                       mtime=blob.updated.timestamp() if blob.updated is not None else None,
+                       hash=f'md5:{base64.b64decode(blob.md5_hash).hex()}' if blob.md5_hash else None)
+
+    def _list(self, prefix: str, recursive=True, metadata=False, page_size=None) -> tp.Iterator[KeyInfo]:
+
+        from google.cloud import storage
+
+        path = join(self.prefix, prefix)
+
+        # Listing a 'directory' must not match its siblings sharing the same name prefix
+        if path and (not prefix or prefix.endswith(KEY_SEPARATOR)):
+            path += KEY_SEPARATOR
+
+        result = path.split(sep=KEY_SEPARATOR, maxsplit=2)
+        if len(result) < 2 or not result[1]:
+            raise IllegalKeyError(f'Full path {path} is too short (must contain a project and a bucket)')
+        project, bucket = result[:2]
+        blob_prefix = result[2] if len(result) > 2 else ''
+
+        blobs = storage.Client(project=project,
+                               credentials=self.credentials).list_blobs(bucket,
+                                                                        prefix=blob_prefix,
+                                                                        delimiter=None if recursive else KEY_SEPARATOR,
+                                                                        page_size=page_size)
+
+        root = join(self.prefix)
+        seen_prefixes = set()
+        for page in blobs.pages:
+            for blob in page:
+                key = _relative_key(root, join(project, bucket, blob.name))
+                if not metadata:
+                    yield KeyInfo(key=key)
+                    continue
+
+                yield KeyInfo(key=key,
+                              size=blob.size,
+                              mtime=blob.updated.timestamp() if blob.updated is not None else None,
+                              hash=f'md5:{base64.b64decode(blob.md5_hash).hex()}' if blob.md5_hash else None)
+
+            # The same 'directory' may be reported by several pages
+            for blob_prefix in page.prefixes:
+                if blob_prefix in seen_prefixes:
+                    continue
+                seen_prefixes.add(blob_prefix)
+                yield KeyInfo(key=_relative_key(root, join(project, bucket, blob_prefix)) + KEY_SEPARATOR)
+
+
+def _relative_key(root: str, path: str) -> str:
+    """ Strips the remote's prefix from a full path """
+    if not root:
+        return path
+    return path[len(root):].lstrip(KEY_SEPARATOR)
@@ -1,4 +1,5 @@
-from remotools.remotes.base import BaseRemote
+import typing as tp
+from remotools.remotes.base import BaseRemote, KeyInfo
 from remotools.utils import join
 from io import BufferedReader
 from remotools.remotes.exceptions import UnknownError, KeyNotFoundError
@@ -51,6 +52,35 @@ class S3Remote(BaseRemote):
         except ClientError as e:
             raise KeyNotFoundError from e
 
+    def _download_range(self, f, key: str, start: int, end: tp.Optional[int], **kwargs):
+        import boto3
+        from botocore.exceptions import ClientError
+
+        path = join(self.prefix, key)
+        result = path.split(sep=KEY_SEPARATOR, maxsplit=1)
+        if len(result) < 2:
+            raise KeyNotFoundError(f'No key corresponding to {path} (must contain at least one separator)')
+        bucket, blob = result
+
+        if end is not None and end <= start:
+            return
+
+        try:
+            session = boto3.session.Session()
+            response = session.client('s3', region_name=self.region_name,
+                                      aws_access_key_id=self.aws_access_key_id,
+                                      aws_secret_access_key=self.aws_secret_access_key,
+                                      ).get_object(Bucket=bucket, Key=blob,
+                                                   Range=f'bytes={start}-{end - 1 if end is not None else ""}')
+        except ClientError as e:
+            # The range starts past the end of the object
+            if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                return
+            raise KeyNotFoundError from e
+
+        for chunk in response['Body'].iter_chunks():
+            f.write(chunk)
+
     def _upload(self, f, key: str, **kwargs) -> str:
         import boto3
 
@@ -114,3 +144,80 @@ class S3Remote(BaseRemote):
                 raise UnknownError from e
         else:
             return True
+
+    def _stat(self, key: str) -> KeyInfo:
+        import boto3
+        from botocore.exceptions import ClientError
+
+        path = join(self.prefix, key)
+        result = path.split(sep=KEY_SEPARATOR, maxsplit=1)
+        if len(result) < 2:
+            raise KeyNotFoundError(f'No key corresponding to {path} (must contain at least one separator)')
+        bucket, blob = result
+
+        try:
+            session = boto3.session.Session()
+            response = session.client('s3', region_name=self.region_name,
+                                      aws_access_key_id=self.aws_access_key_id,
+                                      aws_secret_access_key=self.aws_secret_access_key,
+                                      ).head_object(Bucket=bucket, Key=blob)
+
+        except ClientError as e:
+            if e.response['Error']['Code'] in ("404", "NoSuchKey"):
+                raise KeyNotFoundError(f"Key {key} not found") from e
+            raise UnknownError from e
+
+        # The ETag is the MD5 of the content only for objects that weren't uploaded in multiple parts
+        etag = response.get('ETag', '').strip('"')
+        return KeyInfo(key=key,
+                       size=response.get('ContentLength'),
+                       mtime=response['LastModified'].timestamp() if 'LastModified' in response else None,
+                       hash=f'md5:{etag}' if etag and '-' not in etag else None)
+
+    def _list(self, prefix: str, recursive=True, metadata=False, page_size=None) -> tp.Iterator[KeyInfo]:
+        import boto3
+
+        path = join(self.prefix, prefix)
+
+        # Listing a 'directory' must not match its siblings sharing the same name prefix
+        if path and (not prefix or prefix.endswith(KEY_SEPARATOR)):
+            path += KEY_SEPARATOR
+
+        bucket, _, blob_prefix = path.partition(KEY_SEPARATOR)
+        if not bucket:
+            raise KeyNotFoundError(f'No bucket corresponding to {path}')
+
+        session = boto3.session.Session()
+        client = session.client('s3', region_name=self.region_name,
+                                aws_access_key_id=self.aws_access_key_id,
+                                aws_secret_access_key=self.aws_secret_access_key)
+
+        params = dict(Bucket=bucket, Prefix=blob_prefix)
+        if not recursive:
+            params['Delimiter'] = KEY_SEPARATOR
+        if page_size is not None:
+            params['PaginationConfig'] = {'PageSize': page_size}
+
+        root = join(self.prefix)
+        for page in client.get_paginator('list_objects_v2').paginate(**params):
+            for common_prefix in page.get('CommonPrefixes', []):
+                yield KeyInfo(key=_relative_key(root, f"{bucket}{KEY_SEPARATOR}{common_prefix['Prefix']}"))
+
+            for obj in page.get('Contents', []):
+                key = _relative_key(root, f"{bucket}{KEY_SEPARATOR}{obj['Key']}")
+                if not metadata:
+                    yield KeyInfo(key=key)
+                    continue
+
+                etag = obj.get('ETag', '').strip('"')
+                yield KeyInfo(key=key,
+                              size=obj.get('Size'),
+                              mtime=obj['LastModified'].timestamp() if 'LastModified' in obj else None,
+                              hash=f'md5:{etag}' if etag and '-' not in etag else None)
+
+
+def _relative_key(root: str, path: str) -> str:
+    """ Strips the remote's prefix from a full path """
+    if not root:
+        return path
+    return path[len(root):].lstrip(KEY_SEPARATOR)
@@ -1,6 +1,15 @@
-from remotools.utils import compute_hash, to_path, keep_position
-from remotools.remotes.base import BaseRemote
+import os
+import random
+import tempfile
+import typing as tp
+from remotools.utils import compute_hash, new_hash, to_path, keep_position, is_seekable, is_readable, spool, \
+    clone_file, CLONE_METHODS
+from remotools.remotes.base import BaseRemote, KeyInfo
 from remotools.remotes.exceptions import CorruptedKeyError, KeyNotFoundError
+from remotools.instrumentation import instrument, count
+
+
+VERIFY_POLICIES = ('always', 'first', 'sampled', 'never')
 
 
 class HFSRemote(BaseRemote):
@@ -40,23 +49,64 @@ class HFSRemote(BaseRemote):
     algorithm
         The hashing algorithm used. Must be an attribute of either the hashlib or the xxhash modules.
         Defaults to 'md5'
+
+    verify
+        When downloaded objects are verified against their hash:
+        'always' - on every download
+        'first' - only if the file wasn't verified before, or changed since (its size, mtime or inode changed)
+        'sampled' - like 'first', and also a random sample_rate fraction of the downloads of unchanged files
+        'never' - never
+        'first' and 'sampled' apply to LocalRemote (other remotes are always verified, unless 'never'). They assume
+        that file contents don't change without their metadata changing, e.g. in-place modifications that keep
+        the mtime, or bit rot, go undetected ('sampled' may detect them eventually).
+
+    sample_rate
+        The fraction of downloads of unchanged files that are verified with verify='sampled'
+
+    verified
+        Dictionary like object recording the files of a LocalRemote that were verified
+        (path -> (size, mtime_ns, inode)). Use a persistent one (e.g. SqliteDictKeystore) to share it between
+        processes and runs. Defaults to an in-memory dict.
     """
 
-    def __init__(self, remote: BaseRemote, width=2, depth=4, algorithm='md5'):
+    def __init__(self, remote: BaseRemote, width=2, depth=4, algorithm='md5', verify: str = 'always',
+                 sample_rate: float = 0.01, verified=None):
         super(HFSRemote, self).__init__(name=f'{self.__class__.__name__}<{remote.name}>')
+        if verify not in VERIFY_POLICIES:
+            raise ValueError(f'Unknown verification policy {verify} (must be one of {VERIFY_POLICIES})')
+
         self.remote = remote
         self.width = width
         self.depth = depth
         self.algorithm = algorithm
+        self.verify = verify
+        self.sample_rate = sample_rate
+        self.verified = verified if verified is not None else {}
+
+        # Verified signatures seen by this process, saving lookups of a persistent record
+        self._verified_memo: tp.Dict[str, tp.Tuple[int, int, int]] = {}
 
     def _upload(self, f, key=None, **kwargs) -> str:
 
-        # Figure out the hash of the object to upload
-        key = compute_hash(f, algorithm=self.algorithm)
+        # The stream is read twice (to hash it and to upload it), so non-seekable streams are spooled first
+        spooled = spool(f)
+        try:
+            # Figure out the hash of the object to upload (reading it to the end, so that the span measures it)
+            position = spooled.tell()
+            with instrument(self.name, 'hash', stream=spooled):
+                key = compute_hash(spooled, algorithm=self.algorithm, keep_stream_position=False)
+            spooled.seek(position)
+
+            # Break it according to the desired directory structure
+            path = to_path(key, width=self.width, depth=self.depth)
+            self.remote.upload(spooled, path, progress=False, keep_stream_position=False, params=kwargs)
+
+            # The file was written from the hashed contents
+            self._record(*self._signature(path))
 
-        # Break it according to the desired directory structure
-        path = to_path(key, width=self.width, depth=self.depth)
-        self.remote.upload(f, path, progress=False, keep_stream_position=False, params=kwargs)
+        finally:
+            if spooled is not f:
+                spooled.close()
 
         # The hid is the key to lookup the object
         return key
@@ -68,13 +118,136 @@ class HFSRemote(BaseRemote):
         except ValueError as e:
             raise KeyNotFoundError from e
 
-        with keep_position(f):
+        full_path, signature = self._signature(path)
+        if not self._needs_verification(full_path, signature):
+            count(self.name, 'verify_skip')
             self.remote.download(f, path, progress=False)
+            return
+
+        if is_seekable(f) and is_readable(f):
+            with keep_position(f):
+                self.remote.download(f, path, progress=False)
+
+            # Make sure that the hash matches
+            with instrument(self.name, 'hash', stream=f):
+                recv_key = compute_hash(f, algorithm=self.algorithm, keep_stream_position=False)
+
+        else:
+            # Streams that can't be read back (e.g. pipes) are hashed while they are written
+            writer = _HashingWriter(f, self.algorithm)
+            self.remote.download(writer, path, progress=False)
+            recv_key = writer.hexdigest()
 
-        # Make sure that the hash matches
-        recv_key = compute_hash(f, algorithm=self.algorithm, keep_stream_position=False)
         if recv_key != key:
             raise CorruptedKeyError(f"Hash check for key {key} failed (expected: {key} got: {recv_key}")
+        self._record(full_path, signature)
+
+    def _signature(self, path: str) -> tp.Tuple[tp.Optional[str], tp.Optional[tp.Tuple[int, int, int]]]:
+        """ The file path and signature (size, mtime_ns, inode) of a path of a LocalRemote """
+        from remotools.remotes.local import LocalRemote
+
+        if self.verify in ('always', 'never') or not isinstance(self.remote, LocalRemote):
+            return None, None
+
+        full_path = self.remote._full_path(path)
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            # Reported by the download
+            return full_path, None
+        return full_path, (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def _needs_verification(self, full_path: tp.Optional[str], signature) -> bool:
+        if self.verify == 'never':
+            return False
+        if signature is None or not self._is_verified(full_path, signature):
+            return True
+        return self.verify == 'sampled' and random.random() < self.sample_rate
+
+    def _is_verified(self, full_path: str, signature: tp.Tuple[int, int, int]) -> bool:
+        """ Whether the file was verified (or written from hashed contents) with the given signature """
+        if self._verified_memo.get(full_path) == signature:
+            return True
+
+        if tuple(self.verified.get(full_path) or ()) == signature:
+            self._verified_memo[full_path] = signature
+            return True
+        return False
+
+    def _record(self, full_path: tp.Optional[str], signature):
+        if signature is not None and self._verified_memo.get(full_path) != signature:
+            self._verified_memo[full_path] = signature
+            self.verified[full_path] = signature
+
+    def materialize(self, key: str, dest_path: str, methods: tp.Sequence[str] = CLONE_METHODS,
+                    verify: bool = True) -> str:
+        """
+        Place the object of the given key as a file at dest_path.
+
+        Over a LocalRemote, the stored file is reflinked, hardlinked or copied (the first of methods that works, see
+        utils.clone_file), and verified against its hash unless it was already verified and hasn't changed since
+        (its size, mtime and inode are unchanged), regardless of the verification policy of downloads. Note that a
+        hardlinked file is the stored file itself, and must not be modified (modifications are detected by the next
+        verification). Over other remotes, the object is downloaded into the file.
+
+        Returns the method used ('reflink', 'hardlink', 'copy' or 'download').
+        """
+        from remotools.remotes.local import LocalRemote
+
+        try:
+            path = to_path(key, width=self.width, depth=self.depth)
+        except ValueError as e:
+            raise KeyNotFoundError from e
+
+        with instrument(self.name, 'materialize'):
+            if not isinstance(self.remote, LocalRemote):
+                directory = os.path.dirname(os.path.abspath(dest_path))
+                with tempfile.NamedTemporaryFile(dir=directory, prefix='.' + os.path.basename(dest_path),
+                                                 suffix='.tmp', delete=False) as f:
+                    try:
+                        self.download(f, key, progress=False)
+                    except BaseException:
+                        f.close()
+                        os.unlink(f.name)
+                        raise
+                os.replace(f.name, dest_path)
+                return 'download'
+
+            full_path = self.remote._full_path(path)
+            if verify:
+                self._verify_file(key, full_path)
+            elif not os.path.isfile(full_path):
+                raise KeyNotFoundError(f'Path {full_path} is not a file')
+
+            return clone_file(full_path, dest_path, methods=methods)
+
+    def _verify_file(self, key: str, path: str):
+        """ Verify a file against its key, unless it was verified before and hasn't changed """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError as e:
+            raise KeyNotFoundError(key) from e
+
+        signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+        if self._is_verified(path, signature):
+            count(self.name, 'verify_skip')
+            return
+
+        with open(path, 'rb') as f, instrument(self.name, 'hash', stream=f):
+            recv_key = compute_hash(f, algorithm=self.algorithm, buffer_size=2 ** 20, keep_stream_position=False)
+
+        if recv_key != key:
+            raise CorruptedKeyError(f"Hash check for key {key} failed (expected: {key} got: {recv_key}")
+        self._record(path, signature)
+
+    def _download_range(self, f, key: str, start: int, end: tp.Optional[int], **kwargs):
+        # A part of an object can't be verified against its hash, so ranges are not checked
+        try:
+            path = to_path(key, width=self.width, depth=self.depth)
+        except ValueError as e:
+            raise KeyNotFoundError from e
+
+        self.remote.download_range(f, path, start, end, params=kwargs)
 
     def _contains(self, key: str):
         try:
@@ -86,3 +259,50 @@ class HFSRemote(BaseRemote):
 
         return self.remote.contains(path)
 
+    def _stat(self, key: str) -> KeyInfo:
+        try:
+            path = to_path(key, width=self.width, depth=self.depth)
+        except ValueError as e:
+            raise KeyNotFoundError from e
+
+        # The key is the content hash
+        info = self.remote.stat(path)
+        return info._replace(key=key, hash=f'{self.algorithm}:{key}')
+
+    def _list(self, prefix: str, recursive=True, metadata=False, page_size=None) -> tp.Iterator[KeyInfo]:
+        # The key space is flat, so the listing is always recursive. The key prefix is converted into a path
+        # prefix of the underlying remote, e.g. 'abc' -> 'ab/c' for width=2.
+        w, d = self.width, self.depth
+        parts = [prefix[i * w: (i + 1) * w] for i in range(d)] + [prefix[d * w:]]
+        path_prefix = '/'.join(part for part in parts if part)
+
+        for info in self.remote.list(path_prefix, recursive=True, metadata=metadata, page_size=page_size):
+            if not metadata:
+                info = KeyInfo(key=info)
+
+            parts = info.key.split('/')
+
+            # Skip anything that isn't laid out like an HFS object (e.g. index files)
+            if len(parts) != d + 1 or any(len(part) != w for part in parts[:-1]) or not parts[-1]:
+                continue
+
+            key = ''.join(parts)
+            yield info._replace(key=key, hash=f'{self.algorithm}:{key}' if metadata else None)
+
+
+class _HashingWriter:
+    """ Forwards the writes to a stream, hashing the written bytes """
+
+    def __init__(self, f, algorithm: str):
+        self._f = f
+        self._hash = new_hash(algorithm)
+
+    def write(self, b):
+        self._hash.update(b)
+        return self._f.write(b)
+
+    def tell(self):
+        return self._f.tell()
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
@@ -1,6 +1,7 @@
 import os
-from shutil import copyfileobj
-from remotools.remotes.base import BaseRemote
+import typing as tp
+from shutil import copyfileobj, COPY_BUFSIZE
+from remotools.remotes.base import BaseRemote, KeyInfo
 from remotools.remotes.exceptions import KeyNotFoundError, NonDownloadableKeyError, \
     NonUploadableKeyError, UnknownError
 
@@ -54,6 +55,30 @@ class LocalRemote(BaseRemote):
         except Exception as e:
             raise UnknownError from e
 
+    def _download_range(self, f, key: str, start: int, end: tp.Optional[int], **kwargs):
+
+        path = self._full_path(key)
+        try:
+            with open(path, 'rb') as f_key:
+                f_key.seek(start)
+                remaining = end - start if end is not None else None
+                while remaining is None or remaining > 0:
+                    chunk = f_key.read(COPY_BUFSIZE if remaining is None else min(COPY_BUFSIZE, remaining))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    if remaining is not None:
+                        remaining -= len(chunk)
+
+        except FileNotFoundError as e:
+            raise KeyNotFoundError from e
+
+        except (IsADirectoryError, PermissionError) as e:
+            raise NonDownloadableKeyError from e
+
+        except Exception as e:
+            raise UnknownError from e
+
     def _upload(self, f, key: str, exists_ok=True, **kwargs) -> str:
 
         path = self._full_path(key)
@@ -81,3 +106,68 @@ class LocalRemote(BaseRemote):
         path = self._full_path(key)
         return os.path.isfile(path)
 
+    def open(self, key: str, **kwargs) -> tp.BinaryIO:
+        """ Opens the file of the given key for reading """
+        path = self._full_path(key)
+        try:
+            return open(path, 'rb')
+
+        except FileNotFoundError as e:
+            raise KeyNotFoundError from e
+
+        except (IsADirectoryError, PermissionError) as e:
+            raise NonDownloadableKeyError from e
+
+    def _stat(self, key: str) -> KeyInfo:
+        path = self._full_path(key)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError as e:
+            raise KeyNotFoundError from e
+
+        if not os.path.isfile(path):
+            raise KeyNotFoundError(f'Path {path} is not a file')
+
+        return KeyInfo(key=key, size=st.st_size, mtime=st.st_mtime)
+
+    def _list(self, prefix: str, recursive=True, metadata=False, page_size=None) -> tp.Iterator[KeyInfo]:
+        directory, _, name_prefix = prefix.rpartition('/')
+
+        try:
+            entries = os.scandir(self._full_path(directory))
+        except (FileNotFoundError, NotADirectoryError):
+            return
+
+        # A depth first traversal holding a single scandir iterator per level
+        stack = [(directory, entries, name_prefix)]
+        try:
+            while stack:
+                directory, entries, name_prefix = stack[-1]
+                entry = next(entries, None)
+
+                if entry is None:
+                    entries.close()
+                    stack.pop()
+                    continue
+
+                if not entry.name.startswith(name_prefix):
+                    continue
+
+                key = f'{directory}/{entry.name}' if directory else entry.name
+
+                if entry.is_dir():
+                    if recursive:
+                        stack.append((key, os.scandir(entry.path), ''))
+                    else:
+                        yield KeyInfo(key=key + '/')
+
+                elif entry.is_file():
+                    if metadata:
+                        st = entry.stat()
+                        yield KeyInfo(key=key, size=st.st_size, mtime=st.st_mtime)
+                    else:
+                        yield KeyInfo(key=key)
+
+        finally:
+            for _, entries, _ in stack:
+                entries.close()
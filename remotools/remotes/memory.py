@@ -0,0 +1,457 @@
+from __future__ import annotations
+from collections import OrderedDict
+import hashlib
+import io
+import os
+import struct
+import sys
+import threading
+import time
+import typing as tp
+from remotools.remotes.base import BaseRemote, KeyInfo
+from remotools.remotes.exceptions import KeyNotFoundError, NonUploadableKeyError
+from remotools.utils import BufferReader
+
+
+class MemoryRemote(BaseRemote):
+    """
+    A Remote storing the objects as bytes in the memory of the current process.
+
+    Reads are zero-copy: open(key) returns a stream over the stored bytes, and download(...) writes them
+    to the target stream in a single call. Useful for tests, benchmarks and as a fast scratch storage.
+
+    When max_bytes or max_items is given, the least recently used objects are evicted to stay within
+    the limits.
+
+    Attributes
+    ----------
+    max_bytes
+        Maximal total size of the stored objects. None means no limit.
+
+    max_items
+        Maximal number of stored objects. None means no limit.
+
+    Examples
+    --------
+    >> remote = MemoryRemote(max_bytes=2 ** 30)
+    >> saver = NumpySaver(remote)
+    >> saver.save(np.zeros(10), 'zeros')
+    >> with remote.open('zeros') as f:     # No copy is made
+    >>     np.load(f)
+    """
+
+    def __init__(self, max_bytes: tp.Optional[int] = None, max_items: tp.Optional[int] = None, *args, **kwargs):
+        super(MemoryRemote, self).__init__(*args, **kwargs)
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+
+        # key -> (data, mtime) in LRU order (the most recently used last)
+        self._objects: OrderedDict[str, tp.Tuple[tp.Union[bytes, bytearray], float]] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        """ Total size of the stored objects """
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> tp.Union[bytes, bytearray]:
+        with self._lock:
+            try:
+                data, _ = self._objects[key]
+            except KeyError as e:
+                raise KeyNotFoundError(key) from e
+            self._objects.move_to_end(key)
+            return data
+
+    def _download(self, f, key: str, **kwargs):
+        with memoryview(self._get(key)) as view:
+            f.write(view)
+
+    def _download_range(self, f, key: str, start: int, end: tp.Optional[int], **kwargs):
+        with memoryview(self._get(key)) as view, view[start:end] as part:
+            f.write(part)
+
+    def _upload(self, f, key: str, **kwargs) -> str:
+        size = _remaining_size(f)
+        if size is not None and hasattr(f, 'readinto'):
+            # Read straight into the stored buffer, without the intermediate chunks of read()
+            data = bytearray(size)
+            with memoryview(data) as target:
+                _read_into(f, target)
+        else:
+            data = f.read()
+
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            raise NonUploadableKeyError(f'Object of {len(data)} bytes exceeds max_bytes={self.max_bytes}')
+
+        with self._lock:
+            self._remove(key)
+            self._objects[key] = (data, time.time())
+            self._nbytes += len(data)
+            self._evict()
+
+        return key
+
+    def _contains(self, key: str) -> bool:
+        return key in self._objects
+
+    def _stat(self, key: str) -> KeyInfo:
+        try:
+            data, mtime = self._objects[key]
+        except KeyError as e:
+            raise KeyNotFoundError(key) from e
+        return KeyInfo(key=key, size=len(data), mtime=mtime)
+
+    def _list(self, prefix: str, recursive=True, metadata=False, page_size=None) -> tp.Iterator[KeyInfo]:
+        with self._lock:
+            items = [(key, len(data), mtime) for key, (data, mtime) in self._objects.items() if key.startswith(prefix)]
+
+        directories = set()
+        for key, size, mtime in sorted(items):
+            if not recursive and '/' in key[len(prefix):]:
+                directory = key[:key.index('/', len(prefix)) + 1]
+                if directory not in directories:
+                    directories.add(directory)
+                    yield KeyInfo(key=directory)
+                continue
+
+            yield KeyInfo(key=key, size=size, mtime=mtime) if metadata else KeyInfo(key=key)
+
+    # Extra methods
+    def open(self, key: str, **kwargs) -> BufferReader:
+        """ Returns a read-only stream over the object, without copying it """
+        return BufferReader(self._get(key))
+
+    def evict(self, key: str):
+        """ Remove the object with the given key (if it exists) """
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+            self._nbytes = 0
+
+    def _remove(self, key: str):
+        entry = self._objects.pop(key, None)
+        if entry is not None:
+            self._nbytes -= len(entry[0])
+
+    def _evict(self):
+        while self._objects and ((self.max_bytes is not None and self._nbytes > self.max_bytes) or
+                                 (self.max_items is not None and len(self._objects) > self.max_items)):
+            _, (data, _) = self._objects.popitem(last=False)
+            self._nbytes -= len(data)
+
+
+class SharedMemoryRemote(BaseRemote):
+    """
+    A Remote storing each object in a shared memory block (see multiprocessing.shared_memory), so that
+    other processes on the same host can read it without touching the disk.
+
+    The name of the block is derived from the namespace and the key, so any process constructing
+    a SharedMemoryRemote with the same namespace finds the objects uploaded by the others.
+    A typical use is a ConcurrentSaver (or a RemoteBlobDict) producing encoded objects in the main process,
+    and dataloader worker processes loading them by key.
+
+    Each block starts with an 8 byte header holding the size of the object, since the operating system
+    may round the size of blocks up.
+
+    The uploading process owns the blocks it created: when max_bytes or max_items is given, its least
+    recently uploaded blocks are unlinked to stay within the limits, and close() unlinks all of them.
+    Processes that attached to a block before it was unlinked can keep reading it.
+
+    Unless persistent=True, the blocks are also unlinked when the process tree of the uploading process
+    exits (by multiprocessing's resource tracker). Persistent blocks outlive it and must be removed with
+    evict(...) or close(), or they will occupy memory until reboot. Readers attach to the blocks without
+    registering them with their resource tracker, so a reading process never unlinks them when it exits.
+
+    Attributes
+    ----------
+    namespace
+        Distinguishes the objects of different remotes having the same keys
+
+    max_bytes
+        Maximal total size of the blocks owned by this instance. None means no limit.
+
+    max_items
+        Maximal number of blocks owned by this instance. None means no limit.
+
+    persistent
+        Whether the blocks created by this instance outlive the process tree that created them
+
+    Examples
+    --------
+    >> remote = SharedMemoryRemote(namespace='dataset', max_bytes=8 * 2 ** 30)
+    >> with NumpySaver(remote).concurrent(max_workers=8) as saver:
+    >>     saver.concurrent_save(arrays, keys)
+    >>
+    >> # In a worker process (e.g. inside a torch Dataset)
+    >> array = NumpySaver(SharedMemoryRemote(namespace='dataset')).load(keys[0], progress=False)
+    """
+
+    # Little-endian unsigned 64 bit object size
+    HEADER = struct.Struct('<Q')
+
+    def __init__(self, namespace: str = 'remotools', max_bytes: tp.Optional[int] = None,
+                 max_items: tp.Optional[int] = None, persistent=False, *args, **kwargs):
+        super(SharedMemoryRemote, self).__init__(*args, **kwargs)
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.persistent = persistent
+
+        # Blocks created by this instance: key -> size, in upload order
+        self._owned: OrderedDict[str, int] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+        # Start the resource tracker now, so that forked processes share it instead of starting their own
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+
+    @property
+    def nbytes(self) -> int:
+        """ Total size of the objects owned by this instance """
+        return self._nbytes
+
+    def __getstate__(self):
+        # Copies sent to other processes don't own any blocks
+        state = self.__dict__.copy()
+        state.pop('_lock')
+        state['_owned'] = OrderedDict()
+        state['_nbytes'] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def block_name(self, key: str) -> str:
+        """ The name of the shared memory block of the given key """
+        # Kept short, as some platforms limit the length of the names to 30 characters
+        digest = hashlib.blake2b(f'{self.namespace}\0{key}'.encode('utf-8'), digest_size=12).hexdigest()
+        return f'rt_{digest}'
+
+    def _attach(self, key: str):
+        try:
+            return _attach_untracked(self.block_name(key))
+        except FileNotFoundError as e:
+            raise KeyNotFoundError(key) from e
+
+    def _download(self, f, key: str, **kwargs):
+        shm = self._attach(key)
+        try:
+            size, = self.HEADER.unpack_from(shm.buf)
+            with shm.buf[self.HEADER.size: self.HEADER.size + size] as view:
+                f.write(view)
+        finally:
+            shm.close()
+
+    def _download_range(self, f, key: str, start: int, end: tp.Optional[int], **kwargs):
+        shm = self._attach(key)
+        try:
+            size, = self.HEADER.unpack_from(shm.buf)
+            end = size if end is None else min(end, size)
+            with shm.buf[self.HEADER.size + min(start, size): self.HEADER.size + end] as view:
+                f.write(view)
+        finally:
+            shm.close()
+
+    def _upload(self, f, key: str, **kwargs) -> str:
+        from multiprocessing import shared_memory, resource_tracker
+
+        size = _remaining_size(f)
+        data = None
+        if size is None or not hasattr(f, 'readinto'):
+            data = f.read()
+            size = len(data)
+
+        if self.max_bytes is not None and size > self.max_bytes:
+            raise NonUploadableKeyError(f'Object of {size} bytes exceeds max_bytes={self.max_bytes}')
+
+        # Replace the previous version of the object. Readers already attached to it keep reading it.
+        self.evict(key)
+        name = self.block_name(key)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=self.HEADER.size + size)
+        except FileExistsError:
+            # Uploaded by another process
+            _unlink(name)
+            shm = shared_memory.SharedMemory(name=name, create=True, size=self.HEADER.size + size)
+
+        try:
+            self.HEADER.pack_into(shm.buf, 0, size)
+            with shm.buf[self.HEADER.size: self.HEADER.size + size] as target:
+                if data is not None:
+                    target[:] = data
+                else:
+                    _read_into(f, target)
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+
+        shm.close()
+        if self.persistent:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+
+        with self._lock:
+            self._owned[key] = size
+            self._nbytes += size
+            evicted = self._evicted()
+
+        for key_ in evicted:
+            _unlink(self.block_name(key_))
+
+        return key
+
+    def _contains(self, key: str) -> bool:
+        try:
+            self._attach(key).close()
+        except KeyNotFoundError:
+            return False
+        return True
+
+    def _stat(self, key: str) -> KeyInfo:
+        shm = self._attach(key)
+        try:
+            size, = self.HEADER.unpack_from(shm.buf)
+        finally:
+            shm.close()
+        return KeyInfo(key=key, size=size)
+
+    # Extra methods
+    def open(self, key: str, **kwargs) -> BufferReader:
+        """ Returns a read-only stream over the object, mapped directly from the shared memory block """
+        shm = self._attach(key)
+        size, = self.HEADER.unpack_from(shm.buf)
+        return _BlockReader(shm, size, self.HEADER.size)
+
+    def evict(self, key: str):
+        """ Unlink the block of the given key, if it is owned by this instance """
+        with self._lock:
+            size = self._owned.pop(key, None)
+            if size is None:
+                return
+            self._nbytes -= size
+        _unlink(self.block_name(key))
+
+    def close(self):
+        """ Unlink all the blocks owned by this instance """
+        with self._lock:
+            keys = list(self._owned)
+            self._owned.clear()
+            self._nbytes = 0
+
+        for key in keys:
+            _unlink(self.block_name(key))
+
+    def _evicted(self) -> tp.List[str]:
+        evicted = []
+        while self._owned and ((self.max_bytes is not None and self._nbytes > self.max_bytes) or
+                               (self.max_items is not None and len(self._owned) > self.max_items)):
+            key, size = self._owned.popitem(last=False)
+            self._nbytes -= size
+            evicted.append(key)
+        return evicted
+
+
+class _BlockReader(BufferReader):
+    """ A BufferReader over a shared memory block, detaching from the block when closed """
+
+    def __init__(self, shm, size: int, offset: int):
+        super(_BlockReader, self).__init__(shm.buf[offset: offset + size])
+        self._shm = shm
+
+    def close(self):
+        super(_BlockReader, self).close()
+        try:
+            self._shm.close()
+        except BufferError:
+            # An exported view of the block is still alive, the block is detached once it's released
+            pass
+
+
+class _MappedBlock:
+    """ A shared memory block mapped without registering it with the resource tracker """
+
+    def __init__(self, name: str):
+        import mmap
+        import _posixshmem
+
+        fd = _posixshmem.shm_open('/' + name, os.O_RDWR, mode=0o600)
+        try:
+            self._mmap = mmap.mmap(fd, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+        self.buf = memoryview(self._mmap)
+
+    def close(self):
+        if self.buf is not None:
+            self.buf.release()
+            self.buf = None
+        self._mmap.close()
+
+
+def _attach_untracked(name: str):
+    """
+    Attach to an existing shared memory block. Attaching with SharedMemory(name) registers the block with the
+    resource tracker of the current process, which would unlink it when the process exits, even though the
+    block belongs to the process that created it.
+    """
+    from multiprocessing import shared_memory
+
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    if os.name != 'posix':
+        # Blocks are only tracked on POSIX
+        return shared_memory.SharedMemory(name=name)
+    return _MappedBlock(name)
+
+
+def _unlink(name: str):
+    from multiprocessing import shared_memory
+
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _remaining_size(f) -> tp.Optional[int]:
+    """ The number of bytes left in a seekable stream, or None if it isn't seekable """
+    try:
+        if not f.seekable():
+            return None
+        position = f.tell()
+        end = f.seek(0, io.SEEK_END)
+        f.seek(position)
+    except (AttributeError, OSError):
+        return None
+    return end - position
+
+
+def _read_into(f, target: memoryview):
+    offset = 0
+    while offset < target.nbytes:
+        with target[offset:] as chunk:
+            n = f.readinto(chunk)
+        if not n:
+            raise NonUploadableKeyError(f'Stream ended after {offset} of {target.nbytes} bytes')
+        offset += n
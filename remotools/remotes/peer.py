@@ -0,0 +1,365 @@
+"""
+A shared cache tier between the nodes of a cluster.
+
+Every node runs a CacheServer exposing its local cache (an HFSLocalCachingRemote) over HTTP, and caches a PeerRemote
+instead of the origin remote. The keys are spread across the nodes by consistent hashing: a node missing a key in
+its local cache asks the node owning the key, which fetches the key from the origin (once for the whole cluster)
+into its own cache and serves it. The objects are served along with their content hash, which the receiving node
+verifies.
+
+Examples
+--------
+>> peers = [f'http://node-{i}:8765' for i in range(64)]
+>> remote = HFSLocalCachingRemote(PeerRemote(S3Remote(bucket='dataset'), peers=peers, self_url=peers[rank]),
+>>                                local_cache_path='/tmp/cache')
+>> server = CacheServer(remote, port=8765).start()
+>> remote.download(f, 'images/1.jpg')
+"""
+from __future__ import annotations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+import bisect
+import hashlib
+import logging
+import threading
+import time
+import typing as tp
+from remotools.remotes.base import BaseRemote, KeyInfo
+from remotools.remotes.exceptions import CorruptedKeyError, KeyNotFoundError
+from remotools.instrumentation import instrument, count
+from remotools.utils import new_hash, is_seekable
+
+if tp.TYPE_CHECKING:
+    from remotools.remotes.caching import CachingRemote
+
+logger = logging.getLogger(__name__)
+
+HASH_HEADER = 'X-Content-Hash'
+
+
+class HashRing:
+    """
+    Consistent hashing of keys to nodes. Each node is placed at vnodes points of the ring, so that adding or
+    removing a node only moves about 1/len(nodes) of the keys.
+    """
+
+    def __init__(self, nodes: tp.Iterable[str], vnodes: int = 64):
+        self.nodes = list(dict.fromkeys(nodes))
+        self.vnodes = vnodes
+        points = sorted((self._point(f'{node}#{i}'), node) for node in self.nodes for i in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    @staticmethod
+    def _point(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    def lookup(self, key: str) -> tp.Iterator[str]:
+        """ The distinct nodes in the order of preference for the key: its owner first, then its successors """
+        if not self._points:
+            return
+
+        start = bisect.bisect(self._points, self._point(key))
+        seen = set()
+        for i in range(len(self._points)):
+            node = self._owners[(start + i) % len(self._points)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+
+class PeerRemote(BaseRemote):
+    """
+    A remote downloading objects from the peer owning them (see CacheServer) before resorting to the origin.
+
+    Downloads go to the peer owning the key on the hash ring (or, when it is unreachable, to the next one). When
+    this node owns the key, or no peer is reachable, the object is downloaded from the origin. The content hash
+    sent by the peer is verified. Uploads and all other operations go to the origin.
+
+    Attributes
+    ----------
+    origin
+        The remote holding the objects
+
+    peers
+        Base URLs of the cache servers of all the nodes (e.g. 'http://node-1:8765'), possibly including this one
+
+    self_url
+        The URL of this node's cache server, if it is one of the peers
+
+    vnodes
+        Number of points of each peer on the hash ring
+
+    timeout
+        Timeout in seconds of the connections to the peers
+
+    retry_after
+        Unreachable peers are skipped for this many seconds
+    """
+
+    def __init__(self, origin: BaseRemote, peers: tp.Sequence[str], self_url: tp.Optional[str] = None,
+                 vnodes: int = 64, timeout: float = 5., retry_after: float = 30., chunk_size: int = 2 ** 20):
+        super(PeerRemote, self).__init__(name=f'{self.__class__.__name__}<{origin.name}>')
+        self.origin = origin
+        self.ring = HashRing([peer.rstrip('/') for peer in peers], vnodes=vnodes)
+        self.self_url = self_url.rstrip('/') if self_url is not None else None
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.chunk_size = chunk_size
+
+        self._down: tp.Dict[str, float] = {}   # Peer -> time until which it is skipped
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                import requests
+                self._session = requests.Session()
+            return self._session
+
+    def owner(self, key: str) -> tp.Optional[str]:
+        """ The peer that key is downloaded from, or None for the origin """
+        now = time.monotonic()
+        for peer in self.ring.lookup(key):
+            if peer == self.self_url:
+                return None
+            if self._down.get(peer, 0.) <= now:
+                return peer
+        return None
+
+    def _download(self, f, key: str, **kwargs):
+        import requests
+
+        position = f.tell() if is_seekable(f) else None
+        while True:
+            peer = self.owner(key)
+            if peer is None:
+                break
+
+            written = [0]
+            try:
+                with instrument(self.name, 'peer_download', stream=f):
+                    found = self._download_from_peer(f, key, peer, written)
+
+            except (requests.RequestException, CorruptedKeyError) as e:
+                count(self.name, 'peer_error')
+                self._rewind(f, key, position, written[0])
+
+                if isinstance(e, requests.ConnectionError):
+                    logger.warning(f'{self.name}: peer {peer} is unreachable, skipping it for {self.retry_after}s: '
+                                   f'{e!r}')
+                    with self._lock:
+                        self._down[peer] = time.monotonic() + self.retry_after
+                    continue
+
+                logger.warning(f'{self.name}: failed downloading {key} from {peer}: {e!r}')
+                break
+
+            if found:
+                count(self.name, 'peer_hit')
+                return
+
+            count(self.name, 'peer_miss')
+            break
+
+        self.origin.download(f, key, progress=False, params=kwargs)
+
+    @staticmethod
+    def _rewind(f, key: str, position: tp.Optional[int], written: int):
+        """ Discard the bytes written to f by a failed download """
+        if written == 0:
+            return
+        if position is None:
+            raise CorruptedKeyError(f'{key}: the download from a peer failed midway into a non-seekable stream')
+        f.seek(position)
+        f.truncate()
+
+    def _download_from_peer(self, f, key: str, peer: str, written: tp.List[int]) -> bool:
+        """ Returns False if the peer doesn't have the key. Counts the bytes written to f in written[0]. """
+        with self.session.get(f'{peer}/keys/{quote(key, safe="")}', stream=True, timeout=self.timeout) as r:
+            if r.status_code == 404:
+                return False
+            r.raise_for_status()
+
+            algorithm, _, expected = r.headers.get(HASH_HEADER, '').partition(':')
+            h = new_hash(algorithm) if expected else None
+            for chunk in r.iter_content(chunk_size=self.chunk_size):
+                if h is not None:
+                    h.update(chunk)
+                f.write(chunk)
+                written[0] += len(chunk)
+
+        if h is not None and h.hexdigest() != expected:
+            raise CorruptedKeyError(f'{key}: the content received from {peer} does not match its hash {expected}')
+        return True
+
+    def _download_range(self, f, key: str, start: int, end: tp.Optional[int], **kwargs):
+        self.origin.download_range(f, key, start, end, params=kwargs)
+
+    def _upload(self, f, key: str, **kwargs) -> str:
+        return self.origin.upload(f, key, progress=False, params=kwargs)
+
+    def _contains(self, key: str) -> bool:
+        return self.origin.contains(key)
+
+    def _stat(self, key: str) -> KeyInfo:
+        return self.origin.stat(key)
+
+    def _list(self, prefix: str, recursive=True, metadata=False, page_size=None) -> tp.Iterator[KeyInfo]:
+        for info in self.origin.list(prefix, recursive=recursive, metadata=metadata, page_size=page_size):
+            yield info if metadata else KeyInfo(key=info)
+
+
+class CacheServer:
+    """
+    Serves the cache of a CachingRemote (whose cache is an HFSRemote) over HTTP, for the PeerRemote of other nodes.
+
+    GET (and HEAD) /keys/<quoted key> serves the object cached for a key of the remote, fetching it into the cache
+    first when fetch=True. GET /objects/<content hash> serves an object of the cache by its hash. The responses carry
+    the content hash in an X-Content-Hash header ('<algorithm>:<hex digest>').
+
+    Attributes
+    ----------
+    remote
+        The CachingRemote
+
+    host, port
+        The address to listen on. Port 0 picks a free port (see url).
+
+    fetch
+        Fetch the keys missing in the cache from the remote. Concurrent requests of the same key fetch it once.
+
+    Examples
+    --------
+    >> with CacheServer(remote, host='0.0.0.0', port=8765) as server:
+    >>     train()
+    """
+
+    def __init__(self, remote: CachingRemote, host: str = '127.0.0.1', port: int = 0, fetch: bool = True):
+        self.remote = remote
+        self.fetch = fetch
+        self.algorithm = getattr(remote.cache, 'algorithm', None)
+        self._fetching: tp.Dict[str, tp.List] = {}    # Key -> [lock, number of requests using it]
+        self._lock = threading.Lock()
+        self._thread: tp.Optional[threading.Thread] = None
+
+        server = self
+
+        class Handler(_CacheRequestHandler):
+            cache_server = server
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> CacheServer:
+        """ Serve in a background thread """
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name=self.__class__.__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> CacheServer:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def cache_key(self, key: str) -> tp.Optional[str]:
+        """ The cache key of a remote key, fetching it if necessary. None if not found. """
+        keystore, cache = self.remote.keystore, self.remote.cache
+
+        if key in keystore and cache.contains(keystore[key]):
+            count(self.__class__.__name__, 'cache_hit')
+            return keystore[key]
+
+        if not self.fetch:
+            return None
+
+        # A single fetch per key. The lock is dropped once the last request waiting on it is done.
+        with self._lock:
+            entry = self._fetching.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                if key not in keystore or not cache.contains(keystore[key]):
+                    count(self.__class__.__name__, 'cache_miss')
+                    self.remote.fetch(key, progress=False)
+                return keystore[key]
+
+        except KeyNotFoundError:
+            return None
+
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._fetching[key]
+
+
+class _CacheRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    cache_server: CacheServer = None
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def _serve(self, body: bool):
+        server = self.cache_server
+        kind, _, name = self.path.lstrip('/').partition('/')
+        name = unquote(name)
+
+        try:
+            if kind == 'keys':
+                cache_key = server.cache_key(name)
+            elif kind == 'objects':
+                cache_key = name if server.remote.cache.contains(name) else None
+            else:
+                self.send_error(400, 'Expected /keys/<key> or /objects/<hash>')
+                return
+
+            if cache_key is None:
+                self.send_error(404)
+                return
+
+            size = server.remote.cache.stat(cache_key).size
+
+        except Exception as e:
+            logger.exception(f'Failed serving {self.path}')
+            self.send_error(500, explain=repr(e))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        if server.algorithm is not None:
+            self.send_header(HASH_HEADER, f'{server.algorithm}:{cache_key}')
+        self.end_headers()
+
+        if body:
+            # Unverified: the hash is verified by the receiving side
+            with instrument(server.__class__.__name__, 'serve'):
+                server.remote.cache.download_range(self.wfile, cache_key, 0, None)
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} - {format % args}')
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from remotools.remotes.base import BaseRemote
+from remotools.remotes.base import BaseRemote, KeyInfo
 from remotools.remotes.local import LocalRemote
 from remotools.remotes.web import WebRemote
 from collections import UserDict
@@ -11,6 +11,7 @@ import re
 REMOTE_NAME_RE = re.compile("^[a-zA-Z0-9-]+$")
 REMOTE_NAME_SEPARATOR = '://'
 WEB_REMOTE_NAMES = ['http', 'https']
+RESERVED_REMOTE_NAMES = ['file'] + WEB_REMOTE_NAMES
 
 
 class URIRemote(BaseRemote):
@@ -25,7 +26,7 @@ class URIRemote(BaseRemote):
 
     There are several reserved remote names with the following meaning:
         file - the key is a file in the local file system (Realised with LocalRemote(prefix=None)
-        https, http - used to designate a web URL. Available for download only.
+        https, http - used to designate a web URL (see WebRemote)
 
     Attributes
     ----------
@@ -43,7 +44,7 @@ class URIRemote(BaseRemote):
 
     def __init__(self, remotes: tp.Optional[dict]=None, *args, **kwargs):
         super(URIRemote, self).__init__(*args, **kwargs)
-        self.remotes = _RemotesDict(dict={'file': LocalRemote()})
+        self.remotes = _RemotesDict({'file': LocalRemote()})
         for name in WEB_REMOTE_NAMES:
             self.remotes[name] = WebRemote()
         self.remotes.update(remotes or {})
@@ -67,13 +68,26 @@ class URIRemote(BaseRemote):
         remote = self.remotes[remote_name]
         remote.download(f, remote_key, progress=False, params=kwargs)
 
+    def _download_range(self, f, key: str, start: int, end: tp.Optional[int], **kwargs):
+        remote_name, remote_key = self.parse_key(key)
+        if remote_name not in self.remotes:
+            raise KeyNotFoundError(f'No such remote {remote_name}')
+
+        remote = self.remotes[remote_name]
+        remote.download_range(f, remote_key, start, end, params=kwargs)
+
     def _upload(self, f, key: str, **kwargs) -> str:
         remote_name, remote_key = self.parse_key(key)
         if remote_name not in self.remotes:
             raise KeyNotFoundError(f'No such remote {remote_name}')
 
         remote = self.remotes[remote_name]
-        return f'{remote_name}{REMOTE_NAME_SEPARATOR}{remote.upload(f, remote_key, progress=False, params=kwargs)}'
+        uploaded_key = remote.upload(f, remote_key, progress=False, params=kwargs)
+
+        # The keys of web remotes are already full URLs
+        if remote_name in WEB_REMOTE_NAMES:
+            return uploaded_key
+        return f'{remote_name}{REMOTE_NAME_SEPARATOR}{uploaded_key}'
 
     def _contains(self, key: str):
         remote_name, remote_key = self.parse_key(key)
@@ -84,6 +98,32 @@ class URIRemote(BaseRemote):
         remote = self.remotes[remote_name]
         return remote.contains(remote_key)
 
+    def _stat(self, key: str) -> KeyInfo:
+        remote_name, remote_key = self.parse_key(key)
+        if remote_name not in self.remotes:
+            raise KeyNotFoundError(f'No such remote {remote_name}')
+
+        remote = self.remotes[remote_name]
+        return remote.stat(remote_key)._replace(key=key)
+
+    def _list(self, prefix: str, recursive=True, metadata=False, page_size=None) -> tp.Iterator[KeyInfo]:
+        if REMOTE_NAME_SEPARATOR in prefix:
+            remote_name, remote_key = self.parse_key(prefix)
+            names = [remote_name] if remote_name in self.remotes else []
+
+        # Without a separator the listing spans all the remotes whose name matches the prefix, except for
+        # the reserved ones (that would list the whole local file system)
+        else:
+            remote_key = ''
+            names = [name for name in self.remotes if name.startswith(prefix) and name not in RESERVED_REMOTE_NAMES]
+
+        for name in names:
+            remote = self.remotes[name]
+            for info in remote.list(remote_key, recursive=recursive, metadata=metadata, page_size=page_size):
+                if not metadata:
+                    info = KeyInfo(key=info)
+                yield info._replace(key=f'{name}{REMOTE_NAME_SEPARATOR}{info.key}')
+
 
 class _RemotesDict(UserDict):
     """
@@ -1,23 +1,513 @@
-from remotools.remotes.base import BaseRemote
-import requests
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime, formatdate
+import logging
+import threading
+import time
+import typing as tp
+from remotools.remotes.base import BaseRemote, KeyInfo
+from remotools.remotes.exceptions import KeyNotFoundError, NonDownloadableKeyError, NonUploadableKeyError, \
+    StorageConnectionError, NotModifiedError, UnknownError
+from remotools.utils import is_seekable
+from urllib.parse import quote
+
+# A URL template (formatted with key, quoted_key and, for parts, part, offset and size) or a function of the same
+UrlTemplate = tp.Union[str, tp.Callable[..., str]]
+
+logger = logging.getLogger(__name__)
 
 
 class WebRemote(BaseRemote):
     """
-    A remote used for downloading files from web URLs.
+    A remote used for downloading and uploading files from/to web URLs.
+
+    The keys here are simply the urls. Requests go through a requests.Session, so the connections to each host
+    are pooled and kept alive between requests (note that requests speaks HTTP/1.1 only).
+
+    A download interrupted midway is resumed from where it stopped with a Range request (guarded by If-Range, so
+    that a changed object isn't spliced), up to max_retries times. Objects of at least 2 * segment_size bytes
+    are downloaded in up to max_segments parallel segments, when the server supports ranges and the target stream
+    is seekable.
+
+    A download can be made conditional with the etag and modified_since parameters (see _download(...)).
+
+    Uploads stream the given stream in the body of a PUT (or POST) request, without buffering it: seekable streams
+    are sent with their length, and others with chunked transfer encoding. The request is sent to the key itself,
+    or to the URL produced by upload_url (e.g. a presigned URL). When part_url is given, objects of at least
+    2 * part_size bytes are uploaded in parts, in parallel, each part to the URL produced by part_url, and the
+    upload is then completed by POSTing the list of parts to complete_url (if given) as JSON:
+    {"key": ..., "size": ..., "parts": [{"part": 1, "offset": 0, "size": ..., "etag": ...}, ...]}.
+
+    Attributes
+    ----------
+    chunk_size
+        Number of bytes read from the connection at a time
+
+    timeout
+        Connection and read timeout in seconds
+
+    headers
+        Extra headers sent with every request (e.g. authorization)
+
+    max_retries
+        Number of times an interrupted download is resumed (per segment)
+
+    segment_size
+        Size in bytes of the segments of parallel downloads. None disables them.
 
-    The keys here are simply the urls. A download is attempted as-is using the requests library.
+    max_segments
+        Maximal number of segments downloaded in parallel
+
+    pool_size
+        Maximal number of connections kept alive per host
+
+    upload_url
+        The URL uploads are sent to: a template formatted with key and quoted_key (the URL-quoted key), e.g.
+        'https://blobs.example.com/{quoted_key}?token=...', or a function key -> URL (e.g. presigning it).
+        Defaults to the key itself.
+
+    upload_method
+        'PUT' or 'POST'
+
+    part_size
+        Size in bytes of the parts of parallel uploads
+
+    part_url
+        The URL each part is uploaded to: a template formatted with key, quoted_key, part (starting at 1), offset
+        and size, or a function of the same keyword arguments. None disables part uploads.
+
+    complete_url
+        The URL the list of parts is POSTed to (a template formatted with key and quoted_key, or a function)
+
+    max_parts
+        Maximal number of parts uploaded in parallel (each one is held in memory while uploaded)
+
+    Examples
+    --------
+    >> remote = WebRemote(segment_size=2 ** 26, max_segments=8)
+    >> remote.stat('https://example.com/dataset.tar')       # KeyInfo(key=..., size=..., mtime=...)
+    >> with open('dataset.tar', 'wb') as f:
+    >>     remote.download(f, 'https://example.com/dataset.tar')
+    >>
+    >> remote = WebRemote(upload_url=lambda key: presign(key, method='PUT'))
+    >> remote.upload(f, 'datasets/dataset.tar')
     """
 
-    def _download(self, f, key: str, chunk_size=8192, **kwargs):
-        with requests.get(key, stream=True) as r:
-            r.raise_for_status()
-            for chunk in r.iter_content(chunk_size=chunk_size):
-                f.write(chunk)
+    def __init__(self, chunk_size: int = 2 ** 20, timeout: tp.Optional[float] = 60.,
+                 headers: tp.Optional[tp.Dict[str, str]] = None, max_retries: int = 3,
+                 segment_size: tp.Optional[int] = 2 ** 26, max_segments: int = 8, pool_size: int = 16,
+                 upload_url: tp.Optional[UrlTemplate] = None, upload_method: str = 'PUT', part_size: int = 2 ** 26,
+                 part_url: tp.Optional[UrlTemplate] = None, complete_url: tp.Optional[UrlTemplate] = None,
+                 max_parts: int = 4, *args, **kwargs):
+        super(WebRemote, self).__init__(*args, **kwargs)
+        if upload_method not in ('PUT', 'POST'):
+            raise ValueError(f'upload_method must be PUT or POST (given: {upload_method})')
+
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.max_retries = max_retries
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.pool_size = pool_size
+        self.upload_url = upload_url
+        self.upload_method = upload_method
+        self.part_size = part_size
+        self.part_url = part_url
+        self.complete_url = complete_url
+        self.max_parts = max_parts
+
+        self._session = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Sessions aren't picklable
+        state = self.__dict__.copy()
+        state['_session'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """ The requests.Session shared by all the requests of the remote """
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update(self.headers)
+                self._session = session
+            return self._session
+
+    def _request(self, method: str, key: str, headers: tp.Optional[dict] = None, **kwargs):
+        import requests
+
+        try:
+            return self.session.request(method, key, headers=headers, timeout=self.timeout, **kwargs)
+        except requests.ConnectionError as e:
+            raise StorageConnectionError(f'{method} {key} failed: {e}') from e
+        except requests.RequestException as e:
+            raise UnknownError(f'{method} {key} failed: {e}') from e
+
+    @staticmethod
+    def _check(r, key: str, upload=False):
+        """ Map the error statuses to the remote exceptions """
+        if upload and 400 <= r.status_code < 500:
+            raise NonUploadableKeyError(f'{key}: {r.status_code} {r.reason}')
+        if r.status_code in (404, 410):
+            raise KeyNotFoundError(key)
+        if r.status_code in (401, 403, 405):
+            raise NonDownloadableKeyError(f'{key}: {r.status_code} {r.reason}')
+        if r.status_code >= 500:
+            raise StorageConnectionError(f'{key}: {r.status_code} {r.reason}')
+        if r.status_code >= 400:
+            raise UnknownError(f'{key}: {r.status_code} {r.reason}')
+
+    def _download(self, f, key: str, chunk_size: tp.Optional[int] = None, etag: tp.Optional[str] = None,
+                  modified_since: tp.Optional[float] = None, segmented: bool = True, **kwargs):
+        """
+        Parameters
+        ----------
+        chunk_size
+            Overrides the chunk size of the remote
+
+        etag, modified_since
+            Make the download conditional: NotModifiedError is raised (and nothing is written) if the object's
+            ETag is etag, or if it wasn't modified since the POSIX timestamp modified_since
+
+        segmented
+            Allow parallel segmented downloads
+        """
+        headers = {'Accept-Encoding': 'identity'}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if modified_since is not None:
+            headers['If-Modified-Since'] = formatdate(modified_since, usegmt=True)
+
+        chunk_size = chunk_size or self.chunk_size
+        start = f.tell() if is_seekable(f) else None
+
+        r = self._request('GET', key, headers=headers, stream=True)
+        with r:
+            if r.status_code == 304:
+                raise NotModifiedError(key)
+            self._check(r, key)
+
+            size = _content_length(r)
+            validator = _validator(r)
+            ranges = r.headers.get('Accept-Ranges', '').lower() == 'bytes' and validator is not None
+
+            if segmented and ranges and start is not None and self.segment_size is not None and \
+                    size is not None and size >= 2 * self.segment_size and self.max_segments > 1:
+                # The first segment is read from this response
+                segments = [(offset, min(offset + self.segment_size, size))
+                            for offset in range(0, size, self.segment_size)]
+                self._download_segments(f, key, start, segments, r, validator, chunk_size)
+                f.seek(start + size)
+                return
+
+            written, complete = self._stream(r, f.write, 0, size, chunk_size)
+
+        # Resume the download after interruptions
+        retries = 0
+        while not complete or (size is not None and written < size):
+            if not ranges or size is None or retries >= self.max_retries:
+                raise StorageConnectionError(f'The download of {key} was interrupted after {written} bytes')
+
+            retries += 1
+            logger.warning(f'{self.name}: resuming the download of {key} at {written} bytes (retry {retries})')
+            time.sleep(min(0.5 * 2 ** (retries - 1), 8.))
+            resumed, complete = self._fetch_range(key, written, size, validator, f.write, chunk_size)
+            if resumed > 0:
+                retries = 0
+            written += resumed
+
+    def _stream(self, r, write, offset: int, end: tp.Optional[int], chunk_size: int) -> tp.Tuple[int, bool]:
+        """
+        Write the body of a response, from the given offset of the object until end. Returns the number of bytes
+        written, and whether the body ended normally (rather than the connection breaking).
+        """
+        import requests
+        from urllib3.exceptions import HTTPError
+
+        written = 0
+        try:
+            for chunk in _iter_body(r, chunk_size):
+                if end is not None and offset + written + len(chunk) > end:
+                    chunk = chunk[:end - offset - written]
+                write(chunk)
+                written += len(chunk)
+                if end is not None and offset + written >= end:
+                    break
+
+        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError, HTTPError, OSError) as e:
+            # Possibly resumed
+            logger.debug(f'{self.name}: connection broken after {written} bytes: {e!r}')
+            return written, False
+
+        return written, True
+
+    def _fetch_range(self, key: str, start: int, end: int, validator: str, write,
+                     chunk_size: int) -> tp.Tuple[int, bool]:
+        """ Write the bytes [start, end) of an object that must not have changed (see _stream(...)) """
+        headers = {'Accept-Encoding': 'identity', 'Range': f'bytes={start}-{end - 1}', 'If-Range': validator}
+        try:
+            r = self._request('GET', key, headers=headers, stream=True)
+        except StorageConnectionError as e:
+            logger.debug(f'{self.name}: failed requesting {key} at {start}: {e!r}')
+            return 0, False
+
+        with r:
+            self._check(r, key)
+            if r.status_code != 206:
+                # If-Range failed
+                raise StorageConnectionError(f'{key} changed during the download')
+            return self._stream(r, write, start, end, chunk_size)
 
-    def _upload(self, f, key: str, **kwargs):
-        raise NotImplementedError(f"Uploads are not supported for {self.__class__.__name__}")
+    def _download_segments(self, f, key: str, start: int, segments: tp.List[tp.Tuple[int, int]], first,
+                           validator: str, chunk_size: int):
+        lock = threading.Lock()
+
+        def writer(offset: int):
+            position = [offset]
+
+            def write(chunk):
+                with lock:
+                    f.seek(start + position[0])
+                    f.write(chunk)
+                position[0] += len(chunk)
+            return write
+
+        def download(i: int, response=None):
+            offset, end = segments[i]
+            write = writer(offset)
+            if response is not None:
+                done, _ = self._stream(response, write, offset, end, chunk_size)
+            else:
+                done, _ = self._fetch_range(key, offset, end, validator, write, chunk_size)
+
+            retries = 0
+            while offset + done < end:
+                if retries >= self.max_retries:
+                    raise StorageConnectionError(f'The download of {key} was interrupted at {offset + done} bytes')
+                retries += 1
+                time.sleep(min(0.5 * 2 ** (retries - 1), 8.))
+                fetched, _ = self._fetch_range(key, offset + done, end, validator, write, chunk_size)
+                if fetched > 0:
+                    retries = 0
+                done += fetched
+
+        with ThreadPoolExecutor(max_workers=min(self.max_segments, len(segments))) as pool:
+            futures = [pool.submit(download, 0, first)] + [pool.submit(download, i) for i in range(1, len(segments))]
+            for future in futures:
+                future.result()
+
+    def _download_range(self, f, key: str, start: int, end: tp.Optional[int], chunk_size: tp.Optional[int] = None,
+                        **kwargs):
+        if end is not None and end <= start:
+            return
+
+        headers = {'Accept-Encoding': 'identity', 'Range': f'bytes={start}-{end - 1 if end is not None else ""}'}
+        with self._request('GET', key, headers=headers, stream=True) as r:
+            # The range starts past the end of the object
+            if r.status_code == 416:
+                return
+            self._check(r, key)
+
+            # Servers ignoring the Range header send the whole object
+            position = start if r.status_code == 206 else 0
+            for chunk in r.iter_content(chunk_size=chunk_size or self.chunk_size):
+                begin = max(0, start - position)
+                stop = len(chunk) if end is None else min(len(chunk), end - position)
+                if begin < stop:
+                    f.write(chunk[begin: stop])
+                position += len(chunk)
+                if end is not None and position >= end:
+                    break
+
+    def _upload(self, f, key: str, content_type: tp.Optional[str] = None, chunked: bool = False,
+                parts: bool = True, **kwargs) -> str:
+        """
+        Parameters
+        ----------
+        content_type
+            The Content-Type header of the upload
+
+        chunked
+            Use chunked transfer encoding even if the length of the stream is known
+
+        parts
+            Allow parallel part uploads (when part_url is set)
+        """
+        headers = {'Content-Type': content_type} if content_type is not None else {}
+
+        start = f.tell() if is_seekable(f) else None
+        size = None
+        if start is not None:
+            size = f.seek(0, 2) - start
+            f.seek(start)
+
+        if parts and self.part_url is not None and size is not None and size >= 2 * self.part_size:
+            self._upload_parts(f, key, start, size, headers)
+            return key
+
+        url = _format(self.upload_url, key) if self.upload_url is not None else key
+        retries = 0
+        while True:
+            try:
+                if size is None or chunked:
+                    # requests sends generators with chunked transfer encoding
+                    body = iter(lambda: f.read(self.chunk_size), b'')
+                else:
+                    body = _BoundedReader(f, size)
+                    headers['Content-Length'] = str(size)
+
+                with self._request(self.upload_method, url, headers=headers, data=body) as r:
+                    self._check(r, key, upload=True)
+                return key
+
+            except StorageConnectionError as e:
+                # Only seekable streams can be sent again
+                if start is None or retries >= self.max_retries:
+                    raise
+                retries += 1
+                logger.warning(f'{self.name}: retrying the upload of {key} (retry {retries}): {e}')
+                time.sleep(min(0.5 * 2 ** (retries - 1), 8.))
+                f.seek(start)
+
+    def _upload_parts(self, f, key: str, start: int, size: int, headers: dict):
+        import json
+
+        lock = threading.Lock()
+        layout = [(i + 1, offset, min(self.part_size, size - offset))
+                  for i, offset in enumerate(range(0, size, self.part_size))]
+
+        def upload(part: int, offset: int, part_size: int) -> dict:
+            with lock:
+                f.seek(start + offset)
+                data = f.read(part_size)
+
+            url = _format(self.part_url, key, part=part, offset=offset, size=part_size)
+            retries = 0
+            while True:
+                try:
+                    with self._request('PUT', url, headers=headers, data=data) as r:
+                        self._check(r, key, upload=True)
+                        return {'part': part, 'offset': offset, 'size': part_size, 'etag': r.headers.get('ETag')}
+
+                except StorageConnectionError as e:
+                    if retries >= self.max_retries:
+                        raise
+                    retries += 1
+                    logger.warning(f'{self.name}: retrying part {part} of {key} (retry {retries}): {e}')
+                    time.sleep(min(0.5 * 2 ** (retries - 1), 8.))
+
+        # The parts are read by the workers, so at most max_parts parts are held in memory
+        with ThreadPoolExecutor(max_workers=self.max_parts) as pool:
+            uploaded = list(pool.map(lambda args: upload(*args), layout))
+        f.seek(start + size)
+
+        if self.complete_url is not None:
+            body = json.dumps({'key': key, 'size': size, 'parts': uploaded})
+            with self._request('POST', _format(self.complete_url, key), data=body,
+                               headers={'Content-Type': 'application/json'}) as r:
+                self._check(r, key, upload=True)
+
+    def _head(self, key: str):
+        r = self._request('HEAD', key, headers={'Accept-Encoding': 'identity'}, allow_redirects=True)
+        if r.status_code in (405, 501):
+            # HEAD not allowed: request the first byte instead
+            r = self._request('GET', key, headers={'Accept-Encoding': 'identity', 'Range': 'bytes=0-0'},
+                              stream=True)
+            r.close()
+        return r
 
     def _contains(self, key: str):
-        return False
-        # raise NotImplementedError(f"Existence checks are not supported for {self.__class__.__name__}")
+        r = self._head(key)
+        if r.status_code in (404, 410):
+            return False
+        self._check(r, key)
+        return True
+
+    def _stat(self, key: str) -> KeyInfo:
+        r = self._head(key)
+        self._check(r, key)
+
+        size = _content_length(r)
+        content_range = r.headers.get('Content-Range', '')
+        if r.status_code == 206 and '/' in content_range:
+            total = content_range.rpartition('/')[2]
+            size = int(total) if total.isdigit() else None
+
+        mtime = None
+        if 'Last-Modified' in r.headers:
+            try:
+                mtime = parsedate_to_datetime(r.headers['Last-Modified']).timestamp()
+            except (TypeError, ValueError):
+                pass
+
+        return KeyInfo(key=key, size=size, mtime=mtime)
+
+
+def _iter_body(r, chunk_size: int) -> tp.Iterator[bytes]:
+    """
+    The chunks of the body of a response, of up to chunk_size bytes. The bytes received before the connection
+    breaks are yielded (when urllib3 supports it), so that no more than what was lost is downloaded again.
+    """
+    if not hasattr(r.raw, 'read1'):
+        yield from r.iter_content(chunk_size=chunk_size)
+        return
+
+    while True:
+        chunk = r.raw.read1(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _format(template: UrlTemplate, key: str, **kwargs) -> str:
+    if callable(template):
+        return template(key, **kwargs)
+    return template.format(key=key, quoted_key=quote(key, safe=''), **kwargs)
+
+
+class _BoundedReader:
+    """ Reads up to size bytes of a stream (the body of an upload, sent with its length) """
+
+    def __init__(self, f, size: int):
+        self._f = f
+        self._remaining = size
+
+    def __len__(self):
+        return self._remaining
+
+    def read(self, size=-1) -> bytes:
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._f.read(size) if size else b''
+        self._remaining -= len(data)
+        return data
+
+
+def _content_length(r) -> tp.Optional[int]:
+    """ The size of the object, if known from the response """
+    length = r.headers.get('Content-Length')
+    if length is None or not length.isdigit() or r.headers.get('Content-Encoding', 'identity') != 'identity':
+        return None
+    return int(length)
+
+
+def _validator(r) -> tp.Optional[str]:
+    """ A value for If-Range identifying the version of the object: a strong ETag, or the Last-Modified date """
+    etag = r.headers.get('ETag')
+    if etag is not None and not etag.startswith('W/'):
+        return etag
+    return r.headers.get('Last-Modified')
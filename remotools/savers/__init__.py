@@ -1,12 +1,55 @@
 from .base import BaseSaver
-from .composite_saver import CompositeSaver
-from .csvpandas_saver import CSVPandasSaver
-from .json_saver import JSONSaver
-from .jsonpickle_saver import JSONPickleSaver
-from .pickle_saver import PickleSaver
-from .pil_image_saver import PILImageSaver, PILImageSaverPNG, PILImageSaverJPG
-from .plydata_saver import PlyDataSaver
-from .yaml_saver import YAMLSaver
-from .text_saver import TextSaver
-from .torch_saver import TorchSaver
-from .numpy_saver import NumpySaver
+import importlib
+import typing as tp
+
+# The savers are imported on first access (PEP 562)
+_LAZY = {
+    'CompositeSaver': '.composite_saver',
+    'CSVPandasSaver': '.csvpandas_saver',
+    'JSONSaver': '.json_saver',
+    'JSONPickleSaver': '.jsonpickle_saver',
+    'PickleSaver': '.pickle_saver',
+    'PILImageSaver': '.pil_image_saver',
+    'PILImageSaverPNG': '.pil_image_saver',
+    'PILImageSaverJPG': '.pil_image_saver',
+    'PlyDataSaver': '.plydata_saver',
+    'YAMLSaver': '.yaml_saver',
+    'TextSaver': '.text_saver',
+    'TorchSaver': '.torch_saver',
+    'NumpySaver': '.numpy_saver',
+    'NumpyRawSaver': '.numpy_saver',
+    'NumpyBundleSaver': '.numpy_saver',
+    'ChunkedArraySaver': '.chunked_array_saver',
+    'ParquetSaver': '.parquet_saver',
+    'ArrowSaver': '.parquet_saver',
+}
+
+__all__ = ['BaseSaver'] + list(_LAZY)
+
+if tp.TYPE_CHECKING:
+    from .composite_saver import CompositeSaver
+    from .csvpandas_saver import CSVPandasSaver
+    from .json_saver import JSONSaver
+    from .jsonpickle_saver import JSONPickleSaver
+    from .pickle_saver import PickleSaver
+    from .pil_image_saver import PILImageSaver, PILImageSaverPNG, PILImageSaverJPG
+    from .plydata_saver import PlyDataSaver
+    from .yaml_saver import YAMLSaver
+    from .text_saver import TextSaver
+    from .torch_saver import TorchSaver
+    from .numpy_saver import NumpySaver, NumpyRawSaver, NumpyBundleSaver
+    from .chunked_array_saver import ChunkedArraySaver
+    from .parquet_saver import ParquetSaver, ArrowSaver
+
+
+def __getattr__(name: str):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return __all__
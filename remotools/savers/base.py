@@ -1,7 +1,10 @@
-from abc import ABC, abstractmethod
+import io
+from abc import ABC
 from remotools.remotes.base import BaseRemote
+from remotools.utils import keep_position
 import typing as tp
 from remotools.parallel.saver import ConcurrentSaver
+from remotools.instrumentation import instrument
 
 
 class BaseSaver(ABC):
@@ -19,31 +22,58 @@ class BaseSaver(ABC):
 
     Methods
     -------
-    concurrent(**kwargs) -> ConcurrentSaver
-        Converts the saver into a concurrent saver that utilizes threads to speed up the operations.
-        Returns an instance of a ConcurrentSaver.
-
-    Abstract Methods
-    ----------------
     save(obj, key, ...) -> remote_key
         Save a given object in the remote with the given key. Returns the actual key the object was saved under.
 
     load(key) -> obj
         Load an object from the given key. Returns the loaded object.
 
+    concurrent(**kwargs) -> ConcurrentSaver
+        Converts the saver into a concurrent saver that utilizes threads (or processes) to speed up the operations.
+        Returns an instance of a ConcurrentSaver.
+
+    Methods to Implement
+    --------------------
+    A subclass must either implement the following two methods, or override save(...) and load(...) directly:
+    encode(obj, f, key=None, ...)
+        Serialize the object into the binary stream f. Must not depend on the remote.
+
+    decode(f, ...) -> obj
+        Deserialize an object from the binary stream f. Must not depend on the remote.
+
+    Savers implementing encode/decode can have their serialization offloaded to worker processes.
     """
 
     def __init__(self, remote: BaseRemote):
         assert isinstance(remote, BaseRemote), f"remote must be an derived from {BaseRemote.__name__}, (got {remote})"
         self.remote = remote
 
-    @abstractmethod
     def save(self, obj: tp.Any, key: str, upload_params=None, progress=True, **kwargs) -> str:
-        pass
+        name = self.__class__.__name__
+        with instrument(name, 'save'):
+            f = io.BytesIO()
+            with keep_position(f), instrument(name, 'encode', stream=f):
+                self.encode(obj, f, key=key, **kwargs)
+            return self.remote.upload(f, key, params=upload_params, progress=progress)
 
-    @abstractmethod
     def load(self, key: str, download_params=None, progress=True, **kwargs) -> tp.Any:
-        pass
+        name = self.__class__.__name__
+        with instrument(name, 'load'):
+            f = io.BytesIO()
+            self.remote.download(f, key, params=download_params, progress=progress, keep_stream_position=True)
+            with instrument(name, 'decode', stream=f):
+                return self.decode(f, **kwargs)
+
+    def encode(self, obj: tp.Any, f, key: tp.Optional[str] = None, **kwargs):
+        raise NotImplementedError(f"Encoding is not supported by {self.__class__.__name__}")
+
+    def decode(self, f, **kwargs) -> tp.Any:
+        raise NotImplementedError(f"Decoding is not supported by {self.__class__.__name__}")
+
+    @property
+    def supports_encoding(self) -> bool:
+        """ Whether the saver implements encode(...) and decode(...) """
+        return type(self).encode is not BaseSaver.encode and type(self).decode is not BaseSaver.decode
 
     def concurrent(self, **kwargs) -> ConcurrentSaver:
         return ConcurrentSaver(saver=self, **kwargs)
@@ -0,0 +1,308 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+import io
+import json
+import math
+import typing as tp
+import zlib
+from remotools.savers.base import BaseSaver
+from remotools.exceptions import SaverError
+from remotools.instrumentation import instrument
+
+COMPRESSORS = (None, 'zlib')
+
+
+class ChunkedArraySaver(BaseSaver):
+    """
+    Saves N-dimensional arrays as a grid of separately compressed chunks, so that a slice of the array
+    can be read without downloading all of it.
+
+    An array saved under key 'a' is made of a JSON metadata object at 'a' (shape, dtype, chunk shape and
+    compressor) and of one object per chunk at 'a.chunks/<i>.<j>...'. Chunks on the edges of the array
+    are stored at their actual (smaller) shape.
+
+    save(...) writes the chunks concurrently. load(...) returns a ChunkedArray, which reads only the chunks
+    intersecting the requested slice, concurrently.
+
+    Attributes
+    ----------
+    chunk_bytes
+        Target (uncompressed) chunk size, used when no chunk shape is given. Arrays are then chunked
+        along their first axis only, which suits row-wise random access.
+
+    compressor
+        'zlib' or None
+
+    compression_level
+        The zlib compression level (1 is the fastest)
+
+    max_workers
+        Number of threads uploading or downloading chunks
+
+    Examples
+    --------
+    >> saver = ChunkedArraySaver(S3Remote(bucket='features'))
+    >> saver.save(features, 'train/features', chunks=(4096, 128))
+    >> array = saver.load('train/features')
+    >> batch = array[1000:1256]             # Fetches only the chunks containing rows 1000-1255
+    """
+
+    def __init__(self, remote, chunk_bytes: int = 2 ** 20, compressor: tp.Optional[str] = 'zlib',
+                 compression_level: int = 1, max_workers: tp.Optional[int] = 8):
+        super(ChunkedArraySaver, self).__init__(remote)
+        if compressor not in COMPRESSORS:
+            raise ValueError(f'Unknown compressor {compressor} (must be one of {COMPRESSORS})')
+
+        self.chunk_bytes = chunk_bytes
+        self.compressor = compressor
+        self.compression_level = compression_level
+        self.max_workers = max_workers
+
+    def save(self, obj: tp.Any, key: str, chunks: tp.Optional[tp.Sequence[int]] = None, upload_params=None,
+             progress=True, **kwargs) -> str:
+        """
+        Save an array.
+
+        Parameters
+        ----------
+        obj
+            An array (or anything convertible by np.asarray, e.g. a np.memmap)
+
+        key
+            Remote key of the array's metadata. The chunks are stored next to it.
+
+        chunks
+            The chunk shape. Defaults to chunks of about chunk_bytes bytes along the first axis.
+
+        upload_params
+            Parameters passed to the remote's upload method
+
+        progress
+            Show a progress bar for the metadata upload (chunk uploads are not reported individually)
+
+        Returns
+        -------
+            Remote key of the metadata
+        """
+        import numpy as np
+
+        array = np.asarray(obj)
+        if array.dtype.hasobject:
+            raise SaverError('Arrays of objects are not supported')
+
+        chunks = tuple(chunks) if chunks is not None else self._default_chunks(array)
+        if len(chunks) != array.ndim or any(c <= 0 for c in chunks):
+            raise ValueError(f'Invalid chunk shape {chunks} for an array of shape {array.shape}')
+
+        indices = _chunk_grid(array.shape, chunks)
+        with instrument(self.__class__.__name__, 'save'), ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self._save_chunk, array[_chunk_slices(index, chunks)],
+                                   f'{key}.chunks/{_chunk_name(index)}', upload_params)
+                       for index in indices]
+            chunk_keys = [future.result() for future in futures]
+
+            meta = dict(shape=list(array.shape), dtype=array.dtype.str, chunks=list(chunks),
+                        compressor=self.compressor)
+
+            # Remotes that choose the keys themselves (e.g. HFSRemote) require storing the keys of the chunks
+            names = [_chunk_name(index) for index in indices]
+            if any(chunk_key != f'{key}.chunks/{name}' for chunk_key, name in zip(chunk_keys, names)):
+                meta['keys'] = dict(zip(names, chunk_keys))
+
+            f = io.BytesIO(json.dumps(meta).encode('utf-8'))
+            return self.remote.upload(f, key, params=upload_params, progress=progress)
+
+    def load(self, key: str, download_params=None, progress=True, **kwargs) -> ChunkedArray:
+        """ Returns a ChunkedArray. No chunk is downloaded until it is indexed. """
+        f = io.BytesIO()
+        self.remote.download(f, key, params=download_params, progress=progress, keep_stream_position=True)
+        meta = json.load(io.TextIOWrapper(f, encoding='utf-8'))
+        return ChunkedArray(self, key, meta, download_params=download_params)
+
+    def _default_chunks(self, array) -> tp.Tuple[int, ...]:
+        if array.ndim == 0:
+            return ()
+        row_bytes = max(1, array[:1].nbytes)
+        rows = max(1, self.chunk_bytes // row_bytes)
+        return (min(rows, max(1, array.shape[0])),) + array.shape[1:]
+
+    def _save_chunk(self, chunk, key: str, upload_params) -> str:
+        import numpy as np
+
+        data = memoryview(np.ascontiguousarray(chunk)).cast('B')
+        if self.compressor == 'zlib':
+            data = zlib.compress(data, self.compression_level)
+        return self.remote.upload(io.BytesIO(data), key, params=upload_params, progress=False)
+
+    def _load_chunk(self, key: str, shape: tp.Tuple[int, ...], dtype, compressor: tp.Optional[str],
+                    download_params):
+        import numpy as np
+
+        f = io.BytesIO()
+        self.remote.download(f, key, params=download_params, progress=False)
+        data = f.getbuffer()
+        if compressor == 'zlib':
+            data = zlib.decompress(data)
+        return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+
+class ChunkedArray:
+    """
+    A lazily loaded array saved by ChunkedArraySaver.
+
+    Supports basic indexing (integers, slices with positive steps and Ellipsis). Each indexing operation
+    downloads the chunks it intersects concurrently and returns a new numpy array. np.asarray(...) reads
+    the whole array.
+    """
+
+    def __init__(self, saver: ChunkedArraySaver, key: str, meta: dict, download_params=None):
+        import numpy as np
+
+        self.saver = saver
+        self.key = key
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.chunks = tuple(meta['chunks'])
+        self.compressor = meta['compressor']
+        self.download_params = download_params
+        self._keys = meta.get('keys')
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        size = 1
+        for n in self.shape:
+            size *= n
+        return size
+
+    @property
+    def nbytes(self) -> int:
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        if not self.shape:
+            raise TypeError('len() of unsized object')
+        return self.shape[0]
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(key={self.key!r}, shape={self.shape}, dtype={self.dtype}, ' \
+               f'chunks={self.chunks})'
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[...]
+        return array.astype(dtype, copy=False) if dtype is not None else array
+
+    def __getitem__(self, item):
+        import numpy as np
+
+        selection, squeeze = _normalize_selection(item, self.shape)
+        out = np.empty(tuple(len(range(*s.indices(n))) for s, n in zip(selection, self.shape)), dtype=self.dtype)
+
+        # For every dimension, the chunks intersecting the selection with the corresponding slices
+        per_dim = [_intersecting_chunks(s, n, c) for s, n, c in zip(selection, self.shape, self.chunks)]
+        tasks = [tuple(tuple(part[i] for part in parts) for i in range(3)) for parts in product(*per_dim)] \
+            if out.size > 0 else []
+
+        def fetch(task):
+            index, chunk_selection, out_selection = task
+            chunk = self._load_chunk(index)
+            out[out_selection] = chunk[chunk_selection]
+
+        if len(tasks) == 1 or self.saver.max_workers == 1:
+            for task in tasks:
+                fetch(task)
+        elif tasks:
+            with ThreadPoolExecutor(max_workers=self.saver.max_workers) as pool:
+                for future in [pool.submit(fetch, task) for task in tasks]:
+                    future.result()
+
+        return out[squeeze] if squeeze else out
+
+    def _load_chunk(self, index: tp.Tuple[int, ...]):
+        name = _chunk_name(index)
+        key = self._keys[name] if self._keys is not None else f'{self.key}.chunks/{name}'
+        shape = tuple(min(c, n - i * c) for i, c, n in zip(index, self.chunks, self.shape))
+        return self.saver._load_chunk(key, shape, self.dtype, self.compressor, self.download_params)
+
+
+def _chunk_grid(shape, chunks) -> tp.List[tp.Tuple[int, ...]]:
+    return list(product(*(range(max(1, math.ceil(n / c))) for n, c in zip(shape, chunks))))
+
+
+def _chunk_slices(index, chunks) -> tp.Tuple[slice, ...]:
+    return tuple(slice(i * c, (i + 1) * c) for i, c in zip(index, chunks))
+
+
+def _chunk_name(index) -> str:
+    return '.'.join(map(str, index)) or '0'
+
+
+def _normalize_selection(item, shape) -> tp.Tuple[tp.List[slice], tp.Tuple]:
+    """
+    Converts an index expression into one slice per dimension. Also returns the index that removes the
+    dimensions indexed by integers from the result (an empty tuple if there are none).
+    """
+    if not isinstance(item, tuple):
+        item = (item,)
+
+    if sum(x is Ellipsis for x in item) > 1:
+        raise IndexError('An index can only have a single ellipsis')
+
+    if Ellipsis in item:
+        position = item.index(Ellipsis)
+        item = item[:position] + (slice(None),) * (len(shape) - len(item) + 1) + item[position + 1:]
+
+    if len(item) > len(shape):
+        raise IndexError(f'Too many indices for an array of {len(shape)} dimensions')
+    item = item + (slice(None),) * (len(shape) - len(item))
+
+    selection, squeeze, integers = [], [], False
+    for x, n in zip(item, shape):
+        if isinstance(x, slice):
+            if x.step is not None and x.step <= 0:
+                raise IndexError('Only positive slice steps are supported')
+            selection.append(slice(*x.indices(n)))
+            squeeze.append(slice(None))
+
+        elif hasattr(x, '__index__'):
+            i = x.__index__()
+            if not -n <= i < n:
+                raise IndexError(f'Index {i} is out of bounds for a dimension of size {n}')
+            i = i % n
+            selection.append(slice(i, i + 1, 1))
+            squeeze.append(0)
+            integers = True
+
+        else:
+            raise IndexError(f'Unsupported index {x!r} (only integers, slices and Ellipsis are supported)')
+
+    return selection, tuple(squeeze) if integers else ()
+
+
+def _intersecting_chunks(selection: slice, size: int, chunk: int) -> tp.List[tp.Tuple[int, slice, slice]]:
+    """
+    The chunks of a dimension intersecting the selection. For each chunk, returns its index, the selection
+    within the chunk and the corresponding slice of the output.
+    """
+    start, stop, step = selection.indices(size)
+    if start >= stop:
+        return []
+
+    result = []
+    for index in range(start // chunk, (stop - 1) // chunk + 1):
+        begin, end = index * chunk, min((index + 1) * chunk, stop)
+
+        # The first selected position inside the chunk
+        first = start if begin <= start else start + math.ceil((begin - start) / step) * step
+        if first >= end:
+            continue
+
+        count = len(range(first, end, step))
+        offset = (first - start) // step
+        result.append((index, slice(first - begin, end - begin, step), slice(offset, offset + count)))
+
+    return result
@@ -1,24 +1,169 @@
-import io
-
 from remotools.savers.base import BaseSaver
-from remotools.utils import keep_position
+from remotools.utils import IteratorReader, streaming_download, is_seekable
+from remotools.instrumentation import instrument
 import typing as tp
+import io
+import re
+
+# Compression by file extension (as in pandas' compression='infer')
+EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}
+COMPRESSIONS = (None, 'gzip', 'bz2', 'xz')
+
+# Compression by the first bytes of the file
+MAGIC = [(re.compile(b'\x1f\x8b'), 'gzip'), (re.compile(b'BZh[1-9]'), 'bz2'), (re.compile(b'\xfd7zXZ\x00'), 'xz')]
 
 
 class CSVPandasSaver(BaseSaver):
+    """
+    Saves pandas DataFrames as CSV.
 
-    def save(self, obj: tp.Any, key: str, upload_params=None, progress=True, index=False, **kwargs):
-        import pandas as pd
-        assert isinstance(obj, pd.DataFrame)
+    The CSV is streamed in both directions: save(...) formats and uploads the rows chunksize at a time, and
+    load(...) and load_iter(...) parse the bytes as they are downloaded. So the memory usage doesn't depend
+    on the size of the file (besides the DataFrame itself, for load(...)).
+
+    Attributes
+    ----------
+    chunksize
+        Number of rows formatted at a time when saving
+
+    compression
+        'gzip', 'bz2', 'xz', None, or 'infer' to choose by the extension of the key (e.g. 'table.csv.gz')
+        when saving, and by the first bytes of the file when loading
+
+    compression_level
+        The compression level (None uses the default of the codec)
+
+    Examples
+    --------
+    >> saver = CSVPandasSaver(S3Remote(bucket='tables'))
+    >> saver.save(df, 'events.csv.gz')
+    >> for chunk in saver.load_iter('events.csv.gz', chunksize=10 ** 5):
+    >>     process(chunk)
+    """
+
+    def __init__(self, remote, chunksize: int = 10 ** 5, compression: tp.Optional[str] = 'infer',
+                 compression_level: tp.Optional[int] = None):
+        super(CSVPandasSaver, self).__init__(remote)
+        if compression != 'infer' and compression not in COMPRESSIONS:
+            raise ValueError(f'Unknown compression {compression} (must be one of {COMPRESSIONS} or "infer")')
+
+        self.chunksize = chunksize
+        self.compression = compression
+        self.compression_level = compression_level
+
+    def save(self, obj: tp.Any, key: str, upload_params=None, progress=True, **kwargs) -> str:
+        with instrument(self.__class__.__name__, 'save'), \
+                IteratorReader(self._chunks(obj, key=key, **kwargs)) as f:
+            return self.remote.upload(f, key, params=upload_params, progress=progress)
+
+    def load(self, key: str, download_params=None, progress=True, **kwargs) -> tp.Any:
+        with instrument(self.__class__.__name__, 'load'), \
+                streaming_download(self.remote, key, params=download_params, progress=progress) as f:
+            return self.decode(f, compression=self.compression, **kwargs)
+
+    def load_iter(self, key: str, chunksize: tp.Optional[int] = None, download_params=None, progress=False,
+                  **kwargs) -> tp.Iterator[tp.Any]:
+        """
+        Iterate over the rows of a CSV file, chunksize rows (a DataFrame) at a time.
+
+        The file is downloaded in a background thread and parsed as it arrives. Stopping the iteration
+        early stops the download.
+
+        Parameters
+        ----------
+        key
+            Remote key
 
-        f = io.BytesIO()
-        with keep_position(f):
-            f.write(obj.to_csv(index=index, **kwargs).encode())
-        return self.remote.upload(f, key, params=upload_params, progress=progress)
+        chunksize
+            Number of rows per DataFrame. Defaults to the saver's chunksize.
 
-    def load(self, key: str, download_params=None, progress=True, **kwargs):
+        download_params
+            Parameters passed to the remote's download method
+
+        progress
+            Report the progress of the download (see BaseRemote.download)
+
+        kwargs
+            Passed to pandas.read_csv(...)
+        """
+        with streaming_download(self.remote, key, params=download_params, progress=progress) as f:
+            reader = self.decode(f, compression=self.compression, chunksize=chunksize or self.chunksize,
+                                 **kwargs)
+            with reader:
+                yield from reader
+
+    def encode(self, obj: tp.Any, f, key: tp.Optional[str] = None, **kwargs):
+        for chunk in self._chunks(obj, key=key, **kwargs):
+            f.write(chunk)
+
+    def decode(self, f, compression: tp.Optional[str] = 'infer', **kwargs):
         import pandas as pd
-        f = io.BytesIO()
 
-        self.remote.download(f, key, params=download_params, progress=progress, keep_stream_position=True)
+        if compression == 'infer':
+            f, compression = _sniff_compression(f)
+
+        if compression == 'gzip':
+            import gzip
+            f = gzip.GzipFile(fileobj=f, mode='rb')
+        elif compression == 'bz2':
+            import bz2
+            f = bz2.BZ2File(f, mode='rb')
+        elif compression == 'xz':
+            import lzma
+            f = lzma.LZMAFile(f, mode='rb')
+
         return pd.read_csv(f, **kwargs)
+
+    def _compression(self, key: tp.Optional[str]) -> tp.Optional[str]:
+        if self.compression != 'infer':
+            return self.compression
+
+        for extension, compression in EXTENSIONS.items():
+            if key is not None and key.endswith(extension):
+                return compression
+        return None
+
+    def _compressor(self, compression: tp.Optional[str]):
+        level = self.compression_level
+        if compression == 'gzip':
+            import zlib
+            # wbits=31 produces a gzip stream
+            return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level, zlib.DEFLATED, 31)
+        if compression == 'bz2':
+            import bz2
+            return bz2.BZ2Compressor(9 if level is None else level)
+        if compression == 'xz':
+            import lzma
+            return lzma.LZMACompressor(preset=level)
+        return None
+
+    def _chunks(self, obj, key: tp.Optional[str] = None, index=False, encoding='utf-8',
+                **kwargs) -> tp.Iterator[bytes]:
+        """ The (compressed) CSV, chunksize rows at a time """
+        import pandas as pd
+        assert isinstance(obj, pd.DataFrame)
+
+        compressor = self._compressor(self._compression(key))
+        header = kwargs.pop('header', True)
+        for start in range(0, max(1, len(obj)), self.chunksize):
+            data = obj.iloc[start: start + self.chunksize].to_csv(index=index, header=header if start == 0 else False,
+                                                                    **kwargs).encode(encoding)
+            yield compressor.compress(data) if compressor is not None else data
+
+        if compressor is not None:
+            yield compressor.flush()
+
+
+def _sniff_compression(f) -> tp.Tuple[tp.Any, tp.Optional[str]]:
+    """ The compression of a stream by its first bytes. Also returns the stream to read from instead of f. """
+    if is_seekable(f):
+        head = f.read(6)
+        f.seek(-len(head), io.SEEK_CUR)
+    else:
+        f = io.BufferedReader(f)
+        head = f.peek(6)[:6]
+
+    for magic, compression in MAGIC:
+        if magic.match(head):
+            return f, compression
+    return f, None
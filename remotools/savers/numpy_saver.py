@@ -1,21 +1,367 @@
+from __future__ import annotations
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from shutil import copyfileobj
 import io
 import json
-from remotools.savers.base import BaseSaver
-from remotools.utils import keep_position
 import typing as tp
+from remotools.savers.base import BaseSaver
+from remotools.exceptions import SaverError
+from remotools.remotes.exceptions import KeyNotFoundError
+from remotools.utils import ConcatReader
+from remotools.instrumentation import instrument
 
 
 class NumpySaver(BaseSaver):
 
-    def save(self, obj: tp.Any, key: str, upload_params=None, progress=True, **kwargs):
+    def encode(self, obj: tp.Any, f, key: tp.Optional[str] = None, **kwargs):
+        import numpy as np
+        np.save(f, obj, **kwargs)
+
+    def decode(self, f, **kwargs):
+        import numpy as np
+        return np.load(f, **kwargs)
+
+
+class NumpyRawSaver(NumpySaver):
+    """
+    Saves arrays in the .npy format without intermediate copies.
+
+    The upload streams the .npy header followed by the array's own buffer, and the download allocates
+    the resulting array once and writes the incoming bytes directly into it. So saving or loading an array
+    takes about 1x its size in memory, instead of the 2-3x of NumpySaver.
+
+    When the remote is a LocalRemote, arrays can be memory-mapped instead of read (see mmap_mode).
+
+    The objects are regular .npy files (readable by np.load and NumpySaver). Arrays of Python objects
+    are not supported, use NumpySaver for them.
+
+    Attributes
+    ----------
+    mmap_mode
+        Passed to np.load(...) to memory-map arrays stored by a LocalRemote. None (the default) disables
+        memory-mapping. The key must not be saved again while a mapped array is in use: the file is rewritten
+        in place, and accessing a mapped array of a truncated file kills the process (SIGBUS).
+    """
+
+    def __init__(self, remote, mmap_mode: tp.Optional[str] = None):
+        super(NumpyRawSaver, self).__init__(remote)
+        self.mmap_mode = mmap_mode
+
+    def save(self, obj: tp.Any, key: str, upload_params=None, progress=True, **kwargs) -> str:
+        with instrument(self.__class__.__name__, 'save'), _npy_reader(obj) as f:
+            return self.remote.upload(f, key, params=upload_params, progress=progress)
+
+    def load(self, key: str, download_params=None, progress=True, **kwargs) -> tp.Any:
+        from remotools.remotes.local import LocalRemote
+
+        with instrument(self.__class__.__name__, 'load'):
+            if self.mmap_mode is not None and isinstance(self.remote, LocalRemote):
+                import numpy as np
+                try:
+                    return np.load(self.remote._full_path(key), mmap_mode=self.mmap_mode, allow_pickle=False)
+                except FileNotFoundError as e:
+                    raise KeyNotFoundError(key) from e
+
+            f = _NpyWriter()
+            self.remote.download(f, key, params=download_params, progress=progress)
+            return f.result()
+
+    def encode(self, obj: tp.Any, f, key: tp.Optional[str] = None, **kwargs):
+        with _npy_reader(obj) as reader:
+            copyfileobj(reader, f)
+
+    def decode(self, f, **kwargs):
+        writer = _NpyWriter()
+        copyfileobj(f, writer)
+        return writer.result()
+
+
+class NumpyBundleSaver(BaseSaver):
+    """
+    Saves a dictionary of arrays as a bundle, and loads the arrays of a bundle lazily.
+
+    Each array is saved (concurrently) as a separate .npy object next to the bundle's key, using
+    NumpyRawSaver. The bundle's key holds a JSON index of the arrays. Loading returns an ArrayBundle,
+    a read-only mapping that fetches each array on first access, so only the arrays actually used are
+    downloaded (or memory-mapped, for LocalRemote with mmap_mode).
+
+    Keys ending with '.npz' are loaded with np.load(...), which also decompresses the arrays on access. They can't
+    be saved as bundles (write them with np.savez and upload them to the remote instead).
+
+    Attributes
+    ----------
+    max_workers
+        Number of threads saving the arrays of a bundle
+
+    mmap_mode
+        See NumpyRawSaver
+    """
+
+    def __init__(self, remote, max_workers: tp.Optional[int] = 8, mmap_mode: tp.Optional[str] = None):
+        super(NumpyBundleSaver, self).__init__(remote)
+        self.max_workers = max_workers
+        self.array_saver = NumpyRawSaver(remote, mmap_mode=mmap_mode)
+
+    def save(self, obj: tp.Mapping[str, tp.Any], key: str, upload_params=None, progress=True, **kwargs) -> str:
         import numpy as np
+
+        if key.endswith('.npz'):
+            raise SaverError(f'Bundles can\'t be saved as .npz keys, which are loaded as .npz files (given: {key})')
+
+        names = list(obj)
+        with instrument(self.__class__.__name__, 'save'), ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self.array_saver.save, obj[name], f'{key}.{name}.npy',
+                                   upload_params=upload_params, progress=False) for name in names]
+
+            index = {}
+            for name, future in zip(names, futures):
+                array = np.asanyarray(obj[name])
+                index[name] = dict(key=future.result(), shape=list(array.shape), dtype=array.dtype.str)
+
+            f = io.BytesIO(json.dumps({'arrays': index}).encode('utf-8'))
+            return self.remote.upload(f, key, params=upload_params, progress=progress)
+
+    def load(self, key: str, download_params=None, progress=True, **kwargs) -> tp.Mapping[str, tp.Any]:
+        if key.endswith('.npz'):
+            return self._load_npz(key, download_params=download_params, progress=progress, **kwargs)
+
         f = io.BytesIO()
-        with keep_position(f):
-            np.save(f, obj, **kwargs)
-        return self.remote.upload(f, key, params=upload_params, progress=progress)
+        self.remote.download(f, key, params=download_params, progress=progress, keep_stream_position=True)
+        index = json.load(io.TextIOWrapper(f, encoding='utf-8'))['arrays']
+        return ArrayBundle(self.array_saver, index, download_params=download_params)
 
-    def load(self, key: str, download_params=None, progress=True, **kwargs):
+    def _load_npz(self, key: str, download_params=None, progress=True, **kwargs):
         import numpy as np
+        from remotools.remotes.local import LocalRemote
+
+        if isinstance(self.remote, LocalRemote):
+            try:
+                return np.load(self.remote._full_path(key), **kwargs)
+            except FileNotFoundError as e:
+                raise KeyNotFoundError(key) from e
+
         f = io.BytesIO()
         self.remote.download(f, key, params=download_params, progress=progress, keep_stream_position=True)
         return np.load(f, **kwargs)
+
+
+class ArrayBundle(Mapping):
+    """ A read-only mapping of array names to arrays, loading each array on first access """
+
+    def __init__(self, saver: NumpyRawSaver, index: tp.Dict[str, dict], download_params=None):
+        self.saver = saver
+        self.index = index
+        self.download_params = download_params
+        self._arrays = {}
+
+    def __getitem__(self, name: str):
+        if name not in self._arrays:
+            if name not in self.index:
+                raise KeyError(name)
+            self._arrays[name] = self.saver.load(self.index[name]['key'], download_params=self.download_params,
+                                                 progress=False)
+        return self._arrays[name]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def shape(self, name: str) -> tp.Tuple[int, ...]:
+        """ The shape of an array, without loading it """
+        return tuple(self.index[name]['shape'])
+
+    def dtype(self, name: str):
+        """ The dtype of an array, without loading it """
+        import numpy as np
+        return np.dtype(self.index[name]['dtype'])
+
+
+def _npy_reader(obj) -> ConcatReader:
+    """ A stream of the .npy file of an array, made of its header and the array's own buffer """
+    import numpy as np
+    from numpy.lib import format
+
+    array = np.asanyarray(obj)
+    if array.dtype.hasobject:
+        raise SaverError('Arrays of objects are not supported, use NumpySaver instead')
+
+    header = format.header_data_from_array_1_0(array)
+    f = io.BytesIO()
+    try:
+        format.write_array_header_1_0(f, header)
+    except ValueError:
+        # The header is too large for version 1.0
+        f = io.BytesIO()
+        format.write_array_header_2_0(f, header)
+
+    # Same memory layout as np.save(...): Fortran ordered arrays are written transposed
+    if header['fortran_order']:
+        data = array.T
+    else:
+        data = np.ascontiguousarray(array)
+
+    return ConcatReader([f.getbuffer(), data.reshape(-1).view(np.uint8)])
+
+
+class _NpyWriter(io.RawIOBase):
+    """
+    A stream receiving a .npy file. The array is allocated as soon as the header is received, and the data
+    is written directly into it.
+
+    The stream is also readable and seekable (over the header followed by the array's buffer), since some
+    remotes read back what they downloaded, e.g. to verify its hash.
+    """
+
+    MAGIC_SIZE = 8
+
+    def __init__(self):
+        super(_NpyWriter, self).__init__()
+        self._header = bytearray()
+        self._header_size: tp.Optional[int] = None
+        self._array = None
+        self._target: tp.Optional[memoryview] = None
+        self._position = 0
+        self._end = 0
+
+        # Writes past the header that arrive before it (e.g. from out of order ranged downloads)
+        self._pending: tp.List[tp.Tuple[int, bytes]] = []
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._end + offset
+        else:
+            raise ValueError(f'Invalid whence ({whence})')
+
+        if position < 0:
+            raise ValueError(f'Negative seek position {position}')
+
+        self._position = position
+        return position
+
+    def write(self, b):
+        with memoryview(b) as view, view.cast('B') as data:
+            n = data.nbytes
+            start = 0
+            if self._target is None:
+                if self._position > len(self._header):
+                    self._pending.append((self._position, data.tobytes()))
+                    start = n
+                else:
+                    start = self._read_header(data)
+
+            if start < n:
+                self._write_data(self._position + start, data[start:])
+
+        self._position += n
+        self._end = max(self._end, self._position)
+        return n
+
+    def readinto(self, b):
+        with memoryview(b) as view, view.cast('B') as target:
+            n = 0
+            header_size = len(self._header)
+
+            # Read from the header
+            if self._position < header_size:
+                n = min(target.nbytes, header_size - self._position)
+                target[:n] = self._header[self._position: self._position + n]
+
+            # Read from the array's buffer
+            if self._target is not None and n < target.nbytes:
+                offset = self._position + n - header_size
+                count = max(0, min(target.nbytes - n, self._end - header_size - offset))
+                target[n: n + count] = self._target[offset: offset + count]
+                n += count
+
+        self._position += n
+        return n
+
+    def result(self):
+        if self._target is None or self._end != self._header_size + self._target.nbytes:
+            raise SaverError(f'Truncated .npy stream ({self._end} bytes)')
+        self._target.release()
+        return self._array
+
+    def _write_data(self, position: int, data: memoryview):
+        offset = position - self._header_size
+        if offset < 0:
+            raise SaverError('The header of a .npy stream can not be overwritten')
+
+        end = offset + data.nbytes
+        if end > self._target.nbytes:
+            raise SaverError('The stream is longer than the array it contains')
+        self._target[offset: end] = data
+
+    def _parse_header_size(self) -> tp.Optional[int]:
+        """ The total size of the header, once enough of it is received """
+        if len(self._header) < self.MAGIC_SIZE + 4:
+            return None
+
+        if self._header[:6] != b'\x93NUMPY':
+            raise SaverError('Not a .npy stream')
+
+        major = self._header[6]
+        if major == 1:
+            return self.MAGIC_SIZE + 2 + int.from_bytes(self._header[8:10], 'little')
+        return self.MAGIC_SIZE + 4 + int.from_bytes(self._header[8:12], 'little')
+
+    def _read_header(self, data: memoryview) -> int:
+        """ Consume the header bytes at the start of data. Returns the number of bytes consumed. """
+        import numpy as np
+        from numpy.lib import format
+
+        # The header is at least 64 bytes long, so its size is known after receiving its first 12 bytes
+        consumed = 0
+        if self._header_size is None:
+            consumed = min(self.MAGIC_SIZE + 4 - len(self._header), data.nbytes)
+            self._header += data[:consumed]
+            self._header_size = self._parse_header_size()
+            if self._header_size is None:
+                return consumed
+
+        count = min(self._header_size - len(self._header), data.nbytes - consumed)
+        self._header += data[consumed: consumed + count]
+        consumed += count
+        if len(self._header) < self._header_size:
+            return consumed
+
+        f = io.BytesIO(self._header)
+        version = format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = format.read_array_header_1_0(f)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = format.read_array_header_2_0(f)
+        else:
+            raise SaverError(f'Unsupported .npy version {version}')
+
+        if dtype.hasobject:
+            raise SaverError('Arrays of objects are not supported, use NumpySaver instead')
+
+        self._array = np.empty(shape, dtype=dtype, order='F' if fortran_order else 'C')
+        data_view = self._array.T if fortran_order else self._array
+        self._target = memoryview(data_view.reshape(-1).view(np.uint8))
+
+        for position, pending in self._pending:
+            self._write_data(position, memoryview(pending))
+        self._pending.clear()
+
+        return consumed
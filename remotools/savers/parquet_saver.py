@@ -0,0 +1,352 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import io
+import json
+import operator
+import typing as tp
+from remotools.savers.base import BaseSaver
+from remotools.exceptions import SaverError
+from remotools.instrumentation import instrument
+
+
+class ParquetSaver(BaseSaver):
+    """
+    Saves DataFrames (pandas or pyarrow tables) in the Parquet format.
+
+    Loading reads the object through remote.open(...), so only the footer and the column chunks needed
+    by the projection (columns) and by the row group filtering (filters) are downloaded, for remotes
+    supporting ranged downloads.
+
+    save_dataset(...) splits a large DataFrame into several Parquet objects (by the values of partition
+    columns and/or by number of rows), written concurrently, and load_dataset(...) skips the objects
+    whose partition values don't match the filters.
+
+    Attributes
+    ----------
+    compression
+        The Parquet compression codec ('snappy', 'zstd', 'gzip', None, etc.)
+
+    row_group_size
+        Maximal number of rows per row group, the unit of the filtering. None uses the pyarrow default.
+
+    block_size
+        Minimal number of bytes fetched per ranged download
+
+    to_pandas
+        Whether to load pandas DataFrames (otherwise pyarrow tables are returned)
+
+    max_workers
+        Number of threads writing or reading the objects of a dataset
+
+    Examples
+    --------
+    >> saver = ParquetSaver(S3Remote(bucket='tables'))
+    >> saver.save(df, 'events.parquet')
+    >> saver.load('events.parquet', columns=['user', 'time'], filters=[('time', '>=', start)])
+    >> saver.save_dataset(df, 'events', partition_cols=['day'], rows_per_object=10 ** 6)
+    >> saver.load_dataset('events', columns=['user'], filters=[('day', '=', '2020-01-01')])
+    """
+
+    def __init__(self, remote, compression: tp.Optional[str] = 'snappy', row_group_size: tp.Optional[int] = None,
+                 block_size: int = 2 ** 20, to_pandas: bool = True, max_workers: tp.Optional[int] = 8):
+        super(ParquetSaver, self).__init__(remote)
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.block_size = block_size
+        self.to_pandas = to_pandas
+        self.max_workers = max_workers
+
+    def encode(self, obj: tp.Any, f, key: tp.Optional[str] = None, **kwargs):
+        import pyarrow.parquet as pq
+
+        kwargs.setdefault('compression', self.compression)
+        kwargs.setdefault('row_group_size', self.row_group_size)
+        pq.write_table(_to_table(obj), f, **kwargs)
+
+    def decode(self, f, columns: tp.Optional[tp.List[str]] = None, filters=None, **kwargs):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(f, columns=columns, filters=filters, **kwargs)
+        return table.to_pandas() if self.to_pandas else table
+
+    def load(self, key: str, columns: tp.Optional[tp.List[str]] = None, filters=None, download_params=None,
+             progress=True, **kwargs) -> tp.Any:
+        """
+        Load a DataFrame.
+
+        Parameters
+        ----------
+        key
+            Remote key
+
+        columns
+            The columns to load. None loads all of them.
+
+        filters
+            Row filters, in the format of pyarrow.parquet.read_table(...): a list of (column, op, value)
+            tuples (combined with AND), or a list of such lists (combined with OR).
+
+        download_params
+            Parameters passed to the remote's download_range method
+
+        progress
+            Ignored, the object is read in parts
+        """
+        with instrument(self.__class__.__name__, 'load'), \
+                self.remote.open(key, block_size=self.block_size, params=download_params) as f:
+            return self.decode(f, columns=columns, filters=filters, **kwargs)
+
+    def save_dataset(self, obj: tp.Any, key: str, partition_cols: tp.Optional[tp.List[str]] = None,
+                     rows_per_object: tp.Optional[int] = None, upload_params=None, progress=True, **kwargs) -> str:
+        """
+        Save a DataFrame as several Parquet objects.
+
+        The objects are stored next to the key, which holds a JSON manifest listing them.
+
+        Parameters
+        ----------
+        obj
+            A pandas DataFrame or a pyarrow table
+
+        key
+            Remote key of the manifest
+
+        partition_cols
+            The rows of each combination of values of these columns are saved in separate objects.
+            The columns are kept in the objects.
+
+        rows_per_object
+            Maximal number of rows per object. None means a single object per partition.
+
+        upload_params
+            Parameters passed to the remote's upload method
+
+        progress
+            Show a progress bar for the manifest upload
+
+        kwargs
+            Passed to pyarrow.parquet.write_table(...)
+
+        Returns
+        -------
+            Remote key of the manifest
+        """
+        table = _to_table(obj)
+        partition_cols = list(partition_cols or [])
+
+        parts = []
+        for values, part in _partitions(table, partition_cols):
+            step = rows_per_object or max(1, part.num_rows)
+            for offset in range(0, max(1, part.num_rows), step):
+                directory = '/'.join(f'{c}={v}' for c, v in zip(partition_cols, values))
+                parts.append((dict(zip(partition_cols, values)),
+                              f'{key}.parts/{directory + "/" if directory else ""}{len(parts):05d}.parquet',
+                              part.slice(offset, step)))
+
+        with instrument(self.__class__.__name__, 'save'), ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self._save_part, part, part_key, upload_params, **kwargs)
+                       for _, part_key, part in parts]
+
+            manifest = dict(schema=base64.b64encode(table.schema.serialize()).decode('ascii'),
+                            partition_cols=partition_cols,
+                            parts=[dict(key=future.result(), rows=part.num_rows, partition=partition)
+                                   for (partition, _, part), future in zip(parts, futures)])
+
+            f = io.BytesIO(json.dumps(manifest, default=str).encode('utf-8'))
+            return self.remote.upload(f, key, params=upload_params, progress=progress)
+
+    def load_dataset(self, key: str, columns: tp.Optional[tp.List[str]] = None, filters=None, download_params=None,
+                     progress=True, **kwargs) -> tp.Any:
+        """
+        Load a DataFrame saved by save_dataset(...). The arguments are the same as in load(...).
+
+        The objects whose partition values can't match the filters are not read, and the others are read
+        concurrently.
+        """
+        import pyarrow as pa
+
+        with instrument(self.__class__.__name__, 'load'):
+            f = io.BytesIO()
+            self.remote.download(f, key, params=download_params, progress=progress, keep_stream_position=True)
+            manifest = json.load(io.TextIOWrapper(f, encoding='utf-8'))
+
+            parts = [part for part in manifest['parts'] if _may_match(part['partition'], filters)]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = [pool.submit(self._load_part, part['key'], columns, filters, download_params, **kwargs)
+                           for part in parts]
+                tables = [future.result() for future in futures]
+
+            if not tables:
+                schema = pa.ipc.read_schema(pa.py_buffer(base64.b64decode(manifest['schema'])))
+                table = schema.empty_table()
+                tables = [table.select(columns) if columns is not None else table]
+
+            table = pa.concat_tables(tables)
+            return table.to_pandas() if self.to_pandas else table
+
+    def _save_part(self, table, key: str, upload_params, **kwargs) -> str:
+        f = io.BytesIO()
+        self.encode(table, f, **kwargs)
+        f.seek(0)
+        return self.remote.upload(f, key, params=upload_params, progress=False)
+
+    def _load_part(self, key: str, columns, filters, download_params, **kwargs):
+        import pyarrow.parquet as pq
+
+        with self.remote.open(key, block_size=self.block_size, params=download_params) as f:
+            return pq.read_table(f, columns=columns, filters=filters, **kwargs)
+
+
+class ArrowSaver(BaseSaver):
+    """
+    Saves DataFrames (pandas or pyarrow tables) in the Arrow IPC file format (a.k.a. Feather V2).
+
+    Decoding Arrow data is mostly zero-copy, so it is faster to load than Parquet, at the cost of larger
+    objects. Loading reads the object through remote.open(...), so only the footer and the buffers of the
+    projected columns are downloaded. The format has no statistics, so the filters are applied after
+    reading.
+
+    Attributes
+    ----------
+    compression
+        The buffer compression codec ('lz4', 'zstd' or None)
+
+    batch_size
+        Maximal number of rows per record batch. None writes the table's batches as is.
+
+    block_size
+        Minimal number of bytes fetched per ranged download
+
+    to_pandas
+        Whether to load pandas DataFrames (otherwise pyarrow tables are returned)
+    """
+
+    def __init__(self, remote, compression: tp.Optional[str] = None, batch_size: tp.Optional[int] = None,
+                 block_size: int = 2 ** 20, to_pandas: bool = True):
+        super(ArrowSaver, self).__init__(remote)
+        self.compression = compression
+        self.batch_size = batch_size
+        self.block_size = block_size
+        self.to_pandas = to_pandas
+
+    def encode(self, obj: tp.Any, f, key: tp.Optional[str] = None, **kwargs):
+        import pyarrow as pa
+
+        table = _to_table(obj)
+        options = pa.ipc.IpcWriteOptions(compression=self.compression)
+        with pa.ipc.new_file(f, table.schema, options=options) as writer:
+            writer.write_table(table, max_chunksize=self.batch_size)
+
+    def decode(self, f, columns: tp.Optional[tp.List[str]] = None, filters=None, **kwargs):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        included_fields = None
+        if columns is not None:
+            # The filtered columns are read as well, and dropped after filtering
+            schema = pa.ipc.open_file(f).schema
+            names = list(columns) + [c for c in _filter_columns(filters) if c not in columns]
+            missing = [c for c in names if schema.get_field_index(c) < 0]
+            if missing:
+                raise SaverError(f'No such columns: {missing}')
+            included_fields = sorted(schema.get_field_index(c) for c in names)
+
+        table = pa.ipc.open_file(f, options=pa.ipc.IpcReadOptions(included_fields=included_fields)).read_all()
+        if filters:
+            table = table.filter(pq.filters_to_expression(filters))
+        if columns is not None:
+            table = table.select(columns)
+
+        return table.to_pandas() if self.to_pandas else table
+
+    def load(self, key: str, columns: tp.Optional[tp.List[str]] = None, filters=None, download_params=None,
+             progress=True, **kwargs) -> tp.Any:
+        """ Load a DataFrame. The arguments are the same as in ParquetSaver.load(...) """
+        with instrument(self.__class__.__name__, 'load'), \
+                self.remote.open(key, block_size=self.block_size, params=download_params) as f:
+            return self.decode(f, columns=columns, filters=filters, **kwargs)
+
+
+def _to_table(obj):
+    import pyarrow as pa
+
+    if isinstance(obj, pa.Table):
+        return obj
+
+    try:
+        import pandas as pd
+    except ImportError:
+        pd = None
+
+    if pd is not None and isinstance(obj, pd.DataFrame):
+        return pa.Table.from_pandas(obj)
+
+    raise SaverError(f'Expected a pandas DataFrame or a pyarrow Table (got {type(obj).__name__})')
+
+
+def _partitions(table, partition_cols: tp.List[str]) -> tp.Iterator[tp.Tuple[tuple, tp.Any]]:
+    """ The combinations of values of the partition columns and the corresponding rows """
+    import pyarrow as pa
+
+    if not partition_cols:
+        yield (), table
+        return
+
+    rows = '__remotools_rows'
+    groups = table.select(partition_cols).append_column(rows, pa.array(range(table.num_rows), pa.int64())) \
+        .group_by(partition_cols, use_threads=False).aggregate([(rows, 'list')])
+
+    for group in groups.to_pylist():
+        yield tuple(group[c] for c in partition_cols), table.take(group[f'{rows}_list'])
+
+
+_OPERATORS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+    'in': lambda x, values: x in values,
+    'not in': lambda x, values: x not in values,
+}
+
+
+def _conjunctions(filters) -> tp.List[tp.List[tuple]]:
+    """ Filters in disjunctive normal form (a list of lists of predicates) """
+    if not filters:
+        return []
+    return filters if isinstance(filters[0], list) else [filters]
+
+
+def _filter_columns(filters) -> tp.List[str]:
+    return [column for conjunction in _conjunctions(filters) for column, _, _ in conjunction]
+
+
+def _may_match(partition: dict, filters) -> bool:
+    """ Whether rows of the given partition may satisfy the filters (predicates on other columns are ignored) """
+    conjunctions = _conjunctions(filters)
+    if not conjunctions:
+        return True
+
+    def holds(column, op, value):
+        if column not in partition or op not in _OPERATORS:
+            return True
+        try:
+            return _OPERATORS[op](partition[column], _json_value(value))
+        except TypeError:
+            return True
+
+    return any(all(holds(*predicate) for predicate in conjunction) for conjunction in conjunctions)
+
+
+def _json_value(value):
+    """ A filter value as stored in the manifest (values that are not JSON types are stored as strings) """
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_json_value(v) for v in value]
+    if hasattr(value, 'item') and not isinstance(value, (str, bytes)):
+        # numpy scalars
+        value = value.item()
+    return json.loads(json.dumps(value, default=str))
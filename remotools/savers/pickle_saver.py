@@ -1,23 +1,262 @@
 import io
 import pickle
+import struct
+from shutil import copyfileobj
 from remotools.savers.base import BaseSaver
-from remotools.utils import keep_position
+from remotools.exceptions import SaverError
+from remotools.remotes.exceptions import KeyNotFoundError
+from remotools.utils import ConcatReader
+from remotools.instrumentation import instrument
 import typing as tp
 
+# The layout of objects saved with out-of-band buffers: the magic, the header, the section table (one entry
+# per buffer), the pickle stream and the buffers, each aligned to ALIGNMENT bytes
+MAGIC = b'\x93RTPKL\x05\x00'
+HEADER = struct.Struct('<QQQ')      # Offset and size of the pickle stream, number of buffers
+SECTION = struct.Struct('<QQ')      # Offset and size of a buffer
+ALIGNMENT = 64
+
 
 class PickleSaver(BaseSaver):
+    """
+    Saves objects with pickle.
+
+    With out_of_band=True, objects are pickled with protocol 5 and the large buffers they expose (e.g.
+    numpy arrays and bytearrays) are stored out-of-band, as aligned sections following the pickle stream.
+    The sections are uploaded straight from the objects' memory, and downloaded straight into the buffers
+    of the loaded objects (or memory-mapped, see mmap), so no intermediate copies are made.
+
+    Both formats are loaded regardless of out_of_band.
+
+    Attributes
+    ----------
+    out_of_band
+        Save the large buffers out-of-band
+
+    min_buffer_size
+        Buffers smaller than this are kept in the pickle stream
+
+    mmap
+        Memory-map the out-of-band objects stored by a LocalRemote (the loaded buffers are copy-on-write). The
+        key must not be saved again while the loaded objects are in use: the file is rewritten in place, and
+        accessing the mapped buffers of a truncated file kills the process (SIGBUS).
+
+    Examples
+    --------
+    >> saver = PickleSaver(S3Remote(bucket='objects'), out_of_band=True)
+    >> saver.save({'features': np.zeros((10 ** 6, 128)), 'ids': ids}, 'batch-1')
+    """
+
+    def __init__(self, remote, out_of_band: bool = False, min_buffer_size: int = 2 ** 16, mmap: bool = False):
+        super(PickleSaver, self).__init__(remote)
+        self.out_of_band = out_of_band
+        self.min_buffer_size = min_buffer_size
+        self.mmap = mmap
 
     def save(self, obj: tp.Any, key: str, upload_params=None, progress=True, **kwargs) -> str:
+        if not self.out_of_band:
+            return super(PickleSaver, self).save(obj, key, upload_params=upload_params, progress=progress, **kwargs)
+
+        with instrument(self.__class__.__name__, 'save'), self._sections(obj, **kwargs) as f:
+            return self.remote.upload(f, key, params=upload_params, progress=progress)
+
+    def load(self, key: str, download_params=None, progress=True, **kwargs) -> tp.Any:
+        from remotools.remotes.local import LocalRemote
+
+        with instrument(self.__class__.__name__, 'load'):
+            if self.mmap and isinstance(self.remote, LocalRemote) and _has_sections(self.remote._full_path(key)):
+                try:
+                    return _load_mapped(self.remote._full_path(key), **kwargs)
+                except FileNotFoundError as e:
+                    raise KeyNotFoundError(key) from e
 
-        f = io.BytesIO()
-        with keep_position(f):
+            f = _SectionWriter()
+            self.remote.download(f, key, params=download_params, progress=progress)
+            return f.result(**kwargs)
+
+    def encode(self, obj: tp.Any, f, key: tp.Optional[str] = None, **kwargs):
+        if not self.out_of_band:
             pickle.dump(obj, f, **kwargs)
+            return
+
+        with self._sections(obj, **kwargs) as reader:
+            copyfileobj(reader, f)
+
+    def decode(self, f, **kwargs):
+        writer = _SectionWriter()
+        copyfileobj(f, writer)
+        return writer.result(**kwargs)
+
+    def _sections(self, obj: tp.Any, **kwargs) -> ConcatReader:
+        """ A stream of the object pickled with out-of-band buffers """
+        kwargs.pop('protocol', None)
+        buffers = []
+
+        def buffer_callback(buffer: pickle.PickleBuffer) -> bool:
+            # Returning True keeps the buffer in the pickle stream
+            try:
+                raw = buffer.raw()
+            except BufferError:
+                # Not contiguous
+                return True
+
+            if raw.nbytes < self.min_buffer_size:
+                return True
+            buffers.append(raw)
+            return False
+
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffer_callback, **kwargs)
+
+        # Lay out the sections
+        offset = len(MAGIC) + HEADER.size + SECTION.size * len(buffers)
+        pickle_offset = offset
+        offset += len(data)
+
+        table, parts = [], []
+        for raw in buffers:
+            padding = -offset % ALIGNMENT
+            parts += [bytes(padding), raw]
+            table.append((offset + padding, raw.nbytes))
+            offset += padding + raw.nbytes
+
+        header = MAGIC + HEADER.pack(pickle_offset, len(data), len(buffers)) + \
+            b''.join(SECTION.pack(*entry) for entry in table)
+        return ConcatReader([header, data] + parts)
+
+
+class _SectionWriter(io.RawIOBase):
+    """
+    A stream receiving a pickled object, either a plain pickle stream or the layout of out-of-band buffers.
+    In the latter case the sections are allocated once the header is received, and the data is written
+    directly into them.
+
+    The stream must be written sequentially, and is neither readable nor seekable (so that HFSRemote hashes
+    the received bytes as they are written).
+    """
+
+    def __init__(self):
+        super(_SectionWriter, self).__init__()
+        self._head: tp.Optional[bytearray] = bytearray()
+        self._plain: tp.Optional[io.BytesIO] = None
+        self._pickle: tp.Optional[bytearray] = None
+        self._buffers: tp.List[bytearray] = []
+        self._sections: tp.Optional[tp.List[tp.Tuple[int, memoryview]]] = None
+        self._index = 0
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def write(self, b):
+        with memoryview(b) as view, view.cast('B') as data:
+            n = data.nbytes
+            consumed = 0
+            if self._plain is None and self._sections is None:
+                consumed = self._read_head(data)
+
+            if consumed < n:
+                if self._plain is not None:
+                    self._plain.write(data[consumed:])
+                else:
+                    self._dispatch(self._position + consumed, data[consumed:])
+
+        self._position += n
+        return n
+
+    def result(self, **kwargs) -> tp.Any:
+        if self._plain is not None:
+            self._plain.seek(0)
+            return pickle.load(self._plain, **kwargs)
+
+        if self._sections is None and self._head is not None and not MAGIC.startswith(bytes(self._head)):
+            # A plain pickle stream shorter than the magic
+            return pickle.loads(bytes(self._head), **kwargs)
+
+        if self._sections is None or self._index < len(self._sections):
+            raise SaverError(f'Truncated pickle stream ({self._position} bytes)')
+
+        for _, view in self._sections:
+            view.release()
+        return pickle.loads(self._pickle, buffers=self._buffers, **kwargs)
+
+    def _read_head(self, data: memoryview) -> int:
+        """ Consume the header bytes at the start of data. Returns the number of bytes consumed. """
+        fixed = len(MAGIC) + HEADER.size
+        consumed = 0
+        while self._sections is None and self._plain is None:
+            if not MAGIC.startswith(bytes(self._head[:len(MAGIC)])):
+                # Not (the start of) the magic: a plain pickle stream
+                self._plain = io.BytesIO()
+                self._plain.write(self._head)
+                self._head = None
+                break
+            elif len(self._head) < len(MAGIC):
+                size = len(MAGIC)
+            elif len(self._head) < fixed:
+                size = fixed
+            else:
+                pickle_offset, pickle_size, count = HEADER.unpack_from(self._head, len(MAGIC))
+                size = fixed + SECTION.size * count
+                if len(self._head) == size:
+                    self._allocate(pickle_offset, pickle_size, count)
+                    break
+
+            count = min(size - len(self._head), data.nbytes - consumed)
+            if count == 0:
+                break
+            self._head += data[consumed: consumed + count]
+            consumed += count
+
+        return consumed
+
+    def _allocate(self, pickle_offset: int, pickle_size: int, count: int):
+        fixed = len(MAGIC) + HEADER.size
+        table = [SECTION.unpack_from(self._head, fixed + SECTION.size * i) for i in range(count)]
+        self._pickle = bytearray(pickle_size)
+        self._buffers = [bytearray(size) for _, size in table]
+        self._sections = sorted([(pickle_offset, memoryview(self._pickle))] +
+                                [(offset, memoryview(buffer)) for (offset, _), buffer in zip(table, self._buffers)],
+                                key=lambda section: section[0])
+        self._head = None
+
+    def _dispatch(self, position: int, data: memoryview):
+        """ Copy the bytes received at the given position to the sections they belong to """
+        end = position + data.nbytes
+        while self._index < len(self._sections):
+            offset, target = self._sections[self._index]
+            if offset >= end and target.nbytes:
+                break
+
+            begin, stop = max(position, offset), min(end, offset + target.nbytes)
+            if begin < stop:
+                target[begin - offset: stop - offset] = data[begin - position: stop - position]
+
+            if offset + target.nbytes > end:
+                break
+            self._index += 1
+
+
+def _has_sections(path: str) -> bool:
+    """ Whether the file at path holds an object pickled with out-of-band buffers """
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except FileNotFoundError:
+        return False
 
-        return self.remote.upload(f, key, progress=progress, params=upload_params)
 
-    def load(self, key: str, download_params=None, progress=True, **kwargs):
+def _load_mapped(path: str, **kwargs) -> tp.Any:
+    import mmap
 
-        f = io.BytesIO()
-        self.remote.download(f, key, progress=progress, keep_stream_position=True, params=download_params)
+    with open(path, 'rb') as f:
+        # Copy-on-write, so that the loaded buffers are writable without modifying the file
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
 
-        return pickle.load(f, **kwargs)
+    pickle_offset, pickle_size, count = HEADER.unpack_from(view, len(MAGIC))
+    fixed = len(MAGIC) + HEADER.size
+    buffers = [view[offset: offset + size]
+               for offset, size in (SECTION.unpack_from(view, fixed + SECTION.size * i) for i in range(count))]
+    return pickle.loads(view[pickle_offset: pickle_offset + pickle_size], buffers=buffers, **kwargs)
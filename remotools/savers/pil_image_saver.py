@@ -1,10 +1,42 @@
 import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from os import path as osp
 from remotools.savers.base import BaseSaver
-from remotools.utils import keep_position
+from remotools.exceptions import SaverError
+from remotools.instrumentation import instrument
+import typing as tp
 
 
 class PILImageSaver(BaseSaver):
+    """
+    Saves images given as numpy arrays, in any format supported by PIL.
+
+    Images can be loaded at a reduced size (see decode(...)): JPEG images are then decoded directly at
+    a fraction of their resolution (PIL's draft mode), and other formats are reduced by an integer factor
+    before being resampled. load_many(...) loads a batch of images concurrently (PIL releases the GIL while
+    decoding), optionally into a preallocated array.
+
+    Attributes
+    ----------
+    max_workers
+        Number of threads downloading and decoding the images in load_many(...)
+
+    header_bytes
+        Number of bytes fetched at a time by shape(...), which reads only the header of the image (for remotes
+        supporting ranged downloads)
+
+    Examples
+    --------
+    >> saver = PILImageSaver(S3Remote(bucket='images'), max_workers=16)
+    >> saver.shape('cats/1.jpg')                                    # (height, width)
+    >> batch = saver.load_many(keys, size=(224, 224), mode='RGB')   # A (len(keys), 224, 224, 3) array
+    """
+
+    def __init__(self, remote, max_workers: tp.Optional[int] = 8, header_bytes: int = 2 ** 16):
+        super(PILImageSaver, self).__init__(remote)
+        self.max_workers = max_workers
+        self.header_bytes = header_bytes
 
     def save(self, obj, key: str, ext=None, upload_params=None, progress=True, **kwargs) -> str:
         """
@@ -35,6 +67,10 @@ class PILImageSaver(BaseSaver):
             Remote key used to save the image
 
         """
+        return super(PILImageSaver, self).save(obj=obj, key=key, ext=ext, upload_params=upload_params or {},
+                                               progress=progress, **kwargs)
+
+    def encode(self, obj, f, key: tp.Optional[str] = None, ext=None, **kwargs):
 
         Image = self._import_pil_image()
 
@@ -46,31 +82,131 @@ class PILImageSaver(BaseSaver):
         if not ext:
             ext = ext or '.jpg'
 
-        f = io.BytesIO()
-        with keep_position(f):
-            Image.fromarray(obj).save(f, format=Image.EXTENSION[ext], **kwargs)
+        Image.fromarray(obj).save(f, format=Image.EXTENSION[ext], **kwargs)
+
+    def decode(self, f, size: tp.Optional[tp.Tuple[int, int]] = None, mode: tp.Optional[str] = None,
+               resample=None, reducing_gap: tp.Optional[float] = 2.0, **kwargs):
+        """
+        Decode an image into a numpy array.
+
+        Parameters
+        ----------
+        f
+            A binary stream
+
+        size
+            Resize the image to (height, width). JPEG images are decoded at the smallest scale (1/2, 1/4 or 1/8)
+            that isn't below the target size, which is much faster than decoding the full image.
+
+        mode
+            Convert the image to the given PIL mode (e.g. 'RGB' or 'L')
 
-        return self.remote.upload(f, key, progress=progress, params=upload_params or {})
+        resample
+            The PIL resampling filter used to resize the image. Defaults to bilinear.
 
-    def load(self, key: str, download_params=None, progress=True, **kwargs):
+        reducing_gap
+            Passed to PIL.Image.resize(...): the image is first reduced by an integer factor, as long as it
+            stays reducing_gap times larger than the target size. None disables the reduction.
 
+        kwargs
+            Extra arguments passed to PIL.Image.open(...)
+        """
         Image = self._import_pil_image()
         import numpy as np
 
-        f = io.BytesIO()
-        self.remote.download(f, key, params=download_params, progress=progress, keep_stream_position=True)
+        image = Image.open(f, **kwargs)
+        if size is not None:
+            height, width = size
+            image.draft(mode, (width, height))
+            if image.size != (width, height):
+                resample = getattr(Image, 'Resampling', Image).BILINEAR if resample is None else resample
+                image = image.resize((width, height), resample=resample, reducing_gap=reducing_gap)
 
-        return np.asarray(Image.open(f, **kwargs))
+        if mode is not None and image.mode != mode:
+            image = image.convert(mode)
 
-    def shape(self, key, download_params=None, progress=True, **kwargs):
-        Image = self._import_pil_image()
+        return np.asarray(image)
 
-        f = io.BytesIO()
-        self.remote.download(f, key, params=download_params, progress=progress, keep_stream_position=True)
+    def load_many(self, keys: tp.Sequence[str], size: tp.Optional[tp.Tuple[int, int]] = None, out=None,
+                  download_params=None, **kwargs):
+        """
+        Load a batch of images concurrently.
 
-        # Use PIL's lazy loading to get only the image parameters
-        image = Image.open(f, **kwargs)
-        width, height = image.size
+        Parameters
+        ----------
+        keys
+            Remote keys of the images
+
+        size
+            Resize the images to (height, width) (see decode(...))
+
+        out
+            A preallocated array of shape (len(keys), height, width[, channels]) receiving the images.
+            The images are resized to its height and width.
+
+        download_params
+            Parameters passed to the remote's download method
+
+        kwargs
+            Extra arguments passed to decode(...), e.g. mode
+
+        Returns
+        -------
+            A list of arrays, or a single array of shape (len(keys), height, width[, channels]) when size or out
+            is given
+        """
+        import numpy as np
+
+        keys = list(keys)
+        if out is not None:
+            if len(out) != len(keys):
+                raise ValueError(f'out holds {len(out)} images, but {len(keys)} keys are given')
+            size = tuple(out.shape[1:3])
+
+        results = [None] * len(keys)
+        lock = threading.Lock()
+
+        def load(i: int):
+            nonlocal out
+            f = io.BytesIO()
+            self.remote.download(f, keys[i], params=download_params, progress=False, keep_stream_position=True)
+            image = self.decode(f, size=size, **kwargs)
+
+            if size is None:
+                results[i] = image
+                return
+
+            # The batch is allocated once the number of channels and the type of the images are known
+            if out is None:
+                with lock:
+                    if out is None:
+                        out = np.empty((len(keys),) + image.shape, dtype=image.dtype)
+
+            if image.shape[2:] != out.shape[3:] or image.ndim != out.ndim - 1:
+                raise SaverError(f'Image {keys[i]} of shape {image.shape} does not fit into a batch of shape '
+                                 f'{out.shape} (use mode to convert the images to the same mode)')
+            out[i] = image
+
+        with instrument(self.__class__.__name__, 'load_many'), \
+                ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for future in [pool.submit(load, i) for i in range(len(keys))]:
+                future.result()
+
+        if size is None:
+            return results
+        if out is None:
+            # No keys
+            out = np.empty((0,) + tuple(size), dtype=np.uint8)
+        return out
+
+    def shape(self, key, download_params=None, **kwargs):
+        """ The (height, width) of an image, reading only its header when the remote supports ranged downloads """
+        Image = self._import_pil_image()
+
+        with self.remote.open(key, block_size=self.header_bytes, params=download_params) as f:
+            # Use PIL's lazy loading to get only the image parameters
+            image = Image.open(f, **kwargs)
+            width, height = image.size
         return height, width
 
     def _import_pil_image(self):
@@ -85,16 +221,12 @@ class PILImageSaver(BaseSaver):
 class PILImageSaverPNG(PILImageSaver):
     """  Saves images in the PNG format """
 
-    def save(self, obj, key: str, ext=None, upload_params=None, progress=True, **kwargs) -> str:
-        return super(PILImageSaverPNG, self).save(obj=obj, key=key, ext='.png',
-                                                  upload_params=upload_params,
-                                                  progress=progress, **kwargs)
+    def encode(self, obj, f, key: tp.Optional[str] = None, ext=None, **kwargs):
+        return super(PILImageSaverPNG, self).encode(obj=obj, f=f, key=key, ext='.png', **kwargs)
 
 
 class PILImageSaverJPG(PILImageSaver):
     """  Saves images in the JPG format """
 
-    def save(self, obj, key: str, ext=None, upload_params=None, progress=True, **kwargs) -> str:
-        return super(PILImageSaverJPG, self).save(obj=obj, key=key, ext='.jpg',
-                                                  upload_params=upload_params,
-                                                  progress=progress, **kwargs)
+    def encode(self, obj, f, key: tp.Optional[str] = None, ext=None, **kwargs):
+        return super(PILImageSaverJPG, self).encode(obj=obj, f=f, key=key, ext='.jpg', **kwargs)
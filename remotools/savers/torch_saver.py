@@ -1,21 +1,324 @@
+from __future__ import annotations
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 import io
 import json
-from remotools.savers.base import BaseSaver
-from remotools.utils import keep_position
+import struct
+import threading
 import typing as tp
+from remotools.savers.base import BaseSaver
+from remotools.exceptions import SaverError
+from remotools.remotes.exceptions import KeyNotFoundError
+from remotools.utils import BufferWriter, ConcatReader
+from remotools.instrumentation import instrument
+
+# The dtypes of the safetensors format, by the names of the corresponding torch (and numpy) dtypes
+DTYPES = {
+    'float64': 'F64', 'float32': 'F32', 'float16': 'F16', 'bfloat16': 'BF16',
+    'int64': 'I64', 'int32': 'I32', 'int16': 'I16', 'int8': 'I8',
+    'uint64': 'U64', 'uint32': 'U32', 'uint16': 'U16', 'uint8': 'U8', 'bool': 'BOOL',
+    'float8_e4m3fn': 'F8_E4M3', 'float8_e5m2': 'F8_E5M2',
+}
+DTYPE_NAMES = {code: name for name, code in DTYPES.items()}
+ITEM_SIZES = {'F64': 8, 'F32': 4, 'F16': 2, 'BF16': 2, 'I64': 8, 'I32': 4, 'I16': 2, 'I8': 1,
+              'U64': 8, 'U32': 4, 'U16': 2, 'U8': 1, 'BOOL': 1, 'F8_E4M3': 1, 'F8_E5M2': 1}
+
+# The header size prefix of a safetensors file
+HEADER_SIZE = struct.Struct('<Q')
 
 
 class TorchSaver(BaseSaver):
+    """
+    Saves PyTorch objects, either with torch.save(...) or as sharded checkpoints.
+
+    A sharded checkpoint (see save_sharded(...)) stores a state dict (a flat mapping of names to tensors) in
+    several objects in the safetensors format, written concurrently and without copying the tensors. The key
+    of the checkpoint holds a JSON index mapping each tensor to its shard, in the layout used by the
+    Hugging Face libraries ({'metadata': ..., 'weight_map': ...}).
+
+    load_sharded(...) returns a ShardedStateDict, which reads each tensor on first access with a ranged
+    download (or memory-maps the shards of a LocalRemote, see mmap). NumPy arrays are supported as well.
+
+    Attributes
+    ----------
+    shard_bytes
+        Maximal size of a shard (a single tensor larger than that gets a shard of its own)
+
+    max_workers
+        Number of threads writing or reading the shards
+
+    mmap
+        Memory-map the objects stored by a LocalRemote instead of reading them. The key must not be saved again
+        while the loaded tensors are in use: the file is rewritten in place, and accessing a mapped tensor of a
+        truncated file kills the process (SIGBUS).
 
-    def save(self, obj: tp.Any, key: str, upload_params=None, progress=True, **kwargs):
+    Examples
+    --------
+    >> saver = TorchSaver(S3Remote(bucket='checkpoints'), shard_bytes=2 ** 30)
+    >> saver.save_sharded(model.state_dict(), 'run-1/step-1000')
+    >> state = saver.load_sharded('run-1/step-1000')
+    >> state['encoder.embedding.weight']        # Downloads a single tensor
+    >> model.load_state_dict(state.to_dict())   # Downloads the rest concurrently
+    """
+
+    def __init__(self, remote, shard_bytes: int = 2 ** 31, max_workers: tp.Optional[int] = 8, mmap: bool = False):
+        super(TorchSaver, self).__init__(remote)
+        self.shard_bytes = shard_bytes
+        self.max_workers = max_workers
+        self.mmap = mmap
+
+    def load(self, key: str, download_params=None, progress=True, **kwargs) -> tp.Any:
+        from remotools.remotes.local import LocalRemote
+
+        if self.mmap and isinstance(self.remote, LocalRemote):
+            import torch
+
+            with instrument(self.__class__.__name__, 'load'):
+                try:
+                    return torch.load(self.remote._full_path(key), mmap=True, **kwargs)
+                except FileNotFoundError as e:
+                    raise KeyNotFoundError(key) from e
+
+        return super(TorchSaver, self).load(key, download_params=download_params, progress=progress, **kwargs)
+
+    def encode(self, obj: tp.Any, f, key: tp.Optional[str] = None, **kwargs):
         import torch
-        f = io.BytesIO()
-        with keep_position(f):
-            torch.save(obj, f, **kwargs)
-        return self.remote.upload(f, key, params=upload_params, progress=progress)
+        torch.save(obj, f, **kwargs)
 
-    def load(self, key: str, download_params=None, progress=True, **kwargs):
+    def decode(self, f, **kwargs):
         import torch
+        return torch.load(f, **kwargs)
+
+    def save_sharded(self, obj: tp.Mapping[str, tp.Any], key: str, metadata: tp.Optional[tp.Dict[str, str]] = None,
+                     upload_params=None, progress=True) -> str:
+        """
+        Save a state dict as a sharded checkpoint.
+
+        Parameters
+        ----------
+        obj
+            A mapping of names to tensors (torch tensors or numpy arrays, not mixed)
+
+        key
+            Remote key of the index. The shards are stored next to it.
+
+        metadata
+            String to string metadata, stored in the index and in the header of every shard
+
+        upload_params
+            Parameters passed to the remote's upload method
+
+        progress
+            Show a progress bar for the index upload
+
+        Returns
+        -------
+            Remote key of the index
+        """
+        tensors = {name: _tensor_bytes(value) for name, value in obj.items()}
+        formats = {fmt for fmt, _, _, _ in tensors.values()}
+        if len(formats) > 1:
+            raise SaverError('Torch tensors and numpy arrays can not be mixed in a checkpoint')
+        metadata = dict(metadata or {}, format=formats.pop() if formats else 'pt')
+
+        # Fill the shards in order
+        shards, size = [[]], 0
+        for name, (_, _, _, data) in tensors.items():
+            if shards[-1] and size + data.nbytes > self.shard_bytes:
+                shards.append([])
+                size = 0
+            shards[-1].append(name)
+            size += data.nbytes
+
+        with instrument(self.__class__.__name__, 'save'), ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self._save_shard, {name: tensors[name] for name in names}, metadata,
+                                   f'{key}.shards/{i + 1:05d}-of-{len(shards):05d}.safetensors', upload_params)
+                       for i, names in enumerate(shards)]
+
+            weight_map = {}
+            for names, future in zip(shards, futures):
+                shard_key = future.result()
+                weight_map.update((name, shard_key) for name in names)
+
+            index = dict(metadata=dict(metadata, total_size=sum(t[3].nbytes for t in tensors.values())),
+                         weight_map=weight_map)
+            f = io.BytesIO(json.dumps(index).encode('utf-8'))
+            return self.remote.upload(f, key, params=upload_params, progress=progress)
+
+    def load_sharded(self, key: str, lazy: bool = True, download_params=None, progress=True) -> tp.Mapping[str, tp.Any]:
+        """
+        Load a sharded checkpoint.
+
+        Parameters
+        ----------
+        key
+            Remote key of the index
+
+        lazy
+            Return a ShardedStateDict reading the tensors on access. Otherwise, all the tensors are read
+            concurrently and a dict is returned.
+
+        download_params
+            Parameters passed to the remote's download methods
+
+        progress
+            Show a progress bar for the index download
+        """
         f = io.BytesIO()
         self.remote.download(f, key, params=download_params, progress=progress, keep_stream_position=True)
-        return torch.load(f, **kwargs)
+        index = json.load(io.TextIOWrapper(f, encoding='utf-8'))
+
+        state = ShardedStateDict(self, index, download_params=download_params)
+        return state if lazy else state.to_dict()
+
+    def _save_shard(self, tensors: tp.Dict[str, tuple], metadata: tp.Dict[str, str], key: str,
+                    upload_params) -> str:
+        # Larger items first, so that every tensor is aligned to its item size
+        names = sorted(tensors, key=lambda name: -ITEM_SIZES[DTYPES[tensors[name][1]]])
+
+        header, offset = {'__metadata__': metadata}, 0
+        for name in names:
+            _, dtype, shape, data = tensors[name]
+            header[name] = dict(dtype=DTYPES[dtype], shape=shape, data_offsets=[offset, offset + data.nbytes])
+            offset += data.nbytes
+
+        # The data starts at a multiple of 8 bytes (the header is padded with spaces)
+        encoded = json.dumps(header).encode('utf-8')
+        encoded += b' ' * (-(HEADER_SIZE.size + len(encoded)) % 8)
+
+        with ConcatReader([HEADER_SIZE.pack(len(encoded)), encoded] + [tensors[name][3] for name in names]) as f:
+            return self.remote.upload(f, key, params=upload_params, progress=False)
+
+
+class ShardedStateDict(Mapping):
+    """
+    A read-only mapping of the tensors of a sharded checkpoint, reading each tensor on first access.
+
+    The header of a shard is read once, on the first access to one of its tensors. Tensors stored by
+    a LocalRemote are memory-mapped when the saver's mmap is True. to_dict() reads all the remaining
+    tensors concurrently.
+    """
+
+    def __init__(self, saver: TorchSaver, index: dict, download_params=None):
+        self.saver = saver
+        self.weight_map: tp.Dict[str, str] = index['weight_map']
+        self.metadata: tp.Dict[str, tp.Any] = index.get('metadata', {})
+        self.download_params = download_params
+        self._tensors = {}
+        self._headers: tp.Dict[str, tp.Tuple[dict, int]] = {}
+        self._mmaps = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str):
+        if name not in self._tensors:
+            if name not in self.weight_map:
+                raise KeyError(name)
+            tensor = self._load(name)
+            with self._lock:
+                self._tensors.setdefault(name, tensor)
+        return self._tensors[name]
+
+    def __iter__(self):
+        return iter(self.weight_map)
+
+    def __len__(self):
+        return len(self.weight_map)
+
+    def shape(self, name: str) -> tp.Tuple[int, ...]:
+        """ The shape of a tensor (reads only the header of its shard) """
+        header, _ = self._header(self.weight_map[name])
+        return tuple(header[name]['shape'])
+
+    def dtype(self, name: str) -> str:
+        """ The name of the dtype of a tensor, e.g. 'float32' (reads only the header of its shard) """
+        header, _ = self._header(self.weight_map[name])
+        return DTYPE_NAMES[header[name]['dtype']]
+
+    def to_dict(self) -> tp.Dict[str, tp.Any]:
+        """ All the tensors, reading the ones not read yet concurrently """
+        missing = [name for name in self.weight_map if name not in self._tensors]
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.saver.max_workers) as pool:
+                for future in [pool.submit(self.__getitem__, name) for name in missing]:
+                    future.result()
+        return {name: self._tensors[name] for name in self.weight_map}
+
+    def _load(self, name: str):
+        shard_key = self.weight_map[name]
+        header, data_start = self._header(shard_key)
+        info = header[name]
+        begin, end = info['data_offsets']
+
+        mmap = self._mmap(shard_key)
+        if mmap is not None:
+            data = mmap[data_start + begin: data_start + end]
+        else:
+            data = bytearray(end - begin)
+            with BufferWriter(data) as f:
+                self.saver.remote.download_range(f, shard_key, data_start + begin, data_start + end,
+                                                 params=self.download_params)
+                if f.tell() != len(data):
+                    raise SaverError(f'Truncated shard {shard_key}')
+
+        return _from_bytes(data, DTYPE_NAMES[info['dtype']], info['shape'], self.metadata.get('format', 'pt'))
+
+    def _header(self, shard_key: str) -> tp.Tuple[dict, int]:
+        """ The header of a shard and the offset of its data """
+        if shard_key not in self._headers:
+            remote = self.saver.remote
+            with remote.open(shard_key, block_size=2 ** 16, params=self.download_params) as f:
+                size, = HEADER_SIZE.unpack(f.read(HEADER_SIZE.size))
+                header = json.loads(f.read(size))
+            with self._lock:
+                self._headers[shard_key] = (header, HEADER_SIZE.size + size)
+        return self._headers[shard_key]
+
+    def _mmap(self, shard_key: str):
+        from remotools.remotes.local import LocalRemote
+
+        if not (self.saver.mmap and isinstance(self.saver.remote, LocalRemote)):
+            return None
+
+        with self._lock:
+            if shard_key not in self._mmaps:
+                import numpy as np
+                # Copy-on-write, so that the tensors are writable without modifying the file
+                self._mmaps[shard_key] = np.memmap(self.saver.remote._full_path(shard_key), dtype=np.uint8, mode='c')
+            return self._mmaps[shard_key]
+
+
+def _tensor_bytes(value) -> tp.Tuple[str, str, tp.List[int], tp.Any]:
+    """ The format ('pt' or 'np'), dtype name, shape and a uint8 array of the bytes of a tensor """
+    import numpy as np
+
+    if isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value)
+        if array.dtype.name not in DTYPES:
+            raise SaverError(f'Unsupported dtype {array.dtype}')
+        # np.ascontiguousarray turns scalars into 1-d arrays, so the shape is taken from the value
+        return 'np', array.dtype.name, list(value.shape), array.reshape(-1).view(np.uint8)
+
+    import torch
+    if not isinstance(value, torch.Tensor):
+        raise SaverError(f'Only tensors and numpy arrays can be saved in a sharded checkpoint '
+                         f'(got {type(value).__name__})')
+
+    tensor = value.detach().cpu().contiguous()
+    dtype = str(tensor.dtype).replace('torch.', '')
+    if dtype not in DTYPES:
+        raise SaverError(f'Unsupported dtype {tensor.dtype}')
+    return 'pt', dtype, list(tensor.shape), tensor.reshape(-1).view(torch.uint8).numpy()
+
+
+def _from_bytes(data, dtype: str, shape: tp.List[int], fmt: str):
+    """ A tensor (or array) over the given bytes, without copying them """
+    import numpy as np
+
+    array = np.frombuffer(data, dtype=np.uint8)
+    if fmt == 'np':
+        return array.view(np.dtype(dtype)).reshape(shape)
+
+    import torch
+    if array.size == 0:
+        return torch.empty(shape, dtype=getattr(torch, dtype))
+    return torch.from_numpy(array).view(getattr(torch, dtype)).reshape(shape)
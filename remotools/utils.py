@@ -1,7 +1,15 @@
+import errno
 import hashlib
 import io
 import os
+import shutil
+import queue
+import sys
+import tempfile
+import threading
+import typing as tp
 from contextlib import contextmanager
+from shutil import copyfileobj
 from itertools import chain
 
 
@@ -25,20 +33,26 @@ def keep_position(f, enabled=True):
             f.seek(position)
 
 
+def new_hash(algorithm='md5'):
+    """Returns a new hash object of the given algorithm (from either hashlib or xxhash)."""
+
+    # Allow for XXH algorithms
+    if algorithm.startswith('xxh'):
+        try:
+            import xxhash
+            return getattr(xxhash, algorithm)()
+        except ImportError as e:
+            raise ImportError("It appears that the xxhash package is not installed. Reinstall the package with "
+                              "xxhash as an extra option.") from e
+
+    return hashlib.new(algorithm)
+
+
 def compute_hash(f, algorithm='md5', buffer_size=8192, keep_stream_position=True):
     """Compute hash of file using :attr:`algorithm`."""
 
     with keep_position(f, enabled=keep_stream_position):
-        # Allow for XXH algorithms
-        if algorithm.startswith('xxh'):
-            try:
-                import xxhash
-                hash_fn = getattr(xxhash, algorithm)()
-            except ImportError as e:
-                raise ImportError("It appears that the xxhash package is not installed. Reinstall the package with "
-                                  "xxhash as an extra option.") from e
-        else:
-            hash_fn = hashlib.new(algorithm)
+        hash_fn = new_hash(algorithm)
 
         # Compute the hash over the object
         while True:
@@ -50,6 +64,106 @@ def compute_hash(f, algorithm='md5', buffer_size=8192, keep_stream_position=True
         return hash_fn.hexdigest()
 
 
+def is_seekable(f) -> bool:
+    try:
+        return f.seekable()
+    except (AttributeError, ValueError):
+        return False
+
+
+def is_readable(f) -> bool:
+    try:
+        return f.readable()
+    except (AttributeError, ValueError):
+        return False
+
+
+def spool(f, max_size: int = 2 ** 26):
+    """
+    Returns a seekable stream with the remaining contents of f, positioned at its start. Seekable streams
+    are returned as they are, the others are copied into a temporary file (kept in memory up to max_size bytes).
+    """
+    if is_seekable(f):
+        return f
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=max_size)
+    copyfileobj(f, spooled)
+    spooled.seek(0)
+    return spooled
+
+
+# ioctl request cloning a file on copy-on-write file systems (Linux: btrfs, XFS, overlayfs, etc.)
+FICLONE = 0x40049409
+CLONE_METHODS = ('reflink', 'hardlink', 'copy')
+
+
+def clone_file(src: str, dst: str, methods: tp.Sequence[str] = CLONE_METHODS) -> str:
+    """
+    Place a file at dst with the contents of src, using the first of the given methods that works:
+    'reflink' shares the blocks of src copy-on-write (on file systems supporting it), 'hardlink' links dst to src
+    (so they are the same file) and 'copy' copies the contents. dst is replaced atomically if it exists.
+
+    Returns the method used.
+    """
+    directory = os.path.dirname(os.path.abspath(dst))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(dst), suffix='.tmp')
+    os.close(fd)
+    os.unlink(tmp)
+
+    error = None
+    try:
+        for method in methods:
+            try:
+                if method == 'reflink':
+                    _reflink(src, tmp)
+                elif method == 'hardlink':
+                    os.link(src, tmp)
+                elif method == 'copy':
+                    shutil.copyfile(src, tmp)
+                else:
+                    raise ValueError(f'Unknown method {method} (must be one of {CLONE_METHODS})')
+
+            except OSError as e:
+                # Unsupported by the file system, or across file systems
+                error = e
+                if os.path.lexists(tmp):
+                    os.unlink(tmp)
+                continue
+
+            os.replace(tmp, dst)
+            return method
+
+    finally:
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+
+    raise OSError(errno.ENOTSUP, f'Could not clone {src} into {dst} with any of {tuple(methods)}') from error
+
+
+def _reflink(src: str, dst: str):
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOTSUP, 'Reflinks are only supported on Linux')
+
+    import fcntl
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+
+
+def estimate_size(obj) -> int:
+    """ Estimate the size in bytes of an object's payload """
+
+    # numpy arrays, torch tensors and the like
+    nbytes = getattr(obj, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+
+    if isinstance(obj, (bytes, bytearray, str)):
+        return len(obj)
+
+    # sys.getsizeof is only shallow, but some libraries (e.g. pandas) report the deep size through __sizeof__
+    return sys.getsizeof(obj)
+
+
 def to_path(hid: str, width: int, depth: int):
     w = width
     d = depth
@@ -104,3 +218,347 @@ class DictProxy:
         for key in dct:
             self[key] = dct[key]
 
+
+class BufferReader(io.RawIOBase):
+    """
+    A read-only, seekable binary stream over a bytes-like object.
+
+    The underlying buffer is not copied. Closing the stream releases the view of the buffer.
+    """
+
+    def __init__(self, buffer):
+        super(BufferReader, self).__init__()
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+
+    def __len__(self):
+        return self._view.nbytes
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._view.nbytes + offset
+        else:
+            raise ValueError(f'Invalid whence ({whence})')
+
+        if position < 0:
+            raise ValueError(f'Negative seek position {position}')
+
+        self._position = position
+        return position
+
+    def read(self, size=-1):
+        start = min(self._position, self._view.nbytes)
+        end = self._view.nbytes if size is None or size < 0 else min(start + size, self._view.nbytes)
+        self._position = end
+        return self._view[start:end].tobytes()
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        start = min(self._position, self._view.nbytes)
+        with memoryview(b) as view, view.cast('B') as target:
+            n = min(target.nbytes, self._view.nbytes - start)
+            target[:n] = self._view[start:start + n]
+        self._position = start + n
+        return n
+
+    def getbuffer(self):
+        return self._view
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._view.release()
+            except BufferError:
+                # Someone still holds a view of the buffer (e.g. an array created from getbuffer()).
+                # It will be released together with it.
+                pass
+        super(BufferReader, self).close()
+
+
+class BufferWriter(BufferReader):
+    """
+    A readable, writable and seekable binary stream over a preallocated, writable bytes-like object
+    (e.g. a bytearray). Writing past the end of the buffer raises a ValueError.
+    """
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        with memoryview(b) as view, view.cast('B') as data:
+            n = data.nbytes
+            end = self._position + n
+            if end > self._view.nbytes:
+                raise ValueError(f'Writing {n} bytes at {self._position} exceeds the buffer size {self._view.nbytes}')
+            self._view[self._position: end] = data
+        self._position = end
+        return n
+
+
+class ConcatReader(io.RawIOBase):
+    """
+    A read-only, seekable binary stream over the concatenation of several bytes-like objects.
+
+    The buffers are not copied (nor joined), so large buffers can be uploaded as they are.
+    """
+
+    def __init__(self, buffers):
+        super(ConcatReader, self).__init__()
+        self._views = [memoryview(buffer).cast('B') for buffer in buffers]
+        self._starts = []
+        self._size = 0
+        for view in self._views:
+            self._starts.append(self._size)
+            self._size += view.nbytes
+        self._position = 0
+
+    def __len__(self):
+        return self._size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f'Invalid whence ({whence})')
+
+        if position < 0:
+            raise ValueError(f'Negative seek position {position}')
+
+        self._position = position
+        return position
+
+    def readinto(self, b):
+        with memoryview(b) as view, view.cast('B') as target:
+            n = 0
+            for start, source in zip(self._starts, self._views):
+                if n == target.nbytes:
+                    break
+
+                # Skip the buffers before the current position
+                offset = self._position + n - start
+                if offset >= source.nbytes:
+                    continue
+
+                count = min(target.nbytes - n, source.nbytes - offset)
+                target[n: n + count] = source[offset: offset + count]
+                n += count
+
+        self._position += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            for view in self._views:
+                try:
+                    view.release()
+                except BufferError:
+                    pass
+        super(ConcatReader, self).close()
+
+
+class IteratorReader(io.RawIOBase):
+    """
+    A read-only, non-seekable binary stream over an iterator of bytes-like chunks.
+
+    The chunks are produced on demand, so only one of them is held at a time. Closing the stream closes the
+    iterator (if it's a generator).
+    """
+
+    def __init__(self, chunks: tp.Iterable):
+        super(IteratorReader, self).__init__()
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b'')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def readinto(self, b):
+        with memoryview(b) as view, view.cast('B') as target:
+            while not self._chunk.nbytes:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    return 0
+                self._chunk = memoryview(chunk).cast('B')
+
+            n = min(target.nbytes, self._chunk.nbytes)
+            target[:n] = self._chunk[:n]
+            self._chunk = self._chunk[n:]
+
+        self._position += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._chunk = memoryview(b'')
+            if hasattr(self._chunks, 'close'):
+                self._chunks.close()
+        super(IteratorReader, self).close()
+
+
+class _PipeReader(io.RawIOBase):
+
+    def __init__(self, chunks: queue.Queue, state: dict):
+        super(_PipeReader, self).__init__()
+        self._chunks = chunks
+        self._state = state
+        self._chunk = memoryview(b'')
+        self._position = 0
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def readinto(self, b):
+        with memoryview(b) as view, view.cast('B') as target:
+            while not self._chunk.nbytes:
+                if self._eof:
+                    return 0
+
+                chunk = self._chunks.get()
+                if chunk is None:
+                    self._eof = True
+                    if self._state['error'] is not None:
+                        raise self._state['error']
+                    return 0
+                self._chunk = memoryview(chunk)
+
+            n = min(target.nbytes, self._chunk.nbytes)
+            target[:n] = self._chunk[:n]
+            self._chunk = self._chunk[n:]
+
+        self._position += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            # Unblock the writer
+            self._state['closed'] = True
+            while True:
+                try:
+                    self._chunks.get_nowait()
+                except queue.Empty:
+                    break
+        super(_PipeReader, self).close()
+
+
+class _PipeWriter(io.RawIOBase):
+
+    def __init__(self, chunks: queue.Queue, state: dict):
+        super(_PipeWriter, self).__init__()
+        self._chunks = chunks
+        self._state = state
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def write(self, b):
+        with memoryview(b) as view:
+            n = view.nbytes
+            if n:
+                self._put(view.tobytes())
+        self._position += n
+        return n
+
+    def abort(self, error: BaseException):
+        """ Close the pipe, making the reader raise the given error after the data written so far """
+        self._state['error'] = error
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._put(None)
+            except BrokenPipeError:
+                pass
+        super(_PipeWriter, self).close()
+
+    def _put(self, chunk):
+        while True:
+            if self._state['closed']:
+                raise BrokenPipeError('The reading end of the pipe was closed')
+            try:
+                self._chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+
+def pipe(max_chunks: int = 16) -> tp.Tuple[io.RawIOBase, io.RawIOBase]:
+    """
+    Returns the reading and writing ends of an in-memory pipe, to be used from different threads.
+
+    At most max_chunks written chunks are buffered, after which writes block until the reader catches up.
+    Writing to a pipe whose reader is closed raises a BrokenPipeError.
+    """
+    chunks = queue.Queue(maxsize=max_chunks)
+    state = dict(closed=False, error=None)
+    return _PipeReader(chunks, state), _PipeWriter(chunks, state)
+
+
+@contextmanager
+def streaming_download(remote, key: str, params: tp.Optional[dict] = None, progress=False, max_chunks: int = 16):
+    """
+    Downloads a key in a background thread, yielding a stream from which the downloaded bytes can be read as
+    they arrive. The memory usage is bounded by the pipe between the two (see pipe(...)).
+
+    Errors of the download are raised by the stream once the bytes received before them are read.
+    Leaving the context early stops the download.
+    """
+    reader, writer = pipe(max_chunks=max_chunks)
+
+    def download():
+        try:
+            remote.download(writer, key, progress=progress, params=params)
+        except BrokenPipeError:
+            writer.close()
+        except BaseException as e:
+            writer.abort(e)
+        else:
+            writer.close()
+
+    thread = threading.Thread(target=download, name=f'streaming_download({key})', daemon=True)
+    thread.start()
+    try:
+        yield reader
+    finally:
+        reader.close()
+        thread.join()
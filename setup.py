@@ -30,8 +30,7 @@ setup(
         'xxhash>=2.0.0',
         'requests>=2.24.0',
         'sqlitedict>= 1.7.0',
-        'cachetools',
-        'scalpl'
+        'cachetools'
     ],
 
     extras_require={
@@ -45,6 +44,7 @@ setup(
         "plyfile": ['plyfile>=0.7.2'],
         "yaml": ['ruamel.yaml>=0.16.12'],
         "pandas": ['pandas>=0.24.2'],
+        "arrow": ['pyarrow>=10.0.0'],
         "torch": ['pytorch']
     }
 )